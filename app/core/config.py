@@ -10,14 +10,98 @@ class Settings(BaseSettings):
     VLM_API_BASE: str
     VLM_MODEL_NAME: str
 
+    # 一次导入中同时进行的 VLM 请求数上限
+    VLM_MAX_CONCURRENCY: int = 4
+
+    # 发送给 VLM 前的图片预处理 (在进程池中执行): 长边缩放到 IMAGE_MAX_DIMENSION 以内，
+    # 重新编码为 IMAGE_OUTPUT_FORMAT (JPEG / WEBP) 并去除元数据；结果比原图更大时发送原图
+    IMAGE_PREPROCESS_ENABLED: bool = True
+    IMAGE_MAX_DIMENSION: int = 2048
+    IMAGE_OUTPUT_FORMAT: str = "JPEG"
+    IMAGE_QUALITY: int = 85
+    IMAGE_GRAYSCALE: bool = False  # 灰度可以进一步减小体积，但气泡颜色常用于区分发送者，默认关闭
+    IMAGE_PREPROCESS_WORKERS: int = 2
+    IMAGE_TOKEN_PATCH_SIZE: int = 28  # 估算视觉 token 时每个 patch 的边长 (像素)
+
+    # 长截图切片: 高宽比超过 TILE_MIN_ASPECT 的截图切成高宽比为 TILE_ASPECT、相邻片重叠 TILE_OVERLAP_RATIO 的多片，
+    # 各片并发解析 (共享 VLM_MAX_CONCURRENCY) 后拼接，去掉重叠部分重复的气泡
+    TILE_ENABLED: bool = True
+    TILE_MIN_ASPECT: float = 3.0
+    TILE_ASPECT: float = 2.0
+    TILE_OVERLAP_RATIO: float = 0.2
+
+    # 多图批量解析 (默认关闭): 把连续 VLM_BATCH_SIZE 张截图放进同一个请求，共享一份解析提示词；
+    # 返回结果无法按图拆分时退回逐张解析。1 表示每张图单独请求
+    VLM_BATCH_SIZE: int = 1
+
+    # VLM 解析结果的磁盘缓存 (BLOB_PATH/vlm_cache)，按 (图片 Hash, 模型, 提示词) 命中，超过上限时 LRU 淘汰
+    VLM_CACHE_ENABLED: bool = True
+    VLM_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+
+    # 导入聊天记录导出文件时每次去重 + 批量追加的消息条数
+    EXPORT_IMPORT_CHUNK_SIZE: int = 5000
+
+    # 后台任务 (导入 / 分析) 的任务表 (SQLite 文件) 和同时执行的任务数
+    JOBS_DB_PATH: str = "./data/jobs.db"
+    JOB_WORKERS: int = 2
+
+    # 截图重叠去重: 每张截图开头与前文 (上一张截图，第一张则为 Profile 最新的 OVERLAP_PROFILE_TAIL 条消息)
+    # 重叠至少 OVERLAP_MIN_MESSAGES 条时才去掉，避免 "好的" 之类的单条短消息被误判为重复
+    OVERLAP_DEDUP_ENABLED: bool = True
+    OVERLAP_MIN_MESSAGES: int = 2
+    OVERLAP_PROFILE_TAIL: int = 50
+
+    # 近似重复截图检测: 上传的截图与该 Profile 已导入的截图 (及同批次之前的截图) 的 dHash
+    # 汉明距离不超过 NEAR_DUPLICATE_MAX_DISTANCE 时在 near_duplicates 中报告，默认仍然解析。
+    # NEAR_DUPLICATE_HASH_SIZE=16 即 256 位指纹
+    NEAR_DUPLICATE_ENABLED: bool = True
+    NEAR_DUPLICATE_HASH_SIZE: int = 16
+    NEAR_DUPLICATE_MAX_DISTANCE: int = 10
+    # 布局相同、文字不同的两张聊天截图 dHash 也可能只相差几位，因此跳过 VLM 解析需要显式开启
+    # (NEAR_DUPLICATE_SKIP)，并且 dHash 距离不超过 NEAR_DUPLICATE_SKIP_MAX_DISTANCE、两张图缩小到
+    # NEAR_DUPLICATE_VERIFY_WIDTH 宽后逐像素比较，明显不同的像素占比不超过 NEAR_DUPLICATE_MAX_PIXEL_DIFF
+    NEAR_DUPLICATE_SKIP: bool = False
+    NEAR_DUPLICATE_SKIP_MAX_DISTANCE: int = 4
+    NEAR_DUPLICATE_VERIFY_WIDTH: int = 256
+    NEAR_DUPLICATE_MAX_PIXEL_DIFF: float = 0.001
+
     # LLM (对话辅助) 配置
     LLM_API_KEY: str
     LLM_API_BASE: str
     LLM_MODEL_NAME: str
 
+    # LLM / VLM 调用计量账本 (SQLite)，保留最近 METERING_RETENTION_DAYS 天
+    METERING_ENABLED: bool = True
+    METERING_DB_PATH: str = "./data/metering.db"
+    METERING_RETENTION_DAYS: int = 30
+    # 每个 Profile 每天 (本地日期) 的默认 Token 预算，0 表示不限；可按 Profile 单独设置 (PUT /usage/budget/{id})
+    # 超出后新的后台任务被拒绝 (429)，已排队的任务推迟到第二天
+    DAILY_TOKEN_BUDGET: int = 0
+
     # 数据存储路径
     DATA_PATH: str = "./data/profiles"
 
+    # 存储后端: "json" (默认，DATA_PATH 下的文件) 或 "sqlite" (SQLITE_PATH)
+    # 从 JSON 迁移: python -m app.services.sqlite_storage
+    STORAGE_BACKEND: str = "json"
+    SQLITE_PATH: str = "./data/chat_helper.db"
+
+    # 旁路 blob 存储根目录 (VLM 原始输出等按 Hash 寻址的大块数据，不放进 Profile 文件)
+    BLOB_PATH: str = "./data/blobs"
+    # 上传截图存储 (BLOB_PATH/images) 的总大小上限，超出后淘汰最久未访问的图片；0 表示不限制
+    IMAGE_STORE_MAX_BYTES: int = 2 * 1024 * 1024 * 1024
+
+    # 进程内已解析对象 (Profile / 事件 / 洞察 / 画像) 的 LRU 缓存条目上限，0 表示关闭
+    PROFILE_CACHE_SIZE: int = 64
+
+    # 消息追加日志 (messages_{id}.log.jsonl) 超过该字节数时由后台线程做一次合并压缩
+    MESSAGE_LOG_COMPACT_BYTES: int = 4 * 1024 * 1024
+
+    # write-behind (仅 JSON 后端): 开启后事件 / 洞察 / 画像 / 目录的整体写入先缓冲在内存中，
+    # 每隔 WRITE_BEHIND_FLUSH_INTERVAL 秒合并落盘一次；关闭服务时会强制落盘
+    WRITE_BEHIND_ENABLED: bool = False
+    WRITE_BEHIND_FLUSH_INTERVAL: float = 2.0
+
 
 # 创建一个全局可用的配置实例
 settings = Settings()
\ No newline at end of file
@@ -1,7 +1,7 @@
 import uuid
 import datetime
 from pydantic import BaseModel, Field
-from typing import Literal, Optional, List, Dict, Set
+from typing import Any, Literal, Optional, List, Dict, Set, Tuple
 
 # VLM解析结果的内部结构
 class VLMMessageItem(BaseModel):
@@ -15,6 +15,13 @@ class VLMMessageItem(BaseModel):
 class VLMResponseModel(BaseModel):
     messages: List[VLMMessageItem]
 
+# [新增] 多图批量解析时 VLM 返回的格式: 每张截图一组消息，index 为截图在请求中的编号 (从 1 开始)
+class VLMImageMessages(VLMResponseModel):
+    index: int
+
+class VLMBatchResponseModel(BaseModel):
+    images: List[VLMImageMessages]
+
 
 # 存储在JSON文件中的标准Message格式
 class Message(BaseModel):
@@ -27,7 +34,8 @@ class Message(BaseModel):
     # --- 阶段一新增字段 ---
     source_image_hash: Optional[str] = None  # 关联到源截图
     is_editable: bool = False  # 标记此消息是否为VLM失败的模板
-    raw_vlm_output: Optional[str] = None  # 存储VLM原始输出，用于调试
+    raw_vlm_output: Optional[str] = None  # [旧字段] VLM原始输出；新数据不再内联，保存时会移入旁路存储
+    raw_vlm_ref: Optional[str] = None  # [新增] VLM原始输出在旁路存储中的键 (即截图的 source_image_hash)
     auto_filled_date: bool = Field(default=False)
     auto_filled_time: bool = Field(default=False)
 
@@ -50,19 +58,180 @@ class Profile(BaseModel):
     messages: List[Message] = []
     events: List[Event] = []
 
+# [新增] Profile 目录 (catalog) 中的元数据摘要，列表页只读取它，不加载消息内容
+class ProfileSummary(BaseModel):
+    profile_id: str
+    profile_name: str
+    user_name: str = "我"
+    opponent_name: str
+    created_at: datetime.datetime
+
+    message_count: int = 0
+    event_count: int = 0
+    min_date: Optional[datetime.date] = None  # 最早数据的本地日期
+    max_date: Optional[datetime.date] = None  # 最晚数据的本地日期
+    last_activity: Optional[datetime.datetime] = None  # 最近一次写入的时间
+
+class ProfileSummaryPage(BaseModel):
+    items: List[ProfileSummary]
+    total: int
+    offset: int
+    limit: int
+
+# [新增] Profile 统计信息，每次写入时增量维护；日期范围 / 概览查询直接读取，不加载消息
+class DayCount(BaseModel):
+    messages: int = 0
+    events: int = 0
+
+class ProfileStats(BaseModel):
+    profile_id: str
+    message_count: int = 0
+    event_count: int = 0
+    # 消息和事件的时间范围分开记录 (UTC)，事件列表整体保存时只需重算事件部分
+    message_min_ts: Optional[datetime.datetime] = None
+    message_max_ts: Optional[datetime.datetime] = None
+    event_min_ts: Optional[datetime.datetime] = None
+    event_max_ts: Optional[datetime.datetime] = None
+    # 合并后的范围
+    min_timestamp: Optional[datetime.datetime] = None
+    max_timestamp: Optional[datetime.datetime] = None
+    min_date: Optional[datetime.date] = None  # 本地日期
+    max_date: Optional[datetime.date] = None
+    day_counts: Dict[datetime.date, DayCount] = Field(default_factory=dict)  # 本地日期 -> 当天条数 (升序)
+    updated_at: Optional[datetime.datetime] = None
+
+# [新增] 消息 / 事件的游标分页结果 (items 始终按时间升序)
+class MessagePage(BaseModel):
+    items: List[Message]
+    next_cursor: Optional[str] = None  # 沿同一方向继续翻页时传入的游标
+    has_more: bool = False
+
+class EventPage(BaseModel):
+    items: List[Event]
+    next_cursor: Optional[str] = None
+    has_more: bool = False
+
 class VLMUsage(BaseModel):
         prompt_tokens: int = 0
         completion_tokens: int = 0
         total_tokens: int = 0
+        cached: bool = False  # [新增] 结果来自解析缓存 (或共享了进行中的同一调用)，没有产生新的调用
+
+# [新增] 图片预处理 (缩放 / 重新编码 / 去除元数据) 前后的对比
+class ImagePreprocessStats(BaseModel):
+        original_bytes: int
+        processed_bytes: int
+        original_size: Tuple[int, int]  # (宽, 高)
+        processed_size: Tuple[int, int]
+        mime_type: str  # 实际发送给模型的格式
+        estimated_tokens_before: int = 0  # 按视觉 patch 数粗略估计
+        estimated_tokens_after: int = 0
+
+        @property
+        def bytes_saved(self) -> int:
+                return self.original_bytes - self.processed_bytes
+
+        @property
+        def tokens_saved(self) -> int:
+                return self.estimated_tokens_before - self.estimated_tokens_after
 
 class ImportResult(BaseModel):
         messages: List[Message]
         usage: VLMUsage
         image_hash: str  # 告诉前端这张图的hash
+        latency_ms: float = 0.0  # [新增] 这张图的 VLM 解析耗时 (不含排队等待)
+        preprocess: Optional[ImagePreprocessStats] = None  # [新增] 图片预处理的效果
+        duplicates_removed: int = 0  # [新增] 开头与前文 (上一张截图 / Profile 最新消息) 重叠而被去掉的消息数
+        tile_count: int = 1  # [新增] 长截图切片解析的片数 (1 表示整张解析)
+        batch_size: int = 1  # [新增] 与其他截图合并在同一个 VLM 请求中解析时，该请求包含的截图数
+
+# [新增] 与已导入截图 (或同批次之前的截图) 近似重复的上传
+class NearDuplicate(BaseModel):
+        index: int  # 在上传的 files 中的位置
+        image_hash: str
+        duplicate_of: str  # 与之近似的截图的 Hash
+        distance: int  # dHash 汉明距离
+        pixel_difference: Optional[float] = None  # 逐像素比较中明显不同的像素占比 (未比较时为 None)
+        skipped: bool = False  # 为 True 表示确认是同一张截图，没有调用 VLM
 
 class BatchImportResponse(BaseModel):
         results: List[ImportResult]
         total_usage: VLMUsage
+        total_latency_ms: float = 0.0  # [新增] 整批解析的墙钟耗时
+        bytes_saved: int = 0  # [新增] 预处理节省的上传字节数
+        estimated_tokens_saved: int = 0  # [新增] 预处理节省的视觉 token (估计值)
+        cache_hits: int = 0  # [新增] 命中解析缓存的图片数
+        duplicates_removed: int = 0  # [新增] 截图重叠去重共去掉的消息数
+        near_duplicates: List[NearDuplicate] = []  # [新增] 检测到的近似重复截图
+
+# [新增] 导入聊天记录导出文件 (不经过 VLM) 的结果
+class ChatExportImportResponse(BaseModel):
+        format: str  # 实际使用的格式 (text / csv / json)
+        records: int  # 解析出的消息数
+        imported: int  # 追加到 Profile 的消息数 (dry_run 时为将要追加的数量)
+        duplicates_skipped: int  # 与 Profile 中已有消息重复而跳过的数量
+        invalid_records: int  # 无法解析的记录 (缺少时间 / 内容等)
+        senders: Dict[str, str] = {}  # 导出文件中的发送者 -> 映射结果 ("User 1" / "User 2" / "system")
+        first_timestamp: Optional[datetime.datetime] = None
+        last_timestamp: Optional[datetime.datetime] = None
+        elapsed_ms: float = 0.0
+        dry_run: bool = False
+
+# [新增] 后台任务 (导入截图 / 增量分析)，持久化在任务表中，服务重启后未完成的任务会恢复执行
+JobKind = Literal["import_screenshots", "analyze_profile"]
+JobStatus = Literal["queued", "running", "succeeded", "failed", "cancelled"]
+
+class Job(BaseModel):
+    job_id: str = Field(default_factory=lambda: f"job_{uuid.uuid4().hex}")
+    kind: JobKind
+    profile_id: str
+    status: JobStatus = "queued"
+    params: Dict[str, Any] = Field(default_factory=dict)  # 执行所需的输入 (如导入的图片 Hash)，恢复时据此重新执行
+    progress_done: int = 0  # 已完成的单元数 (图片数 / 天数)
+    progress_total: int = 0
+    result: Optional[Dict[str, Any]] = None  # 成功时的结果 (与对应同步接口的响应结构相同)
+    error: Optional[str] = None
+    attempts: int = 0  # 开始执行的次数 (中断后恢复会再次增加)
+    created_at: datetime.datetime = Field(default_factory=lambda: datetime.datetime.now(datetime.timezone.utc))
+    started_at: Optional[datetime.datetime] = None
+    finished_at: Optional[datetime.datetime] = None
+
+class JobPage(BaseModel):
+    items: List[Job]
+    total: int
+    offset: int
+    limit: int
+
+# [新增] LLM / VLM 调用计量的汇总 (分组列之外的键为 None)
+class UsageBucket(BaseModel):
+    day: Optional[datetime.date] = None
+    profile_id: Optional[str] = None
+    endpoint: Optional[str] = None
+    model: Optional[str] = None
+    client: Optional[str] = None  # "llm" / "vlm"
+    calls: int = 0
+    failed_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    total_latency_ms: float = 0.0
+    avg_latency_ms: float = 0.0
+    max_latency_ms: float = 0.0
+
+class UsageReport(BaseModel):
+    group_by: List[str]
+    since: Optional[datetime.date] = None
+    until: Optional[datetime.date] = None
+    items: List[UsageBucket]
+
+class BudgetStatus(BaseModel):
+    profile_id: str
+    day: datetime.date  # 本地日期
+    daily_token_budget: int  # 0 表示不限
+    used_tokens: int
+    remaining_tokens: Optional[int] = None  # 不限时为 None
+    exceeded: bool = False
+    custom: bool = False  # 是否为该 Profile 单独设置的预算 (否则为默认值 DAILY_TOKEN_BUDGET)
 
 class UpdateProfileNamesRequest(BaseModel):
     profile_name: Optional[str] = None
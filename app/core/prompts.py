@@ -71,6 +71,25 @@ VLM_CHAT_PARSE_PROMPT = """
 ```
 """
 
+# [新增] 多图批量解析: 接在 VLM_CHAT_PARSE_PROMPT 之后，每张截图前有 "第 N 张截图" 的标注
+VLM_BATCH_PARSE_PROMPT = """
+# 多张截图 (覆盖上面第 5 条的输出格式)
+本次请求按顺序包含 {count} 张截图，每张前面标注了编号 (1 到 {count})。
+* **逐张独立解析**: 每张截图单独按上面的要求解析，日期只从该截图本身识别。
+* **不要跨图去重**: 相邻截图内容重叠时，每张截图中的消息都要完整输出。
+* **输出格式**: 你的回答**必须**是一个JSON对象，**只能**包含一个 `images` 键，按编号顺序为每张截图给出一项，
+  `index` 为截图编号，`messages` 的格式与上面的示例相同，没有消息的截图返回空数组。
+
+```json
+{{
+  "images": [
+    {{"index": 1, "messages": [...]}},
+    {{"index": 2, "messages": [...]}}
+  ]
+}}
+```
+"""
+
 # 用于纯文本事件
 LLM_EVENT_SUMMARIZE_PROMPT = """
 你是一位精干的事件总结分析师。
@@ -1,6 +1,10 @@
-from fastapi import FastAPI
-from app.routers import import_router, profile_router, event_router, persona_router, assist_router, timeline_router
+from fastapi import Depends, FastAPI
+from app.routers import import_router, profile_router, event_router, persona_router, assist_router, timeline_router, job_router, usage_router
 from app.core.config import settings
+from app.services.storage_backend import get_storage
+from app.services.image_preprocess import shutdown_executor
+from app.services import job_service, metering
+import asyncio
 import os
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -13,7 +17,8 @@ print("--- main.py: Imports completed ---")
 app = FastAPI(
     title="Chat Helper API",
     description="社交军师 Agent 后端服务",
-    version="0.1.0"
+    version="0.1.0",
+    dependencies=[Depends(metering.tag_request)]  # [新增] 为每个请求中的模型调用打上接口 / Profile 标签
 )
 
 # --- main.py: FastAPI app created ---
@@ -41,6 +46,8 @@ app.include_router(event_router.router) # 确保事件路由被包含
 app.include_router(persona_router.router) # 2. 包含新路由
 app.include_router(assist_router.router)
 app.include_router(timeline_router.router)
+app.include_router(job_router.router)
+app.include_router(usage_router.router)
 
 # --- main.py: Routers included ---
 print("--- main.py: Routers included ---")
@@ -52,6 +59,24 @@ async def on_startup():
     print("--- main.py: Startup event triggered ---")
     os.makedirs(settings.DATA_PATH, exist_ok=True)
     print(f"--- main.py: Data directory '{settings.DATA_PATH}' ensured. ---")
+    # 初始化存储后端 (配置错误时在启动阶段就失败)
+    storage = get_storage()
+    print(f"--- main.py: Storage backend '{settings.STORAGE_BACKEND}' initialized. ---")
+    # 旧格式数据的迁移只在启动时进行，读取路径不再修改存储
+    migrated = await asyncio.to_thread(storage.migrate)
+    if migrated:
+        print(f"--- main.py: Migrated {migrated} profiles from the legacy format. ---")
+    # 启动后台任务 worker，并恢复上次未完成的任务
+    await job_service.start_workers()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # 先停止后台任务 (执行中的任务标记为排队中，下次启动时恢复)，再落盘
+    await job_service.stop_workers()
+    # 停止 write-behind 后台线程，再把缓冲中尚未落盘的数据写入磁盘
+    get_storage().close()
+    print("--- main.py: Storage flushed on shutdown. ---")
+    shutdown_executor()
 
 @app.get("/")
 async def root():
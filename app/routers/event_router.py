@@ -1,4 +1,4 @@
-import hashlib
+import asyncio
 from typing import Optional
 from fastapi import APIRouter, Depends, File, Form, UploadFile, HTTPException, Path, Body
 from pydantic import BaseModel, Field
@@ -39,7 +39,7 @@ async def analyze_event(
     image_hash: Optional[str] = None
     if file:
         image_bytes = await file.read()
-        image_hash = hashlib.sha256(image_bytes).hexdigest()
+        image_hash = await asyncio.to_thread(profile_service.save_uploaded_image, image_bytes)  # [修改] 存入图片存储，之后可按 Hash 重新分析
 
     summary = await event_service.analyze_event_inputs(
         description=description,
@@ -57,6 +57,31 @@ async def analyze_event(
     return AnalyzeEventResponse(summary=summary, original_image_hash=image_hash)
 
 
+class ReprocessEventRequest(BaseModel):
+    image_hash: str
+    description: Optional[str] = None
+
+
+@router.post("/{profile_id}/reprocess", response_model=AnalyzeEventResponse)
+async def reprocess_event(
+        profile_id: str = Path(...),
+        request: ReprocessEventRequest = Body(...)
+):
+    """
+    [新增] 按 Hash 重新分析之前上传过的事件图片，无需重新上传。
+    """
+    profile = profile_service.get_profile_summary(profile_id)
+    image_bytes = profile_service.get_uploaded_image(request.image_hash)
+
+    summary = await event_service.analyze_event_inputs(
+        description=request.description,
+        image_bytes=image_bytes,
+        user_name=profile.user_name,
+        opponent_name=profile.opponent_name
+    )
+    return AnalyzeEventResponse(summary=summary, original_image_hash=request.image_hash)
+
+
 # --- API 2: 保存事件 ---
 
 class SaveEventRequest(BaseModel):
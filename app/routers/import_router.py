@@ -1,10 +1,14 @@
-import hashlib  # <-- 1. 确保导入 hashlib
-from typing import List
-from fastapi import APIRouter, File, UploadFile, Path, HTTPException
+import asyncio
+import time
+from typing import List, Literal, Optional, Tuple
+from fastapi import APIRouter, Body, File, UploadFile, Path, Query, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 
 # 2. 导入所有需要的新模型
-from app.core.models import Message, ImportResult, BatchImportResponse, VLMUsage
-from app.services import vlm_service, profile_service
+from app.core.models import BatchImportResponse, ChatExportImportResponse, ImportResult, Job, NearDuplicate
+from app.core.config import settings
+from app.services import vlm_service, profile_service, job_service, overlap_dedup, near_duplicate, chat_export
 
 router = APIRouter(prefix="/import", tags=["Import (Phase 1)"])
 
@@ -12,44 +16,191 @@ router = APIRouter(prefix="/import", tags=["Import (Phase 1)"])
 @router.post("/{profile_id}/upload_screenshots", response_model=BatchImportResponse)
 async def upload_screenshots(
     profile_id: str = Path(..., description="要导入的Profile ID"),
-    files: List[UploadFile] = File(..., description="聊天记录截图")
+    files: List[UploadFile] = File(..., description="聊天记录截图"),
+    force: bool = Query(False, description="与已导入截图近似重复的图片也强制解析")
 ):
     """
     上传一张或多张截图进行VLM解析。
 
-    此API将 *依次* 解析每张图片，并返回所有结果的聚合。
+    [修改] 此API *并发* 解析所有新图片 (同时进行的请求数受 VLM_MAX_CONCURRENCY 限制)，
+    结果仍按上传顺序返回，并附带每张图片和整批的耗时。
+    [新增] 每张截图开头与上一张截图 (第一张则为 Profile 最新的消息) 重叠的消息会被去掉，见 overlap_dedup。
+    [新增] 与已导入截图近似重复 (重新截取 / 重新压缩) 的图片在 near_duplicates 中报告；
+    只有开启 NEAR_DUPLICATE_SKIP 且确认内容相同时才不调用 VLM。
     """
-    try:
-        profile = profile_service.get_profile(profile_id)
-    except HTTPException as e:
-        # 如果 profile_id 无效，提前返回
-        raise e
+    uploads, near_duplicates = await _read_new_uploads(profile_id, files, force)
+    started = time.perf_counter()
+    batch_results = await vlm_service.parse_images_concurrently(
+        [(image_hash, image_bytes) for _, image_hash, image_bytes in uploads]
+    )
+    batch_results = overlap_dedup.merge_overlaps(batch_results, overlap_dedup.load_profile_tail(profile_id))
+    return vlm_service.summarize_batch(batch_results, started).model_copy(update={"near_duplicates": near_duplicates})
 
-    batch_results = []
-    total_usage = VLMUsage()  # 3. 初始化总消耗
 
+class ImportStreamEvent(BaseModel):
+    """流式导入的一行 (NDJSON)。type 为 result 时携带一张图的 ImportResult，最后一行为 summary"""
+    type: Literal["result", "summary"]
+    index: Optional[int] = None  # 这张图在上传的 files 中的位置 (结果按完成顺序到达)
+    result: Optional[ImportResult] = None
+    summary: Optional[BatchImportResponse] = None  # 汇总信息，其中 results 为空
+
+
+@router.post("/{profile_id}/upload_screenshots/stream")
+async def upload_screenshots_stream(
+    profile_id: str = Path(..., description="要导入的Profile ID"),
+    files: List[UploadFile] = File(..., description="聊天记录截图"),
+    force: bool = Query(False, description="与已导入截图近似重复的图片也强制解析")
+):
+    """
+    [新增] upload_screenshots 的流式版本 (NDJSON，每行一个 ImportStreamEvent)。
+    每张图的 VLM 调用一完成就发送它的结果，前端不必等待整批解析结束；最后一行是 Token 用量等汇总。
+    已处理过的图片 (以及本批次中重复的图片) 同样被跳过，不产生结果行。
+    [新增] 开启重叠去重时，一张图的重叠要等它前面的图都解析完才能确定，因此结果按上传顺序发送 (仍是尽早发送)。
+    """
+    uploads, near_duplicates = await _read_new_uploads(profile_id, files, force)  # 在开始流式响应前读完上传内容
+    merger = None
+    if settings.OVERLAP_DEDUP_ENABLED:
+        merger = overlap_dedup.OverlapMerger(overlap_dedup.load_profile_tail(profile_id))
+
+    async def generate():
+        started = time.perf_counter()
+        results = []
+        images = [(image_hash, image_bytes) for _, image_hash, image_bytes in uploads]
+        async for position, result in vlm_service.iter_parsed_images(images):
+            for ready_position, ready in (merger.add(position, result) if merger else [(position, result)]):
+                results.append(ready)
+                yield ImportStreamEvent(type="result", index=uploads[ready_position][0], result=ready).model_dump_json() + "\n"
+        summary = vlm_service.summarize_batch(results, started).model_copy(
+            update={"results": [], "near_duplicates": near_duplicates}
+        )
+        yield ImportStreamEvent(type="summary", summary=summary).model_dump_json() + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@router.post("/{profile_id}/upload_screenshots/jobs", response_model=Job, status_code=202)
+async def submit_upload_job(
+    profile_id: str = Path(..., description="要导入的Profile ID"),
+    files: List[UploadFile] = File(..., description="聊天记录截图"),
+    force: bool = Query(False, description="与已导入截图近似重复的图片也强制解析")
+):
+    """
+    [新增] upload_screenshots 的后台任务版本: 截图存入图片存储后立即返回任务，
+    通过 GET /jobs/{job_id} 轮询进度，完成后任务的 result 与 upload_screenshots 的响应结构相同。
+    """
+    uploads, near_duplicates = await _read_new_uploads(profile_id, files, force)
+    return job_service.submit_job("import_screenshots", profile_id, {
+        "image_hashes": [image_hash for _, image_hash, _ in uploads],
+        "dedup_with_profile": True,
+        "near_duplicates": [item.model_dump() for item in near_duplicates],
+    })
+
+
+async def _read_new_uploads(
+    profile_id: str,
+    files: List[UploadFile],
+    force: bool = False
+) -> Tuple[List[Tuple[int, str, bytes]], List[NearDuplicate]]:
+    """
+    读取上传的截图，返回需要解析的 (在 files 中的下标, image_hash, image_bytes) 和检测到的近似重复。
+    跳过*之前已保存*的图片 (以及本批次中重复的图片)；
+    [新增] 开启 NEAR_DUPLICATE_SKIP 时，确认与已导入截图内容相同的图片也跳过，force 为 True 时仍然解析 (见 near_duplicate)。
+    """
+    # [修改] 只检查 Profile 是否存在，不加载全部消息
+    if not profile_service.profile_exists(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    # [修改] 先计算所有图片的 Hash，再一次性批量查询哪些是新的
+    # [新增] 图片同时存入内容寻址存储，之后可以按 Hash 重新解析而无需再次上传
+    uploaded = []
     for file in files:
         image_bytes = await file.read()
-        image_hash = hashlib.sha256(image_bytes).hexdigest()
+        image_hash = await asyncio.to_thread(profile_service.save_uploaded_image, image_bytes)  # 写盘 (及可能的淘汰) 不阻塞事件循环
+        uploaded.append((image_hash, image_bytes))
+    new_hashes = set(profile_service.filter_new_sources(profile_id, [image_hash for image_hash, _ in uploaded]))
+
+    uploads = []
+    for index, (image_hash, image_bytes) in enumerate(uploaded):
+        if image_hash in new_hashes:
+            new_hashes.discard(image_hash)
+            uploads.append((index, image_hash, image_bytes))
+    # [已删除] 不再调用 add_processed_source
+    return await near_duplicate.filter_near_duplicates(profile_id, uploads, force)
 
-        # [保留] 检查是否*之前已保存*
-        if profile_service.check_if_source_processed(profile_id, image_hash):
-            continue
 
-        # 1. 调用VLM (返回 messages, usage)
-        parsed_messages, usage = await vlm_service.parse_image_to_messages(image_bytes, image_hash)
+class ReprocessRequest(BaseModel):
+    image_hashes: List[str]
+    refresh: bool = False  # 为 True 时忽略解析缓存，强制重新调用模型
 
-        # 2. 累加Token
-        total_usage.prompt_tokens += usage.prompt_tokens
-        # ... (累加 usage) ...
 
-        # 3. 添加入结果列表
-        batch_results.append(ImportResult(
-            messages=parsed_messages,
-            usage=usage,
-            image_hash=image_hash
-        ))
+@router.post("/{profile_id}/reprocess", response_model=BatchImportResponse)
+async def reprocess_screenshots(
+    profile_id: str = Path(..., description="要导入的Profile ID"),
+    request: ReprocessRequest = Body(...)
+):
+    """
+    [新增] 按 Hash 重新解析已存储的截图 (例如改进提示词之后)，无需重新上传。
+    与上传不同，这里不会跳过已处理过的图片；返回结构与 upload_screenshots 相同，由前端确认后再保存。
+    重叠去重只在这批截图之间进行 (它们的消息通常已经在 Profile 中了)。
+    """
+    if not profile_service.profile_exists(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    # 先读取所有图片，缺失的图片在调用 VLM 之前就报错
+    image_hashes = list(dict.fromkeys(request.image_hashes))
+    images = [(image_hash, profile_service.get_uploaded_image(image_hash)) for image_hash in image_hashes]
+
+    started = time.perf_counter()
+    batch_results = await vlm_service.parse_images_concurrently(images, use_cache=not request.refresh)
+    batch_results = overlap_dedup.merge_overlaps(batch_results)
+    return vlm_service.summarize_batch(batch_results, started)
+
+
+@router.post("/{profile_id}/reprocess/jobs", response_model=Job, status_code=202)
+async def submit_reprocess_job(
+    profile_id: str = Path(..., description="要导入的Profile ID"),
+    request: ReprocessRequest = Body(...)
+):
+    """[新增] reprocess 的后台任务版本"""
+    if not profile_service.profile_exists(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return job_service.submit_job(
+        "import_screenshots", profile_id,
+        {"image_hashes": list(dict.fromkeys(request.image_hashes)), "refresh": request.refresh}
+    )
 
-        # 4. [已删除] 不再调用 add_processed_source
 
-    return BatchImportResponse(results=batch_results, total_usage=total_usage)
\ No newline at end of file
+@router.post("/{profile_id}/chat_export", response_model=ChatExportImportResponse)
+def import_chat_export(
+    profile_id: str = Path(..., description="要导入的Profile ID"),
+    file: UploadFile = File(..., description="聊天记录导出文件 (微信 / QQ 纯文本、CSV 或 JSON)"),
+    export_format: chat_export.ExportFormat = Query("auto", alias="format", description="文件格式，auto 按扩展名 / 内容判断"),
+    self_names: List[str] = Query([], description="导出文件中代表“我”的发送者名称 (映射为 User 1)，默认为 Profile 的 user_name"),
+    encoding: str = Query("utf-8-sig", description="文件编码 (如 GBK 导出的 QQ 记录)"),
+    dry_run: bool = Query(False, description="只解析并返回统计和发送者映射，不写入")
+):
+    """
+    [新增] 直接导入聊天软件导出的聊天记录，不经过 VLM。
+    文件逐行流式解析，按块与 Profile 中已有的消息 (包括截图导入的) 去重后批量追加，见 chat_export。
+    """
+    return chat_export.import_chat_export(
+        profile_id, file.file, filename=file.filename, export_format=export_format,
+        self_names=self_names, encoding=encoding, dry_run=dry_run
+    )
+
+
+class RawVLMOutputResponse(BaseModel):
+    image_hash: str
+    raw_vlm_output: str
+
+
+@router.get("/raw_output/{image_hash}", response_model=RawVLMOutputResponse)
+def get_raw_vlm_output(image_hash: str = Path(..., description="截图的 source_image_hash (即消息的 raw_vlm_ref)")):
+    """
+    [调试] 按需获取某张截图的 VLM 原始输出。
+    原始输出不再内联在每条消息里，消息只保留 raw_vlm_ref 引用。
+    """
+    return RawVLMOutputResponse(
+        image_hash=image_hash,
+        raw_vlm_output=profile_service.get_raw_vlm_output(image_hash)
+    )
\ No newline at end of file
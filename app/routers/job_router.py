@@ -0,0 +1,35 @@
+from typing import Optional
+from fastapi import APIRouter, Path, Query
+
+from app.core.models import Job, JobPage, JobStatus
+from app.services import job_service
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+# 提交任务的接口在各自的路由中:
+#   POST /import/{profile_id}/upload_screenshots/jobs
+#   POST /import/{profile_id}/reprocess/jobs
+#   POST /persona/{profile_id}/analyze_all/jobs
+
+
+@router.get("", response_model=JobPage)
+def list_jobs(
+    profile_id: Optional[str] = Query(None, description="只列出该 Profile 的任务"),
+    status: Optional[JobStatus] = Query(None),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """列出后台任务，最新提交的在前"""
+    return job_service.list_jobs(profile_id, status, offset, limit)
+
+
+@router.get("/{job_id}", response_model=Job)
+def get_job(job_id: str = Path(...)):
+    """轮询任务的状态、进度和结果"""
+    return job_service.get_job(job_id)
+
+
+@router.post("/{job_id}/cancel", response_model=Job)
+async def cancel_job(job_id: str = Path(...)):
+    """取消排队中或执行中的任务；已结束的任务原样返回"""
+    return await job_service.cancel_job(job_id)
@@ -5,8 +5,8 @@ from typing import Optional, List, Dict  # [修改] 导入 List, Dict
 import datetime
 
 # [修改] 导入 ContextualInsight
-from app.core.models import UserPersona, OpponentPersona, ContextualInsight
-from app.services import persona_service, profile_service
+from app.core.models import UserPersona, OpponentPersona, ContextualInsight, Job
+from app.services import persona_service, profile_service, job_service
 
 router = APIRouter(prefix="/persona", tags=["Persona (Phase 2)"])
 
@@ -58,7 +58,9 @@ async def update_user_persona_summary(
     """
     根据用户输入，更新“用户画像”的自我总结
     """
-    return await persona_service.generate_user_persona_summary(profile_id, request.description)
+    # [新增] 同一 Profile 的画像更新串行执行，避免 LLM 调用期间的并发写入互相覆盖
+    async with profile_service.async_profile_lock(profile_id):
+        return await persona_service.generate_user_persona_summary(profile_id, request.description)
 
 
 # --- Opponent Persona ---
@@ -81,7 +83,8 @@ async def update_opponent_persona_info(
     """
     根据用户输入，提取并更新“对方画像”的基础信息
     """
-    return await persona_service.extract_opponent_basic_info(profile_id, request.description)
+    async with profile_service.async_profile_lock(profile_id):
+        return await persona_service.extract_opponent_basic_info(profile_id, request.description)
 
 
 # --- Date Range & Insights ---
@@ -118,7 +121,9 @@ async def trigger_incremental_analysis(profile_id: str = Path(...)):
     这是一个潜在的耗时操作。
     """
     try:
-        result = await persona_service.analyze_profile_incrementally(profile_id)
+        # [新增] 分析期间持有 Profile 的异步锁，同一 Profile 的分析 / 画像更新不会并发交错
+        async with profile_service.async_profile_lock(profile_id):
+            result = await persona_service.analyze_profile_incrementally(profile_id)
 
         # [修改] 确保 new_insights 已经是 JSON 兼容的字典列表
         # persona_service 现在应该返回处理好的列表
@@ -137,4 +142,15 @@ async def trigger_incremental_analysis(profile_id: str = Path(...)):
         print(f"!!! Unexpected error during incremental analysis trigger for {profile_id}: {e}")
         import traceback
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"分析过程中发生意外错误: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"分析过程中发生意外错误: {e}")
+
+
+@router.post("/{profile_id}/analyze_all/jobs", response_model=Job, status_code=202)
+async def submit_incremental_analysis_job(profile_id: str = Path(...)):
+    """
+    [新增] analyze_all 的后台任务版本: 立即返回任务，通过 GET /jobs/{job_id} 轮询进度 (按天计)，
+    完成后任务的 result 与 analyze_all 的响应结构相同。
+    """
+    if not profile_service.profile_exists(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return job_service.submit_job("analyze_profile", profile_id)
\ No newline at end of file
@@ -1,7 +1,11 @@
 from typing import List, Optional
-from fastapi import APIRouter, Body, Path # 确保导入 Path
+from fastapi import APIRouter, Body, Path, Query # 确保导入 Path
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from app.core.models import Profile, Message, UpdateProfileNamesRequest
+from app.core.models import (
+    Profile, Message, UpdateProfileNamesRequest, ProfileSummary, ProfileSummaryPage, MessagePage, EventPage,
+    ProfileStats
+)
 from app.services import profile_service
 
 router = APIRouter(prefix="/profiles", tags=["Profiles"])
@@ -37,6 +41,24 @@ def get_all_profiles():
     """
     return profile_service.list_all_profiles()
 
+@router.get("/summary", response_model=ProfileSummaryPage)
+def get_profile_summaries(
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """
+    [新增] 分页获取 Profile 元数据摘要 (名称、消息/事件数、日期范围、最近活动)。
+    数据来自写入时维护的 Profile 目录，不会加载任何消息内容。
+    """
+    return profile_service.list_profile_summaries(offset=offset, limit=limit)
+
+@router.get("/cache/stats")
+def get_cache_stats():
+    """
+    [调试] 查看 Profile 缓存的命中 / 未命中统计
+    """
+    return profile_service.get_cache_stats()
+
 @router.get("/{profile_id}", response_model=Profile)
 def get_profile(profile_id: str = Path(..., description="要获取的Profile ID")):
     """
@@ -44,6 +66,52 @@ def get_profile(profile_id: str = Path(..., description="要获取的Profile ID"
     """
     return profile_service.get_profile(profile_id)
 
+@router.get("/{profile_id}/export")
+def export_profile(profile_id: str = Path(..., description="要导出的Profile ID")):
+    """
+    [新增] 流式导出完整 Profile (JSON 结构与 GET /profiles/{profile_id} 相同)。
+    消息按天从存储读取并逐批发送，不会在内存中构建整个 Profile。
+    """
+    return StreamingResponse(profile_service.stream_profile_json(profile_id), media_type="application/json")
+
+@router.get("/{profile_id}/header", response_model=ProfileSummary)
+def get_profile_header(profile_id: str = Path(..., description="要获取的Profile ID")):
+    """
+    [新增] 获取 Profile 的头部信息 (名称、消息/事件数、日期范围)，不包含任何消息和事件。
+    """
+    return profile_service.get_profile_summary(profile_id)
+
+@router.get("/{profile_id}/stats", response_model=ProfileStats)
+def get_profile_stats(profile_id: str = Path(..., description="要获取的Profile ID")):
+    """
+    [新增] 获取 Profile 的统计概览: 消息/事件数、最早/最晚时间、每天的条数。写入时维护，不加载消息。
+    """
+    return profile_service.get_profile_stats(profile_id)
+
+@router.get("/{profile_id}/messages", response_model=MessagePage)
+def get_message_page(
+    profile_id: str = Path(..., description="要获取消息的Profile ID"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor；为空时从最新 (backward) 或最早 (forward) 开始"),
+    limit: int = Query(100, ge=1, le=1000),
+    direction: str = Query("backward", pattern="^(forward|backward)$")
+):
+    """
+    [新增] 按游标分页获取消息 (每页内按时间升序)，客户端只拉取需要渲染的窗口。
+    """
+    return profile_service.get_message_page(profile_id, cursor=cursor, limit=limit, direction=direction)
+
+@router.get("/{profile_id}/events", response_model=EventPage)
+def get_event_page(
+    profile_id: str = Path(..., description="要获取事件的Profile ID"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    limit: int = Query(100, ge=1, le=1000),
+    direction: str = Query("backward", pattern="^(forward|backward)$")
+):
+    """
+    [新增] 按游标分页获取事件 (每页内按时间升序)。
+    """
+    return profile_service.get_event_page(profile_id, cursor=cursor, limit=limit, direction=direction)
+
 @router.post("/{profile_id}/messages", response_model=Profile)
 def save_edited_messages(
     profile_id: str = Path(..., description="要保存消息的Profile ID"),
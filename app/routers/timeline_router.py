@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Path, Depends, HTTPException
+from fastapi import APIRouter, Path, HTTPException
+from fastapi.responses import StreamingResponse
 from typing import List
 import datetime
 
@@ -6,40 +7,49 @@ import datetime
 from app.services import timeline_service
 from app.services.timeline_service import DateNode # 导入已修正的 DateNode
 
-# (需要从 models.py 导入 Profile 和从 profile_service 导入 get_profile)
-from app.core.models import Profile
 from app.services import profile_service
 
 router = APIRouter(prefix="/timeline", tags=["Timeline (Visualization)"])
 
-# 复用 assist_router 中的依赖注入，确保 profile_id 有效
-def get_profile_dependency(profile_id: str = Path(...)) -> Profile:
-    try:
-        # get_profile 会在找不到时自动抛出 404
-        return profile_service.get_profile(profile_id)
-    except HTTPException as e:
-        # 重新抛出 HTTPException (如 404 Not Found)
-        raise e
-    except Exception as e:
-        # 捕获其他意外的加载错误
-        raise HTTPException(status_code=500, detail=f"Failed to load profile: {e}")
-
 
 @router.get("/{profile_id}", response_model=List[DateNode])
-async def get_timeline_data(
-    # FastAPI 会先运行 get_profile_dependency
-    profile: Profile = Depends(get_profile_dependency)
-):
+async def get_timeline_data(profile_id: str = Path(...)):
     """
     [新增] 获取用于时间线可视化的聚合数据。
     数据已按日期（大节点）预先分组，
     每个日期下的项目（聊天/事件）已按时间排好序。
+    [修改] 只检查 Profile 是否存在，不再为了校验 profile_id 加载全部消息和事件。
     """
+    if not profile_service.profile_exists(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
     try:
-        timeline_nodes = timeline_service.get_timeline_data_for_profile(profile.profile_id)
+        timeline_nodes = timeline_service.get_timeline_data_for_profile(profile_id)
         return timeline_nodes
     except Exception as e:
         print(f"!!! UNEXPECTED ERROR in /timeline: {e}")
         import traceback
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"生成时间线时发生意外错误: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"生成时间线时发生意外错误: {e}")
+
+
+@router.get("/{profile_id}/stream")
+def stream_timeline_data(profile_id: str = Path(...)):
+    """
+    [新增] 流式获取时间线数据 (NDJSON: 每行一个 DateNode，最新的日期在前)。
+    日期节点逐个生成、逐个发送，首字节时间和内存占用不随历史长度增长。
+    生成过程中出错时连接被中断 (不会正常结束)，客户端应把读取失败视为时间线不完整。
+    """
+    if not profile_service.profile_exists(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    def generate():
+        try:
+            for node in timeline_service.iter_date_nodes(profile_id):
+                yield node.model_dump_json() + "\n"
+        except Exception as e:
+            # 响应头已经发出，无法再返回 500: 记录错误后继续抛出，让服务器中断连接，
+            # 客户端会收到不完整的分块响应，而不是一个看起来完整、实际被截断的时间线
+            print(f"!!! ERROR while streaming timeline for {profile_id}: {e}")
+            raise
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
\ No newline at end of file
@@ -0,0 +1,46 @@
+import datetime
+from typing import Optional
+from fastapi import APIRouter, Body, Path, Query, HTTPException
+from pydantic import BaseModel, Field
+
+from app.core.models import BudgetStatus, UsageReport
+from app.services import metering, profile_service
+
+router = APIRouter(prefix="/usage", tags=["Usage"])
+
+
+class UpdateBudgetRequest(BaseModel):
+    daily_token_budget: Optional[int] = Field(None, ge=0, description="每日 Token 预算，0 表示不限；null 表示恢复默认值")
+
+
+@router.get("", response_model=UsageReport)
+def get_usage(
+    group_by: str = Query("day", description=f"分组列，逗号分隔，可选: {', '.join(metering.GROUP_COLUMNS)}"),
+    profile_id: Optional[str] = Query(None),
+    since: Optional[datetime.date] = Query(None, description="起始本地日期 (含)"),
+    until: Optional[datetime.date] = Query(None, description="结束本地日期 (含)")
+):
+    """按天 / Profile / 接口 / 模型汇总 LLM 和 VLM 调用的 Token 用量、调用次数和耗时"""
+    columns = [column.strip() for column in group_by.split(",") if column.strip()]
+    invalid = [column for column in columns if column not in metering.GROUP_COLUMNS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid group_by column(s): {', '.join(invalid)}")
+    return UsageReport(
+        group_by=columns, since=since, until=until,
+        items=metering.get_ledger().aggregate(columns, profile_id, since, until)
+    )
+
+
+@router.get("/budget/{profile_id}", response_model=BudgetStatus)
+def get_budget(profile_id: str = Path(...)):
+    """该 Profile 今天的 Token 预算和已用量"""
+    return metering.get_budget_status(profile_id)
+
+
+@router.put("/budget/{profile_id}", response_model=BudgetStatus)
+def update_budget(profile_id: str = Path(...), request: UpdateBudgetRequest = Body(...)):
+    """单独设置该 Profile 的每日 Token 预算"""
+    if not profile_service.profile_exists(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    metering.get_ledger().set_budget(profile_id, request.daily_token_budget)
+    return metering.get_budget_status(profile_id)
@@ -105,20 +105,22 @@ class AssistService:
             sorted_dates_with_data = []
 
             try:
-                profile = profile_service.get_profile(self.profile_id)
-                all_raw_items: List[Union[Message, Event]] = profile.messages + profile.events
-                if all_raw_items:
-                    # 按日期分组
-                    for item in all_raw_items:
-                        item_local_date = item.timestamp.astimezone(LOCAL_TZ).date()
-                        all_items_map[item_local_date].append(item)
+                # [修改] 先从按天索引取出有数据的日期 (最新在前)，不再扫描全部历史
+                sorted_dates_with_data = sorted(profile_service.get_active_dates(self.profile_id), reverse=True)
+                if sorted_dates_with_data:
+                    latest_data_date = sorted_dates_with_data[0]
+                    if len(sorted_dates_with_data) > 1:
+                        previous_data_date = sorted_dates_with_data[1]
 
-                    # 获取有数据的日期并排序 (最新在前)
-                    sorted_dates_with_data = sorted(all_items_map.keys(), reverse=True)
-                    if sorted_dates_with_data:
-                        latest_data_date = sorted_dates_with_data[0]
-                        if len(sorted_dates_with_data) > 1:
-                            previous_data_date = sorted_dates_with_data[1]
+                # 只读取需要展示详细日志的日期 (今天 / 最近活动日 / 上一个活动日)，并按日期分组
+                needed_dates = {d for d in (today_date, latest_data_date, previous_data_date) if d is not None}
+                all_raw_items: List[Union[Message, Event]] = (
+                    profile_service.get_messages_for_dates(self.profile_id, needed_dates)
+                    + profile_service.get_events_for_dates(self.profile_id, needed_dates)
+                )
+                for item in all_raw_items:
+                    item_local_date = item.timestamp.astimezone(LOCAL_TZ).date()
+                    all_items_map[item_local_date].append(item)
 
             except Exception as e:
                 print(f"Error loading profile items for context: {e}")
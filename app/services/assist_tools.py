@@ -51,22 +51,10 @@ def get_recent_chat_history(profile_id: str, dates: List[str]) -> str:
         if not target_dates:
              return json.dumps({"error": "No valid dates provided after parsing."})
 
-        # 2. 加载 Profile 数据
-        profile = profile_service.get_profile(profile_id)
-
-        # 3. 筛选指定日期的消息
-        selected_messages = []
-        for msg in profile.messages:
-            # 将消息时间戳转换为本地日期
-            msg_local_date = msg.timestamp.astimezone(LOCAL_TZ).date()
-            # 检查本地日期是否存在于目标日期集合中
-            if msg_local_date in target_dates:
-                selected_messages.append(msg)
-
-        # 4. 按时间戳排序筛选出的消息
-        selected_messages.sort(key=lambda m: profile_service._normalize_to_utc(m.timestamp))
-
-        # 5. 返回 JSON 字符串
+        # 2. [修改] 通过按天索引只读取目标日期的消息 (已按时间戳排序)
+        selected_messages = profile_service.get_messages_for_dates(profile_id, target_dates)
+
+        # 3. 返回 JSON 字符串
         return json.dumps([m.model_dump(mode='json') for m in selected_messages])
 
     except Exception as e:
@@ -79,13 +67,9 @@ def get_recent_events(profile_id: str, days: int = 7) -> str:
     获取最近 N 天的 *详细* 离线事件 (Events)。(保持不变)
     """
     try:
-        events = profile_service.load_events(profile_id)
         cutoff_date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
-        recent_events = [
-            e for e in events
-            if profile_service._normalize_to_utc(e.timestamp) >= cutoff_date
-        ]
-        recent_events.sort(key=lambda e: e.timestamp)
+        # [修改] 由存储后端按时间范围查询 (已按时间排序)
+        recent_events = profile_service.get_events_between(profile_id, start=cutoff_date)
         return json.dumps([e.model_dump(mode='json') for e in recent_events])
     except Exception as e:
         return json.dumps({"error": f"Failed to load events: {e}"})
@@ -96,11 +80,8 @@ def search_insights_by_keyword(profile_id: str, keyword: str) -> str:
     根据关键词搜索 *所有* 历史洞察 (Insights) 的摘要。(保持不变)
     """
     try:
-        insights = profile_service.load_insights(profile_id)
-        found_insights = [
-            i for i in insights
-            if keyword.lower() in i.summary.lower()
-        ]
+        # [修改] 由存储后端执行关键词搜索
+        found_insights = profile_service.search_insights(profile_id, keyword)
         found_insights.sort(key=lambda i: i.analysis_date, reverse=True)
         return json.dumps([i.model_dump(mode='json') for i in found_insights])
     except Exception as e:
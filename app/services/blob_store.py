@@ -0,0 +1,193 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from app.core.config import settings
+
+# 键只允许字母、数字、下划线和连字符 (通常是 SHA-256 十六进制串)，防止路径穿越
+_KEY_PATTERN = re.compile(r"[0-9A-Za-z_-]{4,128}")
+
+
+class BlobStore:
+    """
+    按键 (内容 Hash) 寻址的旁路文件存储。
+    每个 blob 是一个独立文件，按键的前两级字符分片存放: {root}/ab/cd/abcd....
+    写入使用 临时文件 + rename，读取方不会看到写了一半的文件。
+    """
+
+    def __init__(self, root: str, max_bytes: int = 0):
+        self.root = root
+        # max_bytes > 0 时按总大小淘汰: 超出后删除最久未访问的 blob，直到降到上限的 90%
+        self.max_bytes = max_bytes
+        self._size_lock = threading.Lock()
+        # path -> 大小，按访问顺序排列 (最久未访问的在前)。首次需要时按 mtime 扫描一次，之后增量维护，
+        # 淘汰时只需从头部弹出，不必每次写入都遍历整个目录
+        self._index: Optional["OrderedDict[str, int]"] = None
+        self._total_bytes = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        if not _KEY_PATTERN.fullmatch(key):
+            raise ValueError(f"Invalid blob key: {key!r}")
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def get(self, key: str) -> Optional[bytes]:
+        """读取 blob，不存在时返回 None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if self.max_bytes:
+            self._touch(path)
+        return data
+
+    def put(self, key: str, data: bytes, overwrite: bool = True) -> bool:
+        """写入 blob。overwrite 为 False 且已存在时不写入。返回是否写入。"""
+        path = self._path(key)
+        if not overwrite and os.path.exists(path):
+            if self.max_bytes:
+                self._touch(path)  # 重复写入同一内容也算一次访问
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.max_bytes:
+            self._load_index()  # 在修改文件之前完成首次扫描，避免重复计入
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if self.max_bytes:
+            self._record(path, len(data))
+        return True
+
+    def delete(self, key: str):
+        path = self._path(key)
+        if self.max_bytes:
+            self._load_index()
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        if self.max_bytes:
+            with self._size_lock:
+                self._total_bytes -= self._index.pop(path, 0)
+
+    # --- 按大小淘汰 ---
+
+    def _touch(self, path: str):
+        """以 mtime 记录最近访问时间 (atime 在很多文件系统上不可靠，重启后按 mtime 恢复访问顺序)"""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._size_lock:
+            if self._index is not None and path in self._index:
+                self._index.move_to_end(path)
+
+    def _iter_blobs(self):
+        """遍历所有 blob 文件，返回 (path, stat)；跳过写入中的临时文件"""
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    yield path, os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+    def _load_index(self):
+        with self._size_lock:
+            if self._index is None:
+                blobs = sorted(self._iter_blobs(), key=lambda item: item[1].st_mtime_ns)
+                self._index = OrderedDict((path, st.st_size) for path, st in blobs)
+                self._total_bytes = sum(self._index.values())
+
+    def total_bytes(self) -> int:
+        self._load_index()
+        with self._size_lock:
+            return self._total_bytes
+
+    def _record(self, path: str, size: int):
+        """记录刚写入的 blob (移到访问顺序末尾)，超出上限时淘汰"""
+        with self._size_lock:
+            self._total_bytes += size - self._index.pop(path, 0)
+            self._index[path] = size
+            over_limit = self._total_bytes > self.max_bytes
+        if over_limit:
+            self._evict(keep=path)
+
+    def _evict(self, keep: Optional[str] = None):
+        """删除最久未访问的 blob，直到总大小不超过上限的 90% (keep 是刚写入的文件，不删除)"""
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        with self._size_lock:
+            while self._total_bytes > target and self._index:
+                path, size = self._index.popitem(last=False)
+                if path == keep:
+                    self._index[path] = size  # 只剩刚写入的文件
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self._total_bytes -= size
+                evicted += 1
+            total = self._total_bytes
+        if evicted:
+            print(f"BlobStore {self.root}: evicted {evicted} blobs, {total} bytes remaining")
+
+
+_raw_output_store: Optional[BlobStore] = None
+
+
+def get_raw_output_store() -> BlobStore:
+    """VLM 原始输出的旁路存储，以截图的 source_image_hash 为键"""
+    global _raw_output_store
+    if _raw_output_store is None:
+        _raw_output_store = BlobStore(os.path.join(settings.BLOB_PATH, "vlm_raw"))
+    return _raw_output_store
+
+
+_image_store: Optional[BlobStore] = None
+
+
+def get_image_store() -> BlobStore:
+    """上传截图的内容寻址存储，以图片的 SHA-256 为键，所有 Profile 共享 (同一张图只存一份)"""
+    global _image_store
+    if _image_store is None:
+        _image_store = BlobStore(os.path.join(settings.BLOB_PATH, "images"), max_bytes=settings.IMAGE_STORE_MAX_BYTES)
+    return _image_store
+
+
+_phash_store: Optional[BlobStore] = None
+
+
+def get_phash_store() -> BlobStore:
+    """上传截图的感知哈希 (dHash 十六进制串)，以图片的 SHA-256 为键，上传时计算一次"""
+    global _phash_store
+    if _phash_store is None:
+        _phash_store = BlobStore(os.path.join(settings.BLOB_PATH, "phash"))
+    return _phash_store
+
+
+_vlm_cache_store: Optional[BlobStore] = None
+
+
+def get_vlm_cache_store() -> BlobStore:
+    """VLM 解析结果缓存，键由图片 Hash、模型名、提示词 Hash 等组合而成 (见 vlm_service)"""
+    global _vlm_cache_store
+    if _vlm_cache_store is None:
+        _vlm_cache_store = BlobStore(os.path.join(settings.BLOB_PATH, "vlm_cache"), max_bytes=settings.VLM_CACHE_MAX_BYTES)
+    return _vlm_cache_store
@@ -0,0 +1,546 @@
+"""
+[新增] 导入聊天软件导出的聊天记录文件，不经过 VLM。
+
+支持三种格式，逐行 (逐条) 流式解析，内存占用与文件大小无关:
+- text: 微信 / QQ 风格的纯文本导出。每条消息以 "日期 时间 发送者" (或 "发送者 日期 时间") 的一行开头，
+  后面一行或多行是内容；第一条消息之前的文件头 (消息分组、消息对象等) 被忽略。
+- csv: 带表头，按常见列名识别时间 / 发送者 / 内容 / 类型 / 是否本人发送的列 (如 WeChatMsg 导出的 CSV)。
+- json: JSON Lines，或 JSON 数组 (也可以是顶层对象中的消息数组)，每个对象的键与 CSV 的列名相同。
+
+发送者映射为 "User 1" (我) / "User 2" (对方) / "system"。解析出的消息按块 (EXPORT_IMPORT_CHUNK_SIZE 条)
+与 Profile 中同一时间范围、导入开始前已有的消息去重 (时间精确到分钟 + 发送者 + 归一化文本，
+与截图导入的消息同样可以对上)，再批量追加。
+"""
+import codecs
+import csv
+import datetime
+import io
+import json
+import re
+import time
+import uuid
+from collections import Counter
+from typing import IO, Any, Dict, Iterable, Iterator, List, Literal, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.core.models import ChatExportImportResponse, Message
+from app.services import profile_service
+from app.services.overlap_dedup import normalize_text
+from app.services.storage_backend import LOCAL_TZ, normalize_to_utc
+
+ExportFormat = Literal["auto", "text", "csv", "json"]
+
+
+class ExportRecord(NamedTuple):
+    """导出文件中的一条消息 (发送者尚未映射)"""
+    timestamp: datetime.datetime  # UTC
+    sender: str
+    text: str
+    content_type: Optional[str] = None
+    is_self: Optional[bool] = None  # 导出文件直接标明是否本人发送时 (如 IsSender 列) 优先于名称映射
+
+
+# --- 字段解析 ---
+
+_DATE = r"\d{4}[-/.年]\d{1,2}[-/.月]\d{1,2}日?"
+_TIME = r"\d{1,2}:\d{2}(?::\d{2})?"
+_DATETIME_RE = re.compile(
+    r"^\s*(\d{4})[-/.年](\d{1,2})[-/.月](\d{1,2})日?(?:[\sT]+(\d{1,2}):(\d{2})(?::(\d{2}))?(?:\.\d+)?)?\s*$"
+)
+
+
+def parse_timestamp(value: Any) -> Optional[datetime.datetime]:
+    """
+    解析导出文件中的时间，返回 UTC 时间。支持 Unix 时间戳 (秒或毫秒)、"YYYY-MM-DD HH:MM[:SS]" 及其 / . 年月日 变体、
+    带时区的 ISO 8601。没有时区的时间按本地时区理解。
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value.strip())
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        seconds = value / 1000 if value > 1e11 else value
+        try:
+            return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+    if not isinstance(value, str):
+        return None
+
+    match = _DATETIME_RE.match(value)
+    if match:
+        year, month, day, hour, minute, second = (int(part) if part else 0 for part in match.groups())
+        try:
+            local = datetime.datetime(year, month, day, hour, minute, second, tzinfo=LOCAL_TZ)
+        except ValueError:
+            return None
+        return local.astimezone(datetime.timezone.utc)
+    try:
+        parsed = datetime.datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=LOCAL_TZ)
+    return parsed.astimezone(datetime.timezone.utc)
+
+
+_CONTENT_TYPES = {"text", "image", "transfer", "emoji", "system", "unknown", "video"}
+
+# 微信消息类型编号 (WeChatMsg 等工具导出的 Type 列)
+_WECHAT_TYPES = {1: "text", 3: "image", 34: "unknown", 43: "video", 47: "emoji", 49: "unknown",
+                 10000: "system", 10002: "system"}
+
+# 导出文件中代替非文本内容的占位符
+_PLACEHOLDERS = (
+    ("[图片]", "image"), ("[表情]", "emoji"), ("[动画表情]", "emoji"), ("[视频]", "video"),
+    ("[视频通话]", "video"), ("[转账]", "transfer"), ("[红包]", "transfer"),
+    ("[语音]", "unknown"), ("[文件]", "unknown"), ("[链接]", "unknown"),
+)
+
+
+def infer_content_type(text: str, declared: Any = None) -> str:
+    """优先使用导出文件中的类型 (名称或微信类型编号)，否则按占位符推断，默认为 text"""
+    if isinstance(declared, str):
+        declared = declared.strip()
+        if declared.lower() in _CONTENT_TYPES:
+            return declared.lower()
+        if declared.isdigit():
+            declared = int(declared)
+    if isinstance(declared, int) and declared in _WECHAT_TYPES:
+        return _WECHAT_TYPES[declared]
+    stripped = text.lstrip()
+    for placeholder, content_type in _PLACEHOLDERS:
+        if stripped.startswith(placeholder):
+            return content_type
+    return "text"
+
+
+def _parse_flag(value: Any) -> Optional[bool]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("1", "true", "yes", "y", "是"):
+        return True
+    if text in ("0", "false", "no", "n", "否"):
+        return False
+    return None
+
+
+# --- 纯文本 (微信 / QQ) ---
+
+_HEADER_PATTERNS = (
+    re.compile(rf"^(?P<date>{_DATE})\s+(?P<time>{_TIME})\s+(?P<sender>\S.*?)\s*$"),  # QQ: 2023-05-01 12:34:56 张三(12345)
+    re.compile(rf"^(?P<sender>\S.*?)\s+(?P<date>{_DATE})\s+(?P<time>{_TIME})\s*$"),  # 微信: 张三 2023-05-01 12:34:56
+)
+# QQ 在昵称后附带的 QQ 号或邮箱
+_SENDER_SUFFIX_RE = re.compile(r"\s*(?:\(\d{5,}\)|（\d{5,}）|<[^<>]*>)$")
+
+
+def _match_header(line: str) -> Optional[Tuple[datetime.datetime, str]]:
+    for pattern in _HEADER_PATTERNS:
+        match = pattern.match(line)
+        if match:
+            timestamp = parse_timestamp(f"{match.group('date')} {match.group('time')}")
+            sender = _SENDER_SUFFIX_RE.sub("", match.group("sender")).strip()
+            if timestamp is not None and sender:
+                return timestamp, sender
+    return None
+
+
+def iter_text_records(lines: Iterable[str]) -> Iterator[Optional[ExportRecord]]:
+    """逐行解析纯文本导出；内容为空的消息产出 None (计为无效记录)"""
+    header: Optional[Tuple[datetime.datetime, str]] = None
+    body: List[str] = []
+
+    def finish() -> Optional[ExportRecord]:
+        text = "\n".join(body).strip()
+        if not text:
+            return None
+        return ExportRecord(header[0], header[1], text, infer_content_type(text))
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+        parsed = _match_header(line.strip()) if line.strip() else None
+        if parsed is not None:
+            if header is not None:
+                yield finish()
+            header, body = parsed, []
+        elif header is not None:
+            body.append(line)
+    if header is not None:
+        yield finish()
+
+
+# --- CSV / JSON ---
+
+# 字段 -> 可能的列名 (小写比较，按优先级)
+_FIELD_ALIASES = {
+    "timestamp": ("timestamp", "datetime", "time", "date", "strtime", "createtime", "create_time", "时间", "发送时间"),
+    "sender": ("nickname", "sender", "from", "sender_name", "remark", "talker", "name", "发送者", "发送人", "昵称"),
+    "text": ("text", "content", "message", "msg", "strcontent", "body", "内容", "消息", "消息内容"),
+    "content_type": ("content_type", "type", "msg_type", "类型"),
+    "is_self": ("is_self", "issender", "is_sender", "from_me", "is_me", "是否本人", "是否发送"),
+}
+
+
+def _resolve_fields(keys: Iterable[str]) -> Dict[str, str]:
+    """由表头 / 对象的键确定各字段使用的列名"""
+    lowered = {}
+    for key in keys:
+        if key is not None:
+            lowered.setdefault(key.strip().lower(), key)
+    fields = {}
+    for field, aliases in _FIELD_ALIASES.items():
+        for alias in aliases:
+            if alias in lowered:
+                fields[field] = lowered[alias]
+                break
+    return fields
+
+
+def _record_from_row(row: Dict[str, Any], fields: Dict[str, str]) -> Optional[ExportRecord]:
+    timestamp = parse_timestamp(row.get(fields.get("timestamp", "")))
+    text = row.get(fields.get("text", ""))
+    text = "" if text is None else str(text).strip()
+    sender = row.get(fields.get("sender", ""))
+    sender = "" if sender is None else str(sender).strip()
+    is_self = _parse_flag(row.get(fields["is_self"])) if "is_self" in fields else None
+    if timestamp is None or not text or not (sender or is_self is not None):
+        return None
+    return ExportRecord(timestamp, sender, text, infer_content_type(text, row.get(fields.get("content_type", ""))), is_self)
+
+
+def iter_csv_records(lines: Iterable[str]) -> Iterator[Optional[ExportRecord]]:
+    reader = csv.DictReader(lines)
+    fields = _resolve_fields(reader.fieldnames or [])
+    if "timestamp" not in fields or "text" not in fields:
+        raise HTTPException(status_code=400, detail=f"CSV 表头中找不到时间或内容列: {reader.fieldnames}")
+    for row in reader:
+        yield _record_from_row(row, fields)
+
+
+def _iter_json_array(stream: IO[str], chunk_size: int = 64 * 1024) -> Iterator[Any]:
+    """从流中逐个解码 JSON 数组的元素 (流已定位在 '[' 之后)，只缓冲当前元素"""
+    decoder = json.JSONDecoder()
+    buffer, position, eof = "", 0, False
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position < len(buffer) and buffer[position] == "]":
+            return
+        try:
+            if position >= len(buffer):
+                raise ValueError("need more data")
+            item, end = decoder.raw_decode(buffer, position)
+            # 数字等标量可能在缓冲区末尾被截断 ("-0." 会先解码出 -0)，后面不是分隔符且还有数据时读完再解码
+            if not eof and not isinstance(item, (dict, list)) and (end == len(buffer) or buffer[end] not in " \t\r\n,]"):
+                raise ValueError("need more data")
+        except ValueError:
+            if eof:
+                if position < len(buffer):
+                    raise HTTPException(status_code=400, detail="JSON 文件格式错误 (数组未正确结束)")
+                return
+            chunk = stream.read(chunk_size)
+            buffer, position, eof = buffer[position:] + chunk, 0, not chunk
+            continue
+        yield item
+        position = end
+
+
+# 顶层对象中常见的消息数组键名 (小写比较)
+_ARRAY_KEY_ALIASES = {"messages", "message_list", "msgs", "msg_list", "data", "records", "chats", "items", "list",
+                      "消息", "聊天记录"}
+# 多行 JSON 中 "键": [ 的开头
+_ARRAY_START_RE = re.compile(r'"((?:[^"\\]|\\.)*)"\s*:\s*\[')
+
+
+def _is_message_array(key: str, first_item: Any = None, empty: bool = False) -> bool:
+    """数组的第一个元素是带时间和内容字段的对象时才是消息数组；空数组只在键名是常见别名时算"""
+    if empty:
+        return key.strip().lower() in _ARRAY_KEY_ALIASES
+    if not isinstance(first_item, dict):
+        return False
+    fields = _resolve_fields(first_item.keys())
+    return "timestamp" in fields and "text" in fields
+
+
+def _pick_message_array(obj: Dict[str, Any]) -> List[Any]:
+    """单行顶层对象: 优先取常见别名键下的数组，否则取第一个看起来是消息的数组"""
+    arrays = [(key, value) for key, value in obj.items() if isinstance(value, list)]
+    arrays.sort(key=lambda item: item[0].strip().lower() not in _ARRAY_KEY_ALIASES)  # 稳定排序，别名键在前
+    for key, value in arrays:
+        if _is_message_array(key, value[0] if value else None, empty=not value):
+            return value
+    return []
+
+
+def _find_message_array(prefix: str, stream: IO[str], chunk_size: int = 64 * 1024) -> "_Prefixed":
+    """
+    在多行 JSON 对象中找到消息数组，返回定位在其 '[' 之后的流。
+    依次检查每个 "键": [ ，跳过第一个元素不像消息的数组 (如元数据中的 tags)，只缓冲扫描位置附近的文本。
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, eof = prefix, 0, False
+    while True:
+        match = _ARRAY_START_RE.search(buffer, position)
+        if match is None:
+            if eof:
+                raise HTTPException(status_code=400, detail="JSON 文件中找不到消息数组")
+            # 保留末尾一段，跨块的 "键": [ 在读入下一块后仍能匹配
+            buffer, position = buffer[max(position, len(buffer) - 4096):], 0
+            chunk = stream.read(chunk_size)
+            buffer, eof = buffer + chunk, not chunk
+            continue
+
+        start = match.end()
+        while True:
+            item_start = start
+            while item_start < len(buffer) and buffer[item_start] in " \t\r\n":
+                item_start += 1
+            try:
+                if item_start >= len(buffer):
+                    raise ValueError("need more data")
+                if buffer[item_start] == "]":
+                    found = _is_message_array(match.group(1), empty=True)
+                else:
+                    found = _is_message_array(match.group(1), decoder.raw_decode(buffer, item_start)[0])
+                break
+            except ValueError:
+                if eof:
+                    found = False
+                    break
+                chunk = stream.read(chunk_size)
+                buffer, eof = buffer + chunk, not chunk
+        if found:
+            return _Prefixed(buffer[start:], stream)
+        position = start
+
+
+def iter_json_records(stream: IO[str]) -> Iterator[Optional[ExportRecord]]:
+    """JSON 数组 / 顶层对象中的消息数组 / JSON Lines"""
+    first_line = ""
+    while not first_line.strip():
+        first_line = stream.readline()
+        if not first_line:
+            return
+
+    objects: Iterable[Any]
+    stripped = first_line.strip()
+    try:
+        first = json.loads(stripped) if stripped.startswith("{") else None
+    except ValueError:
+        first = None
+    if isinstance(first, dict) and "timestamp" not in _resolve_fields(first.keys()):
+        # 整个文件只有一行的顶层对象: 取其中的消息数组
+        objects = _pick_message_array(first)
+    elif isinstance(first, dict):
+        def json_lines():
+            yield first
+            for line in stream:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        yield None
+        objects = json_lines()
+    elif stripped.startswith("["):
+        objects = _iter_json_array(_Prefixed(stripped[1:], stream))
+    else:
+        # 多行的顶层对象: 其他字段 (元数据等) 中也可能有数组，按键名和元素内容找到消息数组
+        objects = _iter_json_array(_find_message_array(first_line, stream))
+
+    fields: Optional[Dict[str, str]] = None
+    for item in objects:
+        if not isinstance(item, dict):
+            yield None
+            continue
+        if fields is None:
+            fields = _resolve_fields(item.keys())
+        yield _record_from_row(item, fields)
+
+
+class _Prefixed:
+    """在流前面接上已经读出的一段文本"""
+
+    def __init__(self, prefix: str, stream: IO[str]):
+        self._prefix = prefix
+        self._stream = stream
+
+    def read(self, size: int = -1) -> str:
+        if self._prefix:
+            prefix, self._prefix = self._prefix, ""
+            return prefix
+        return self._stream.read(size)
+
+
+def detect_format(filename: Optional[str], stream: IO[str]) -> str:
+    """按扩展名判断格式；扩展名不明确时看第一个非空字符 ('[' / '{' 为 JSON)，否则为纯文本"""
+    name = (filename or "").lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".json", ".jsonl", ".ndjson")):
+        return "json"
+    if name.endswith(".txt"):
+        return "text"
+    start = stream.tell()
+    head = stream.read(4096).lstrip()
+    stream.seek(start)
+    return "json" if head[:1] in ("[", "{") else "text"
+
+
+# --- 发送者映射 ---
+
+_SYSTEM_SENDERS = {"system", "系统消息", "系统提示", "10000"}
+_MAX_REPORTED_SENDERS = 200
+_UNNAMED = {"User 1": "(我)", "User 2": "(对方)", "system": "(系统)"}  # 导出文件中没有发送者名称时的显示
+
+
+class SenderMapper:
+    """导出文件中的发送者名称 -> "User 1" / "User 2" / "system"，并记录映射结果 (供前端核对)"""
+
+    def __init__(self, self_names: Iterable[str]):
+        self.self_names = {name.strip() for name in self_names if name and name.strip()}
+        self.seen: Dict[str, str] = {}
+
+    def map(self, record: ExportRecord) -> str:
+        if record.sender in _SYSTEM_SENDERS or record.content_type == "system":
+            role = "system"
+        elif record.is_self is not None:
+            role = "User 1" if record.is_self else "User 2"
+        else:
+            role = "User 1" if record.sender in self.self_names else "User 2"
+        if len(self.seen) < _MAX_REPORTED_SENDERS:
+            self.seen.setdefault(record.sender or _UNNAMED[role], role)
+        return role
+
+
+# --- 去重 + 批量追加 ---
+
+def _minute(timestamp: datetime.datetime) -> datetime.datetime:
+    return normalize_to_utc(timestamp).replace(second=0, microsecond=0)
+
+
+def _dedup_key(msg: Message) -> Tuple[datetime.datetime, str, str]:
+    return _minute(msg.timestamp), msg.sender, normalize_text(msg.text)
+
+
+def _drop_existing(profile_id: str, chunk: List[Message], id_prefix: str, matched: Counter) -> List[Message]:
+    """
+    去掉 Profile 中*导入开始前*已有的消息 (按多重集合计数: 同一分钟里同一个人发了两次 "好"，已有一条时只跳过一条)。
+    只查询这一块的时间范围，SQLite 后端走时间索引。
+    本次导入追加的消息 (message_id 以 id_prefix 开头) 不参与比较: 导出文件未按时间排序时，同一分钟的消息可能分在
+    不同的块里，它们之间相同是真实的重复发送。matched 记录已被前面的块对上的已有消息，一条已有消息只抵消一次。
+    """
+    keys = [_dedup_key(msg) for msg in chunk]
+    start = min(key[0] for key in keys)
+    end = max(key[0] for key in keys) + datetime.timedelta(minutes=1)
+    existing = Counter(
+        _dedup_key(msg) for msg in profile_service.get_messages_between(profile_id, start, end)
+        if not msg.is_editable and not msg.message_id.startswith(id_prefix)
+    )
+    if not existing:
+        return chunk
+    for key in existing:
+        existing[key] -= matched.get(key, 0)
+    kept = []
+    for msg, key in zip(chunk, keys):
+        if existing[key] > 0:
+            existing[key] -= 1
+            matched[key] += 1
+        else:
+            kept.append(msg)
+    return kept
+
+
+def import_chat_export(
+        profile_id: str,
+        raw: IO[bytes],
+        filename: Optional[str] = None,
+        export_format: ExportFormat = "auto",
+        self_names: Optional[List[str]] = None,
+        encoding: str = "utf-8-sig",
+        dry_run: bool = False
+) -> ChatExportImportResponse:
+    """
+    流式解析导出文件并导入 Profile。self_names 为导出文件中代表 "我" 的名称 (默认为 Profile 的 user_name)；
+    dry_run 为 True 时只解析和去重、不写入，用于先核对发送者映射。
+    """
+    if not profile_service.profile_exists(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        raise HTTPException(status_code=400, detail=f"未知的编码: {encoding}")
+
+    started = time.perf_counter()
+    mapper = SenderMapper(self_names or [profile_service.get_profile_summary(profile_id).user_name])
+    stream = io.TextIOWrapper(raw, encoding=encoding, errors="replace", newline="")
+    if export_format == "auto":
+        export_format = detect_format(filename, stream)
+    if export_format == "csv":
+        records = iter_csv_records(stream)
+    elif export_format == "json":
+        records = iter_json_records(stream)
+    else:
+        records = iter_text_records(stream)
+
+    total = imported = duplicates = invalid = 0
+    first_ts = last_ts = None
+    chunk: List[Message] = []
+    # 本次导入写入的消息使用同一个 message_id 前缀 (格式仍是 msg_ + 32 位十六进制)，去重时据此排除
+    id_prefix = f"msg_{uuid.uuid4().hex[:12]}"
+    matched: Counter = Counter()
+
+    def flush():
+        nonlocal imported, duplicates
+        # 去重查询和追加在同一个 profile_lock (可重入) 内，并发的导入 / 截图保存不会都通过检查而写入重复消息
+        with profile_service.profile_lock(profile_id):
+            kept = _drop_existing(profile_id, chunk, id_prefix, matched)
+            if not dry_run:
+                profile_service.append_messages(profile_id, kept)
+        duplicates += len(chunk) - len(kept)
+        imported += len(kept)
+        chunk.clear()
+
+    try:
+        for record in records:
+            if record is None:
+                invalid += 1
+                continue
+            total += 1
+            first_ts = record.timestamp if first_ts is None else min(first_ts, record.timestamp)
+            last_ts = record.timestamp if last_ts is None else max(last_ts, record.timestamp)
+            msg = Message(
+                message_id=f"{id_prefix}{uuid.uuid4().hex[:20]}",
+                timestamp=record.timestamp,
+                sender=mapper.map(record),
+                content_type=record.content_type or "text",
+                text=record.text,
+            )
+            chunk.append(msg)
+            if len(chunk) >= settings.EXPORT_IMPORT_CHUNK_SIZE:
+                flush()
+        if chunk:
+            flush()
+    finally:
+        stream.detach()
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"[Chat Export] {export_format} export for {profile_id}: {total} records, {imported} imported, "
+          f"{duplicates} duplicates, {invalid} invalid in {elapsed_ms:.0f} ms{' (dry run)' if dry_run else ''}")
+    return ChatExportImportResponse(
+        format=export_format,
+        records=total,
+        imported=imported,
+        duplicates_skipped=duplicates,
+        invalid_records=invalid,
+        senders=mapper.seen,
+        first_timestamp=first_ts,
+        last_timestamp=last_ts,
+        elapsed_ms=elapsed_ms,
+        dry_run=dry_run,
+    )
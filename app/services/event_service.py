@@ -1,4 +1,3 @@
-import base64
 from typing import Optional
 from openai import APIError
 from app.core.config import settings
@@ -10,10 +9,7 @@ from app.core.prompts import (
     VLM_EVENT_PROMPT_TASK
 )
 from app.services.llm_client import llm_client, vlm_client
-
-
-def get_image_base64_sync(image_bytes: bytes) -> str:
-    return base64.b64encode(image_bytes).decode('utf-8')
+from app.services.image_preprocess import prepare_image
 
 
 async def analyze_event_inputs(
@@ -31,7 +27,7 @@ async def analyze_event_inputs(
     try:
         if image_bytes:
             # --- 逻辑 2 & 3: 有图片 (VLM) ---
-            image_b64 = get_image_base64_sync(image_bytes)
+            prepared = await prepare_image(image_bytes)  # [修改] 缩放 / 重新编码后再发送
 
             # 动态构建 VLM Prompt
             prompt_parts = [
@@ -50,7 +46,7 @@ async def analyze_event_inputs(
                     "content": [
                         {"type": "text", "text": final_vlm_prompt},
                         {"type": "image_url", "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_b64}"
+                            "url": prepared.data_url
                         }},
                     ],
                 }],
@@ -0,0 +1,295 @@
+"""
+[新增] 发送给 VLM 之前的图片预处理。
+
+手机截图通常是几 MB 的 PNG，直接 base64 发送既慢又占用视觉 token。这里在进程池中
+(不阻塞事件循环) 完成: 按 EXIF 方向校正 -> 长边缩放到 IMAGE_MAX_DIMENSION 以内 ->
+(可选) 灰度 -> 重新编码为 JPEG / WebP (不写入任何元数据)。
+滚动长截图先切成多片 (split_tall_image)，否则整体缩放后文字会糊掉。
+重新编码后反而更大时 (如本来就很小的 JPEG、大面积纯色的 PNG) 选择更小的编码或原图，
+并使用其真实的 MIME 类型。
+"""
+import asyncio
+import base64
+import io
+import math
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+
+from PIL import Image, ImageChops, ImageOps
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.core.models import ImagePreprocessStats
+
+_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif", "BMP": "image/bmp"}
+
+
+class PreparedImage(BaseModel):
+    data: bytes
+    mime_type: str
+    stats: ImagePreprocessStats
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{base64.b64encode(self.data).decode('utf-8')}"
+
+
+def estimate_image_tokens(width: int, height: int, patch_size: int) -> int:
+    """按 patch 数粗略估计视觉 token (与多数按 patch 切分的 VLM 在同一数量级，仅用于对比)"""
+    return math.ceil(width / patch_size) * math.ceil(height / patch_size)
+
+
+def _open_image(image_bytes: bytes, decode: bool = True) -> Image.Image:
+    """decode 为 False 时只解析图片头部 (格式、尺寸)"""
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        if decode:
+            image.load()
+    except Exception:
+        raise ValueError("Invalid image file")
+    return image
+
+
+def image_size(image_bytes: bytes) -> Tuple[int, int]:
+    """只读取图片头部得到 (宽, 高)；无法识别时抛出 ValueError"""
+    return _open_image(image_bytes, decode=False).size
+
+
+def _encode(image: Image.Image, image_format: str, **save_kwargs) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **save_kwargs)
+    return buffer.getvalue()
+
+
+def _preprocess(
+        image_bytes: bytes,
+        max_dimension: int,
+        output_format: str,
+        quality: int,
+        grayscale: bool,
+        patch_size: int
+) -> Tuple[bytes, str, dict]:
+    """进程池中执行的部分 (只接收 / 返回可 pickle 的基本类型)"""
+    image = _open_image(image_bytes)
+    original_format = image.format
+    original_size = image.size
+
+    image = ImageOps.exif_transpose(image)
+    if max(image.size) > max_dimension > 0:
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    if grayscale:
+        image = image.convert("L")
+    elif image.mode not in ("RGB", "L"):
+        # JPEG 不支持透明通道，透明部分铺白底 (聊天截图的背景通常是浅色)
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        image = background
+
+    save_kwargs = {"quality": quality}
+    if output_format == "JPEG":
+        save_kwargs["optimize"] = True
+    elif output_format == "WEBP":
+        save_kwargs["method"] = 4
+    candidates = [(_encode(image, output_format, **save_kwargs), output_format)]
+    if original_format == "PNG" and output_format != "PNG":
+        # 大面积纯色的界面截图用无损 PNG 有时反而更小
+        candidates.append((_encode(image, "PNG", optimize=True), "PNG"))
+    if image.size == original_size:
+        # 没有缩放时，重新编码不比原图小就原样发送
+        candidates.append((image_bytes, original_format))
+    data, data_format = min(candidates, key=lambda candidate: len(candidate[0]))
+    mime_type = _MIME_TYPES.get(data_format, "image/jpeg")
+    processed_size = image.size
+
+    return data, mime_type, {
+        "original_bytes": len(image_bytes),
+        "processed_bytes": len(data),
+        "original_size": original_size,
+        "processed_size": processed_size,
+        "mime_type": mime_type,
+        "estimated_tokens_before": estimate_image_tokens(*original_size, patch_size),
+        "estimated_tokens_after": estimate_image_tokens(*processed_size, patch_size),
+    }
+
+
+def _split_tiles(image_bytes: bytes, min_aspect: float, tile_aspect: float, overlap_ratio: float) -> Optional[List[bytes]]:
+    """进程池中执行: 把长截图从上到下切成相互重叠的片 (PNG 无损，之后各自再预处理)；不需要切片时返回 None"""
+    image = ImageOps.exif_transpose(_open_image(image_bytes))
+    width, height = image.size
+    if width <= 0 or height / width <= min_aspect:
+        return None
+    tile_height = max(1, int(width * tile_aspect))
+    if tile_height >= height:
+        return None  # TILE_ASPECT 不小于图片本身的高宽比时只会有一片，不切
+    overlap = min(int(tile_height * overlap_ratio), tile_height - 1)
+    step = tile_height - overlap
+    tops = list(range(0, height - tile_height, step)) + [height - tile_height]  # 最后一片与底部对齐
+    return [_encode(image.crop((0, top, width, top + tile_height)), "PNG", compress_level=1) for top in tops]
+
+
+def _passthrough(image_bytes: bytes) -> Tuple[bytes, str, dict]:
+    """不做预处理: 只读取图片头部校验格式，按真实类型发送原图"""
+    image = _open_image(image_bytes, decode=False)
+    mime_type = _MIME_TYPES.get(image.format, "image/jpeg")
+    tokens = estimate_image_tokens(*image.size, settings.IMAGE_TOKEN_PATCH_SIZE)
+    return image_bytes, mime_type, {
+        "original_bytes": len(image_bytes),
+        "processed_bytes": len(image_bytes),
+        "original_size": image.size,
+        "processed_size": image.size,
+        "mime_type": mime_type,
+        "estimated_tokens_before": tokens,
+        "estimated_tokens_after": tokens,
+    }
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=max(1, settings.IMAGE_PREPROCESS_WORKERS))
+    return _executor
+
+
+def shutdown_executor():
+    """关闭预处理进程池 (应用关闭时调用)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _dhash(image_bytes: bytes, hash_size: int) -> str:
+    """
+    差值哈希 (dHash): 灰度缩小到 (hash_size + 1) x hash_size，逐行比较相邻像素的明暗，
+    得到 hash_size² 位的指纹 (十六进制)。重新压缩、轻微缩放 / 裁剪后的同一张截图指纹只相差少数几位。
+    """
+    image = _open_image(image_bytes, decode=False)
+    image.draft("L", (hash_size * 8, hash_size * 8))  # JPEG 可以直接按缩小的尺寸解码
+    image = ImageOps.exif_transpose(image).convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = list(image.getdata())
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+async def compute_dhash(image_bytes: bytes) -> Optional[str]:
+    """[新增] 在预处理进程池中计算图片的 dHash；图片无法识别或计算失败时返回 None"""
+    global _executor
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_executor(), _dhash, image_bytes, settings.NEAR_DUPLICATE_HASH_SIZE)
+    except ValueError:
+        return None
+    except BrokenProcessPool as e:
+        print(f"Warning: Image preprocessing pool is broken, skipping perceptual hash: {e}")
+        _executor = None
+    except Exception as e:
+        print(f"Warning: Could not compute perceptual hash: {e}")
+    return None
+
+
+# 逐像素比较时灰度差超过该值才算 "明显不同" (JPEG 重新压缩的噪声远小于文字与背景的差)
+_PIXEL_DIFF_THRESHOLD = 48
+
+
+def _pixel_difference(image_bytes: bytes, other_bytes: bytes, width: int) -> float:
+    """
+    两张图灰度缩小到同样的 width x (按第一张图的宽高比) 后，明显不同的像素占比。
+    dHash 只反映大致布局，气泡位置相同而文字不同的两张截图要在这里才能区分开。
+    """
+    image = ImageOps.exif_transpose(_open_image(image_bytes)).convert("L")
+    other = ImageOps.exif_transpose(_open_image(other_bytes)).convert("L")
+    size = (width, max(1, round(width * image.height / image.width)))
+    difference = ImageChops.difference(
+        image.resize(size, Image.Resampling.BOX), other.resize(size, Image.Resampling.BOX)
+    )
+    changed = sum(difference.histogram()[_PIXEL_DIFF_THRESHOLD + 1:])
+    return changed / (size[0] * size[1])
+
+
+async def compare_images(image_bytes: bytes, other_bytes: bytes) -> Optional[float]:
+    """[新增] 在预处理进程池中逐像素比较两张图 (见 _pixel_difference)；无法比较时返回 None"""
+    global _executor
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(
+            _get_executor(), _pixel_difference, image_bytes, other_bytes, settings.NEAR_DUPLICATE_VERIFY_WIDTH
+        )
+    except ValueError:
+        return None
+    except BrokenProcessPool as e:
+        print(f"Warning: Image preprocessing pool is broken, skipping image comparison: {e}")
+        _executor = None
+    except Exception as e:
+        print(f"Warning: Could not compare images: {e}")
+    return None
+
+
+async def split_tall_image(image_bytes: bytes) -> Optional[List[bytes]]:
+    """
+    [新增] 高宽比超过 TILE_MIN_ASPECT 的长截图切成重叠的片 (在进程池中)，其余图片返回 None。
+    先只读取图片头部判断尺寸，普通截图不会进入进程池；切片失败时返回 None (整张解析)。
+    """
+    global _executor
+    if not settings.TILE_ENABLED:
+        return None
+    try:
+        width, height = image_size(image_bytes)
+    except ValueError:
+        return None
+    if max(width, height) / max(1, min(width, height)) <= settings.TILE_MIN_ASPECT:
+        return None  # EXIF 旋转前后都不是长图
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(
+            _get_executor(), _split_tiles, image_bytes,
+            settings.TILE_MIN_ASPECT, settings.TILE_ASPECT, settings.TILE_OVERLAP_RATIO
+        )
+    except BrokenProcessPool as e:
+        print(f"Warning: Image preprocessing pool is broken, parsing long screenshot as a whole: {e}")
+        _executor = None
+    except Exception as e:
+        print(f"Warning: Could not split long screenshot, parsing it as a whole: {e}")
+    return None
+
+
+async def prepare_image(image_bytes: bytes) -> PreparedImage:
+    """
+    预处理一张图片，返回要发送给模型的数据及前后对比。
+    图片无法识别时抛出 ValueError；进程池不可用时退回为发送原图。
+    """
+    global _executor
+    if settings.IMAGE_PREPROCESS_ENABLED:
+        loop = asyncio.get_running_loop()
+        try:
+            data, mime_type, stats = await loop.run_in_executor(
+                _get_executor(), _preprocess, image_bytes,
+                settings.IMAGE_MAX_DIMENSION, settings.IMAGE_OUTPUT_FORMAT.upper(),
+                settings.IMAGE_QUALITY, settings.IMAGE_GRAYSCALE, settings.IMAGE_TOKEN_PATCH_SIZE
+            )
+        except ValueError:
+            raise
+        except BrokenProcessPool as e:
+            print(f"Warning: Image preprocessing pool is broken, sending original image: {e}")
+            _executor = None  # 下次重新创建
+            data, mime_type, stats = _passthrough(image_bytes)
+        except Exception as e:
+            print(f"Warning: Image preprocessing failed, sending original image: {e}")
+            data, mime_type, stats = _passthrough(image_bytes)
+    else:
+        data, mime_type, stats = _passthrough(image_bytes)
+
+    prepared = PreparedImage(data=data, mime_type=mime_type, stats=ImagePreprocessStats(**stats))
+    if settings.IMAGE_PREPROCESS_ENABLED:
+        print(f"[Image Preprocess] {stats['original_size']} {stats['original_bytes']} B -> "
+              f"{stats['processed_size']} {stats['processed_bytes']} B ({mime_type}), "
+              f"~{prepared.stats.tokens_saved} tokens saved")
+    return prepared
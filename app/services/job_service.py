@@ -0,0 +1,313 @@
+"""
+[新增] 进程内的后台任务队列。
+
+导入截图、增量分析都可能持续几分钟，放在 HTTP 请求里执行时客户端超时 / 断开就会丢失结果。
+这里把它们作为任务提交: 任务写入 SQLite 任务表 (JOBS_DB_PATH) 后立即返回 job_id，
+由 JOB_WORKERS 个 asyncio worker 依次执行，前端轮询任务状态和进度。
+
+- 任务的输入 (params) 只包含可持久化的数据: 导入任务引用图片存储中的 Hash，而不是图片本身。
+- 服务重启时，排队中和执行到一半的任务重新排队。两类任务重新执行的代价都很小:
+  已解析的截图命中 VLM 解析缓存，已分析过的日期会被增量分析跳过。
+- 取消: 排队中的任务直接标记为 cancelled；执行中的任务取消其 asyncio Task。
+- [新增] Profile 当天的 Token 预算用完后拒绝提交新任务，已排队的任务推迟到第二天 (见 metering)。
+"""
+import asyncio
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.core.models import Job, JobKind, JobPage, JobStatus, NearDuplicate
+from app.services import metering, overlap_dedup, persona_service, profile_service, vlm_service
+
+_FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    profile_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_profile ON jobs (profile_id, created_at);
+"""
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class JobStore:
+    """任务表。与 Profile 使用哪种存储后端无关，始终是一个独立的 SQLite 文件。"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # 任务状态在事件循环和线程池中都会读写，单个连接加锁即可 (写入量很小)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def save(self, job: Job):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, kind, profile_id, status, created_at, data) VALUES (?, ?, ?, ?, ?, ?)",
+                (job.job_id, job.kind, job.profile_id, job.status, job.created_at.isoformat(), job.model_dump_json())
+            )
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return Job.model_validate_json(row[0]) if row else None
+
+    def list(
+            self,
+            profile_id: Optional[str] = None,
+            status: Optional[JobStatus] = None,
+            offset: int = 0,
+            limit: int = 50
+    ) -> Tuple[List[Job], int]:
+        """按创建时间倒序 (最新的在前) 分页列出任务，返回 (任务, 总数)"""
+        clauses, args = [], []
+        if profile_id:
+            clauses.append("profile_id = ?")
+            args.append(profile_id)
+        if status:
+            clauses.append("status = ?")
+            args.append(status)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM jobs {where}", args).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT data FROM jobs {where} ORDER BY created_at DESC LIMIT ? OFFSET ?", args + [limit, offset]
+            ).fetchall()
+        return [Job.model_validate_json(row[0]) for row in rows], total
+
+    def list_unfinished(self) -> List[Job]:
+        """排队中和执行中的任务，按创建时间升序 (恢复时按原顺序重新排队)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+        return [Job.model_validate_json(row[0]) for row in rows]
+
+
+_store: Optional[JobStore] = None
+
+
+def get_job_store() -> JobStore:
+    global _store
+    if _store is None:
+        _store = JobStore(settings.JOBS_DB_PATH)
+    return _store
+
+
+def _update(job_id: str, **changes) -> Optional[Job]:
+    store = get_job_store()
+    job = store.get(job_id)
+    if job is None:
+        return None
+    job = job.model_copy(update=changes)
+    store.save(job)
+    return job
+
+
+# --- 任务处理函数: (job, report_progress) -> 结果 (JSON 兼容的 dict) ---
+
+ProgressCallback = Callable[[int, int], None]
+
+
+async def _run_import(job: Job, report: ProgressCallback) -> Dict[str, Any]:
+    """解析图片存储中的截图，结果结构与 upload_screenshots 的响应相同 (由前端确认后再保存)"""
+    # 先读取所有图片，已被淘汰的图片在调用 VLM 之前就报错
+    images = [(image_hash, profile_service.get_uploaded_image(image_hash)) for image_hash in job.params["image_hashes"]]
+    report(0, len(images))
+    started = time.perf_counter()
+    results = [None] * len(images)
+    done = 0
+    async for index, result in vlm_service.iter_parsed_images(images, use_cache=not job.params.get("refresh", False)):
+        results[index] = result
+        done += 1
+        report(done, len(images))
+    # 上传的新截图还要与 Profile 最新的消息去重；重新解析的截图只在批次内去重
+    tail = overlap_dedup.load_profile_tail(job.profile_id) if job.params.get("dedup_with_profile") else None
+    results = overlap_dedup.merge_overlaps(results, tail)
+    summary = vlm_service.summarize_batch(results, started)
+    summary.near_duplicates = [NearDuplicate(**item) for item in job.params.get("near_duplicates", [])]
+    return summary.model_dump(mode='json')
+
+
+async def _run_analysis(job: Job, report: ProgressCallback) -> Dict[str, Any]:
+    # 与同步接口一样，分析期间持有 Profile 的异步锁
+    async with profile_service.async_profile_lock(job.profile_id):
+        return await persona_service.analyze_profile_incrementally(job.profile_id, on_progress=report)
+
+
+_HANDLERS: Dict[str, Callable[[Job, ProgressCallback], Awaitable[Dict[str, Any]]]] = {
+    "import_screenshots": _run_import,
+    "analyze_profile": _run_analysis,
+}
+
+
+# --- 执行器 ---
+
+_queue: Optional[asyncio.Queue] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None  # worker 所在的事件循环 (asyncio.Queue 只能在这个线程操作)
+_workers: List[asyncio.Task] = []
+_running: Dict[str, asyncio.Task] = {}  # job_id -> 正在执行该任务的 Task
+_cancel_requested: Set[str] = set()
+
+
+async def start_workers():
+    """启动 worker，并把上次未完成的任务重新排队 (应用启动时调用)"""
+    global _queue, _loop
+    if _queue is not None:
+        return
+    _queue = asyncio.Queue()
+    _loop = asyncio.get_running_loop()
+    resumed = 0
+    for job in get_job_store().list_unfinished():
+        if job.status == "running":
+            _update(job.job_id, status="queued")
+        _queue.put_nowait(job.job_id)
+        resumed += 1
+    if resumed:
+        print(f"[Job Service] Resumed {resumed} unfinished jobs")
+    _workers.extend(asyncio.create_task(_worker()) for _ in range(max(1, settings.JOB_WORKERS)))
+
+
+async def stop_workers():
+    """停止 worker (应用关闭时调用)。执行中的任务保持可恢复状态，下次启动时重新执行"""
+    global _queue
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _queue = None
+
+
+async def _worker():
+    while True:
+        job_id = await _queue.get()
+        try:
+            await _execute(job_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"!!! [Job Service] Unexpected error while running job {job_id}: {e}")
+        finally:
+            _queue.task_done()
+
+
+async def _execute(job_id: str):
+    job = get_job_store().get(job_id)
+    if job is None or job.status != "queued":
+        return  # 排队期间已被取消
+    if metering.budget_exceeded(job.profile_id):
+        # 预算按本地日期计，推迟到第二天再检查 (服务在此之前重启时会照常恢复排队并再次检查)
+        _update(job_id, error="该 Profile 今日的 Token 预算已用完，任务推迟到明天执行")
+        asyncio.get_running_loop().call_later(metering.seconds_until_tomorrow(), _requeue, job_id)
+        print(f"[Job Service] Deferred job {job_id}: daily token budget of {job.profile_id} exceeded")
+        return
+    job = _update(job_id, status="running", started_at=_now(), attempts=job.attempts + 1, error=None)
+    print(f"[Job Service] Running {job.kind} job {job_id} for profile {job.profile_id} (attempt {job.attempts})")
+    task = asyncio.ensure_future(_run(job))
+    _running[job_id] = task
+    try:
+        await task
+    finally:
+        _running.pop(job_id, None)
+        _cancel_requested.discard(job_id)
+
+
+def _requeue(job_id: str):
+    if _queue is not None:
+        _queue.put_nowait(job_id)
+
+
+async def _run(job: Job):
+    """执行任务并记录最终状态 (在任务自己的 Task 中完成，取消方等待 Task 结束后即可读到最终状态)"""
+    job_id = job.job_id
+    metering.set_tags(profile_id=job.profile_id, endpoint=f"job:{job.kind}")
+
+    def report(done: int, total: int):
+        _update(job_id, progress_done=done, progress_total=total)
+
+    try:
+        result = await _HANDLERS[job.kind](job, report)
+    except asyncio.CancelledError:
+        if job_id in _cancel_requested:
+            _update(job_id, status="cancelled", finished_at=_now())
+            print(f"[Job Service] Job {job_id} cancelled")
+            return
+        # 服务关闭导致的中断: 重新标记为排队中，下次启动时恢复
+        _update(job_id, status="queued")
+        raise
+    except HTTPException as e:
+        _update(job_id, status="failed", error=str(e.detail), finished_at=_now())
+    except Exception as e:
+        print(f"!!! [Job Service] Job {job_id} failed: {e}")
+        _update(job_id, status="failed", error=f"{type(e).__name__}: {e}", finished_at=_now())
+    else:
+        _update(job_id, status="succeeded", result=result, finished_at=_now())
+        print(f"[Job Service] Job {job_id} succeeded")
+
+
+# --- 对外接口 ---
+
+def submit_job(kind: JobKind, profile_id: str, params: Optional[Dict[str, Any]] = None) -> Job:
+    """
+    持久化并排队一个任务，立即返回。
+    worker 尚未启动时 (如在应用之外调用) 任务只写入任务表，下次启动时执行。
+    [新增] 该 Profile 当天的 Token 预算已用完时拒绝 (429)。
+    """
+    if metering.budget_exceeded(profile_id):
+        raise HTTPException(status_code=429, detail="该 Profile 今日的 Token 预算已用完，请明天再试或调整预算")
+    job = Job(kind=kind, profile_id=profile_id, params=params or {})
+    get_job_store().save(job)
+    if _queue is not None:
+        # 调用方可能在线程池中 (同步的路由函数)，通过事件循环线程入队才能唤醒等待中的 worker
+        _loop.call_soon_threadsafe(_requeue, job.job_id)
+    print(f"[Job Service] Queued {kind} job {job.job_id} for profile {profile_id}")
+    return job
+
+
+def get_job(job_id: str) -> Job:
+    job = get_job_store().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+def list_jobs(
+        profile_id: Optional[str] = None,
+        status: Optional[JobStatus] = None,
+        offset: int = 0,
+        limit: int = 50
+) -> JobPage:
+    items, total = get_job_store().list(profile_id, status, offset, limit)
+    return JobPage(items=items, total=total, offset=offset, limit=limit)
+
+
+async def cancel_job(job_id: str) -> Job:
+    """取消任务。已结束的任务原样返回；执行中的任务等待其响应取消 (最多几秒)"""
+    job = get_job(job_id)
+    if job.status in _FINISHED_STATUSES:
+        return job
+    task = _running.get(job_id)
+    if task is None:
+        # 还在排队 (worker 取到它时会跳过)
+        return _update(job_id, status="cancelled", finished_at=_now())
+    _cancel_requested.add(job_id)
+    task.cancel()
+    await asyncio.wait([task], timeout=5)
+    return get_job(job_id)
@@ -0,0 +1,852 @@
+import json
+import os
+import glob
+import atexit
+import datetime
+import operator
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.core.models import (
+    Profile, Message, Event, UserPersona, OpponentPersona, ContextualInsight, ProfileSummary, ProfileStats
+)
+from app.services.storage_backend import (
+    StorageBackend, to_local_date, merge_sorted, timestamp_key, filter_by_time, page_sorted_items
+)
+from app.services.profile_cache import VersionedLRUCache
+from app.services import serializer
+
+_message_id = operator.attrgetter("message_id")
+
+# 按天索引中的一项: (所在消息段 "base" / "log" / "inline", 字节偏移 (inline 为在主文件中的位置), 字节长度)
+DayIndexEntry = Tuple[str, int, int]
+
+# 游标分页时每批按天索引读取的天数
+_PAGE_CHUNK_DAYS = 7
+
+
+class JsonStorageBackend(StorageBackend):
+    """
+    默认的本地 JSON 文件存储后端。
+    每个 Profile 对应一组文件：主文件 + 消息 JSONL 段 + 事件 / 洞察 / 画像文件。
+    """
+
+    def __init__(self, data_path: str):
+        self.data_path = data_path
+        # 确保数据目录存在
+        os.makedirs(self.data_path, exist_ok=True)
+        # 已解析的按天索引和按时间排序的事件列表，按相关文件的 (mtime, size) 校验
+        self._read_cache = VersionedLRUCache(settings.PROFILE_CACHE_SIZE)
+        # 目录是所有 Profile 共用的一个文件，读-改-写需要串行
+        self._catalog_lock = threading.Lock()
+        # 每个 Profile 的消息段 / 按天索引 / 图源索引的文件锁: 后台压缩与追加、读取互斥
+        self._message_locks: Dict[str, threading.RLock] = {}
+        self._message_locks_guard = threading.Lock()
+
+        # write-behind: 整体重写的 JSON 文档 (事件 / 洞察 / 画像 / 目录) 先记在内存中，
+        # 由后台线程每隔 WRITE_BEHIND_FLUSH_INTERVAL 秒合并落盘；同一文件的多次保存只写最后一次
+        self._write_behind = settings.WRITE_BEHIND_ENABLED
+        self._pending: Dict[str, Tuple[Any, Callable[[Any], bytes]]] = {}
+        # 追加日志超过 MESSAGE_LOG_COMPACT_BYTES 的 Profile，由同一个后台线程压缩 (不占用请求的时间)
+        self._pending_compactions: Set[str] = set()
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self._stop_flusher = threading.Event()
+        if self._write_behind:
+            atexit.register(self.close)
+
+    # --- 路径辅助函数 ---
+
+    def get_profile_path(self, profile_id: str) -> str:
+        """获取主 Profile JSON 文件的路径"""
+        return os.path.join(self.data_path, f"profile_{profile_id}.json")
+
+    def get_messages_path(self, profile_id: str) -> str:
+        """获取已压缩的消息基础段 (按时间排序的 JSONL) 的路径"""
+        return os.path.join(self.data_path, f"messages_{profile_id}.jsonl")
+
+    def get_message_log_path(self, profile_id: str) -> str:
+        """获取消息追加日志段 (JSONL) 的路径，新保存的消息只追加到这里"""
+        return os.path.join(self.data_path, f"messages_{profile_id}.log.jsonl")
+
+    def get_day_index_path(self, profile_id: str) -> str:
+        """获取基础段按天索引 (本地日期 -> 消息字节偏移) 的路径，压缩时整体重写"""
+        return os.path.join(self.data_path, f"dayindex_{profile_id}.json")
+
+    def get_day_index_log_path(self, profile_id: str) -> str:
+        """获取追加日志段按天索引的路径，与日志段同步追加"""
+        return os.path.join(self.data_path, f"dayindex_{profile_id}.log.jsonl")
+
+    def get_sources_path(self, profile_id: str) -> str:
+        """获取已处理图源 Hash 索引 (每行一个 Hash，只追加) 的路径"""
+        return os.path.join(self.data_path, f"sources_{profile_id}.txt")
+
+    def get_stats_path(self, profile_id: str) -> str:
+        """获取 Profile 统计信息 (计数、时间范围、每天条数) 的路径"""
+        return os.path.join(self.data_path, f"stats_{profile_id}.json")
+
+    def get_catalog_path(self) -> str:
+        """获取 Profile 目录 (所有 Profile 的元数据摘要) 的路径"""
+        return os.path.join(self.data_path, "catalog.json")
+
+    def get_event_path(self, profile_id: str) -> str:
+        """获取事件 JSON 文件的路径"""
+        return os.path.join(self.data_path, f"event_{profile_id}.json")
+
+    def get_user_persona_path(self, profile_id: str) -> str:
+        """获取用户画像 JSON 文件的路径"""
+        return os.path.join(self.data_path, f"persona_user_{profile_id}.json")
+
+    def get_opponent_persona_path(self, profile_id: str) -> str:
+        """获取对方画像 JSON 文件的路径"""
+        return os.path.join(self.data_path, f"persona_opponent_{profile_id}.json")
+
+    def get_insights_path(self, profile_id: str) -> str:
+        """获取上下文洞察 JSON 文件的路径"""
+        return os.path.join(self.data_path, f"insights_{profile_id}.json")
+
+    # --- 缓存版本 ---
+
+    @staticmethod
+    def _file_stamp(filepath: str):
+        try:
+            st = os.stat(filepath)
+            return st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            return None
+
+    def get_version_stamp(self, profile_id: str, kind: str):
+        """以相关文件的 (mtime, size) 作为版本标记"""
+        paths = {
+            "profile": [
+                self.get_profile_path(profile_id),
+                self.get_messages_path(profile_id),
+                self.get_message_log_path(profile_id),
+                self.get_sources_path(profile_id),
+            ],
+            "sources": [self.get_sources_path(profile_id)],
+            "events": [self.get_event_path(profile_id)],
+            "insights": [self.get_insights_path(profile_id)],
+            "user_persona": [self.get_user_persona_path(profile_id)],
+            "opponent_persona": [self.get_opponent_persona_path(profile_id)],
+            "stats": [self.get_stats_path(profile_id)],
+            "catalog": [self.get_catalog_path()],
+        }.get(kind, [])
+        return tuple(self._file_stamp(p) for p in paths)
+
+    # --- 原子写入 / write-behind ---
+
+    @staticmethod
+    @contextmanager
+    def _atomic_file(filepath: str):
+        """
+        以二进制模式写入临时文件，成功后 rename 替换目标文件。
+        写入中途崩溃只会留下临时文件，目标文件要么是旧内容，要么是完整的新内容。
+        """
+        tmp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                yield f
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _atomic_write(self, filepath: str, data: bytes):
+        with self._atomic_file(filepath) as f:
+            f.write(data)
+
+    @staticmethod
+    def _encode_json(default=None) -> Callable[[Any], bytes]:
+        """[修改] 统一使用可插拔的序列化器，写入紧凑格式 (读取仍兼容旧的缩进格式)"""
+        return lambda obj: serializer.dumps(obj, default=default)
+
+    def _write_document(self, filepath: str, value: Any, encode: Callable[[Any], bytes]):
+        """
+        整体写入一个 JSON 文档。value 必须是调用方不会再修改的数据 (如新建的 dict / list)。
+        开启 write-behind 时只记录待写内容，读取时优先返回这里的内容。
+        """
+        if not self._write_behind:
+            self._atomic_write(filepath, encode(value))
+            return
+        with self._pending_lock:
+            self._pending[filepath] = (value, encode)
+        self._ensure_flusher()
+
+    def _get_pending(self, filepath: str) -> Optional[Any]:
+        """返回尚未落盘的文档内容 (JSON 兼容的 dict / list)，没有时返回 None"""
+        with self._pending_lock:
+            entry = self._pending.get(filepath)
+        return entry[0] if entry is not None else None
+
+    def _ensure_flusher(self):
+        with self._pending_lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="json-storage-background", daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop_flusher.wait(settings.WRITE_BEHIND_FLUSH_INTERVAL):
+            self.flush()
+            self._run_pending_compactions()
+
+    def close(self):
+        """
+        停止后台线程并等待它结束，再做最后一次落盘 (此后的写入会重新启动后台线程)。
+        尚未执行的压缩不在关闭时进行: 追加日志本身是完整的，下次追加时会重新安排压缩。
+        """
+        with self._pending_lock:
+            flusher, self._flusher = self._flusher, None
+        if flusher is not None:
+            self._stop_flusher.set()
+            flusher.join()
+            self._stop_flusher.clear()
+        self.flush()
+
+    def flush(self):
+        """把 write-behind 缓冲中的文档全部落盘"""
+        with self._flush_lock:
+            with self._pending_lock:
+                snapshot = list(self._pending.items())
+            for filepath, entry in snapshot:
+                value, encode = entry
+                try:
+                    self._atomic_write(filepath, encode(value))
+                except Exception as e:
+                    print(f"!!! ERROR flushing {filepath}: {e}")
+                    continue
+                # 写入期间如果又有新的保存，保留新的待写内容
+                with self._pending_lock:
+                    if self._pending.get(filepath) is entry:
+                        del self._pending[filepath]
+
+    # --- Message Segment Load/Save ---
+
+    def _read_message_segment(self, filepath: str) -> List[Message]:
+        """逐行读取一个 JSONL 消息段。无法解析的行 (如写入中断留下的半行) 会被跳过。"""
+        if not os.path.exists(filepath):
+            return []
+        messages = []
+        with open(filepath, 'rb') as f:
+            for line_no, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    messages.append(Message.model_validate_json(line))
+                except Exception as e:
+                    print(f"Warning: Skipping unreadable line {line_no} in {filepath}: {e}")
+        return messages
+
+    @staticmethod
+    def _encode_message_lines(messages: List[Message]) -> List[bytes]:
+        """将消息序列化为 JSONL 行 (UTF-8 字节，每条消息一行)"""
+        return [
+            msg.model_dump_json().encode('utf-8') + b"\n"
+            for msg in messages
+        ]
+
+    def _write_message_segment(self, filepath: str, messages: List[Message]) -> Dict[str, List[List[int]]]:
+        """
+        整体重写一个 JSONL 消息段 (仅在压缩时使用)。
+        返回按本地日期分组的 [字节偏移, 字节长度]，用于按天索引。
+        """
+        days = defaultdict(list)
+        offset = 0
+        with self._atomic_file(filepath) as f:
+            for msg, line in zip(messages, self._encode_message_lines(messages)):
+                f.write(line)
+                days[to_local_date(msg.timestamp).isoformat()].append([offset, len(line)])
+                offset += len(line)
+        return days
+
+    @staticmethod
+    def _merge_message_segments(base: List[Message], log: List[Message]) -> List[Message]:
+        """
+        合并基础段和日志段，按 message_id 去重 (日志段中的版本优先)，并按时间排序。
+        去重可以兜住压缩过程中断时基础段和日志段的重叠。
+        """
+        # [修改] 基础段在压缩时已排序，只需把日志段归并进去，不再整体重新排序
+        log_ids = {msg.message_id for msg in log}
+        if not log_ids.isdisjoint(map(_message_id, base)):
+            base = [msg for msg in base if msg.message_id not in log_ids]
+        log = list({msg.message_id: msg for msg in log}.values())
+        return merge_sorted(base, log)
+
+    def _message_lock(self, profile_id: str) -> threading.RLock:
+        with self._message_locks_guard:
+            lock = self._message_locks.get(profile_id)
+            if lock is None:
+                lock = self._message_locks[profile_id] = threading.RLock()
+            return lock
+
+    def compact_message_log(self, profile_id: str):
+        """
+        将追加日志合并进基础段：重写排序后的基础段和主 Profile 文件，然后删除日志。
+        (save_profile 本身就是一次完整的压缩)
+        """
+        with self._message_lock(profile_id):
+            profile = self.load_profile(profile_id)
+            if profile is not None:
+                self.save_profile(profile)
+
+    def _schedule_compaction(self, profile_id: str):
+        with self._pending_lock:
+            self._pending_compactions.add(profile_id)
+        self._ensure_flusher()
+
+    def _run_pending_compactions(self):
+        """在后台线程中压缩超过阈值的追加日志 (期间同一 Profile 的追加和读取会等待压缩完成)"""
+        with self._pending_lock:
+            profile_ids, self._pending_compactions = self._pending_compactions, set()
+        for profile_id in profile_ids:
+            log_path = self.get_message_log_path(profile_id)
+            try:
+                with self._message_lock(profile_id):
+                    # 安排压缩之后可能已经被 save_profile 整体重写过了
+                    if self._file_stamp(log_path) is None or os.path.getsize(log_path) < settings.MESSAGE_LOG_COMPACT_BYTES:
+                        continue
+                    self.compact_message_log(profile_id)
+            except Exception as e:
+                print(f"!!! ERROR compacting message log for profile {profile_id}: {e}")
+
+    # --- Profile Load/Save ---
+
+    def profile_exists(self, profile_id: str) -> bool:
+        return os.path.exists(self.get_profile_path(profile_id))
+
+    def list_profile_ids(self) -> List[str]:
+        search_path = os.path.join(self.data_path, "profile_*.json")
+        return [
+            os.path.basename(filepath).replace("profile_", "").replace(".json", "")
+            for filepath in glob.glob(search_path)
+        ]
+
+    def load_profile(self, profile_id: str) -> Optional[Profile]:
+        with self._message_lock(profile_id):
+            filepath = self.get_profile_path(profile_id)
+            if not os.path.exists(filepath):
+                return None
+
+            # 1. 加载主 Profile 数据
+            profile_data = serializer.load_file(filepath)
+            # 2. [重要] 创建 Profile 对象时，忽略文件中的 'events' 字段
+            #    (旧格式的文件中 messages 仍内联在主文件里，这里一并读入)
+            profile = Profile(**{k: v for k, v in profile_data.items() if k != 'events'})
+
+            # 3. 合并消息基础段和追加日志段
+            inline_messages = profile.messages
+            base_messages = self._read_message_segment(self.get_messages_path(profile_id))
+            log_messages = self._read_message_segment(self.get_message_log_path(profile_id))
+            if inline_messages:
+                # 旧格式的内联消息 (压缩中断时可能与基础段重叠): 去重后整体排序一次
+                base_messages = sorted(
+                    {msg.message_id: msg for msg in inline_messages + base_messages}.values(), key=timestamp_key
+                )
+            # 基础段在压缩时已经排序、去重，没有日志段时直接使用
+            profile.messages = self._merge_message_segments(base_messages, log_messages) if log_messages else base_messages
+
+            # 日志段和图源索引中的 Hash 尚未写回主文件，在这里补齐 processed_sources
+            known = set(profile.processed_sources)
+            extra_sources = [msg.source_image_hash for msg in log_messages] + (self._read_sources_file(profile_id) or [])
+            for hash_val in extra_sources:
+                if hash_val and hash_val != 'manual_entry' and hash_val not in known:
+                    profile.processed_sources.append(hash_val)
+                    known.add(hash_val)
+
+            return profile
+
+    def load_profile_header(self, profile_id: str) -> Optional[Profile]:
+        filepath = self.get_profile_path(profile_id)
+        if not os.path.exists(filepath):
+            return None
+        profile_data = serializer.load_file(filepath)
+        profile = Profile(**{k: v for k, v in profile_data.items() if k not in ('events', 'messages')})
+
+        sources = self._read_sources_file(profile_id)
+        if sources is None:
+            # 旧数据没有图源索引: 生成一次 (需要完整加载一次 Profile)
+            self.load_source_hashes(profile_id)
+            sources = self._read_sources_file(profile_id) or []
+        known = set(profile.processed_sources)
+        for hash_val in sources:
+            if hash_val not in known:
+                profile.processed_sources.append(hash_val)
+                known.add(hash_val)
+        return profile
+
+    def save_profile(self, profile: Profile):
+        with self._message_lock(profile.profile_id):
+            filepath = self.get_profile_path(profile.profile_id)
+
+            # 1. [重要] 序列化时排除 events 字段；messages 单独写入 JSONL 基础段
+            profile_dict = profile.model_dump(mode='json', exclude={'events', 'messages'})
+
+            # 2. 先写基础段 (已排序)，再写主 Profile 文件，最后删除已合并的追加日志
+            #    任一步中断，读取时都会按 message_id 去重，不会丢失或重复消息
+            sorted_messages = sorted(profile.messages, key=timestamp_key)
+            messages_path = self.get_messages_path(profile.profile_id)
+            days = self._write_message_segment(messages_path, sorted_messages)
+            # 基础段的按天索引随压缩一起重建
+            self._write_base_day_index(profile.profile_id, os.path.getsize(messages_path), days)
+
+            self._atomic_write(filepath, self._encode_json()(profile_dict))
+            self._write_sources_file(profile.profile_id, profile.processed_sources)
+
+            for path in (self.get_message_log_path(profile.profile_id),
+                         self.get_day_index_log_path(profile.profile_id)):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def append_messages(self, profile_id: str, messages: List[Message]):
+        """只把新消息追加到日志段末尾，写入量与新消息数量成正比；日志过大时安排后台压缩"""
+        with self._message_lock(profile_id):
+            lines = self._encode_message_lines(messages)
+            offset = self._append_lines(self.get_message_log_path(profile_id), b"".join(lines))
+
+            # 同步追加日志段的按天索引 (同样只写新记录)
+            index_lines = []
+            for msg, line in zip(messages, lines):
+                index_lines.append(serializer.dumps([to_local_date(msg.timestamp).isoformat(), offset, len(line)]) + b"\n")
+                offset += len(line)
+            with open(self.get_day_index_log_path(profile_id), 'ab') as f:
+                f.write(b"".join(index_lines))
+
+            if offset >= settings.MESSAGE_LOG_COMPACT_BYTES:
+                # 压缩要重写全部历史，交给后台线程，不让触发它的这次写入等待
+                self._schedule_compaction(profile_id)
+
+            self.add_source_hashes(profile_id, [
+                msg.source_image_hash for msg in messages
+                if msg.source_image_hash and msg.source_image_hash != 'manual_entry'
+            ])
+
+    @staticmethod
+    def _append_lines(filepath: str, data: bytes) -> int:
+        """
+        在文件末尾追加若干完整的行，返回写入数据的起始偏移。
+        上次写入如果中断在半行，先补一个换行，避免新记录和残缺的行粘在一起。
+        """
+        prefix = b""
+        if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
+            with open(filepath, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    prefix = b"\n"
+        with open(filepath, 'ab') as f:
+            offset = f.tell() + len(prefix)
+            f.write(prefix + data)
+        return offset
+
+    # --- 已处理图源索引 (sources_{id}.txt，每行一个 Hash) ---
+
+    def _read_sources_file(self, profile_id: str) -> Optional[List[str]]:
+        """读取图源索引，文件不存在时返回 None"""
+        filepath = self.get_sources_path(profile_id)
+        if not os.path.exists(filepath):
+            return None
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+
+    def _write_sources_file(self, profile_id: str, hashes: List[str]):
+        self._atomic_write(self.get_sources_path(profile_id), "".join(h + "\n" for h in hashes).encode('utf-8'))
+
+    def load_source_hashes(self, profile_id: str) -> Set[str]:
+        with self._message_lock(profile_id):
+            hashes = self._read_sources_file(profile_id)
+            if hashes is None:
+                # 旧数据没有索引文件: 从 Profile 生成一次
+                profile = self.load_profile(profile_id)
+                if profile is None:
+                    return set()
+                self._write_sources_file(profile_id, profile.processed_sources)
+                hashes = profile.processed_sources
+            return set(hashes)
+
+    def add_source_hashes(self, profile_id: str, hashes: List[str]):
+        """只向索引文件追加新的 Hash，不重写主 Profile 文件 (下次压缩时写回)"""
+        with self._message_lock(profile_id):
+            known = self.load_source_hashes(profile_id)
+            new_hashes = []
+            for h in hashes:
+                if h not in known:
+                    known.add(h)
+                    new_hashes.append(h)
+            if new_hashes:
+                self._append_lines(self.get_sources_path(profile_id), "".join(h + "\n" for h in new_hashes).encode('utf-8'))
+
+    # --- 按天索引 (本地日期 -> 消息在 JSONL 段中的字节偏移) ---
+
+    def _write_base_day_index(self, profile_id: str, base_size: int, days: Dict[str, List[List[int]]]):
+        self._atomic_write(self.get_day_index_path(profile_id),
+                           self._encode_json()({"base_size": base_size, "days": days}))
+
+    @staticmethod
+    def _scan_segment_days(filepath: str, keep_unreadable: bool = False) -> Dict[str, List[List[int]]]:
+        """
+        扫描一个消息段，重新计算每条消息的本地日期和字节偏移 (索引缺失或过期时使用)。
+        keep_unreadable 为 True 时，无法解析的行记在空日期 "" 下，使索引项首尾相接、覆盖整个文件。
+        """
+        days = defaultdict(list)
+        if not os.path.exists(filepath):
+            return days
+        offset = 0
+        with open(filepath, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    try:
+                        ts = datetime.datetime.fromisoformat(serializer.loads(line)['timestamp'].replace('Z', '+00:00'))
+                        days[to_local_date(ts).isoformat()].append([offset, len(line)])
+                    except Exception as e:
+                        print(f"Warning: Skipping unreadable line at offset {offset} in {filepath}: {e}")
+                        if keep_unreadable:
+                            days[""].append([offset, len(line)])
+                offset += len(line)
+        return days
+
+    def _load_inline_messages(self, profile_id: str) -> List[Message]:
+        """旧格式的主文件中内联的 messages (没有字节偏移，由启动时的 migrate 压缩迁移出来)"""
+        return [Message(**data) for data in serializer.load_file(self.get_profile_path(profile_id)).get('messages') or []]
+
+    def migrate(self) -> int:
+        """把旧格式主文件中内联的 messages 压缩迁移到 JSONL 基础段，返回迁移的 Profile 数量"""
+        migrated = 0
+        for profile_id in self.list_profile_ids():
+            try:
+                if serializer.load_file(self.get_profile_path(profile_id)).get('messages'):
+                    self.compact_message_log(profile_id)
+                    migrated += 1
+            except Exception as e:
+                print(f"!!! ERROR migrating inline messages for profile {profile_id}: {e}")
+        return migrated
+
+    def _build_day_index(self, profile_id: str) -> Dict[str, List[DayIndexEntry]]:
+        """
+        读取 (必要时重建) 基础段和日志段的按天索引，合并为 {本地日期: [索引项]}。
+        只会写入索引文件本身；尚未迁移的内联消息按它们在主文件中的位置记为 "inline" 索引项。
+        """
+        base_path = self.get_messages_path(profile_id)
+        base_size = os.path.getsize(base_path) if os.path.exists(base_path) else 0
+
+        base_index = None
+        index_path = self.get_day_index_path(profile_id)
+        if os.path.exists(index_path):
+            try:
+                base_index = serializer.load_file(index_path)
+            except Exception as e:
+                print(f"Warning: Could not load day index {index_path}: {e}")
+
+        if base_index is None or base_index.get("base_size") != base_size:
+            base_index = {"base_size": base_size, "days": self._scan_segment_days(base_path)}
+            self._write_base_day_index(profile_id, base_size, base_index["days"])
+
+        index: Dict[str, List[DayIndexEntry]] = defaultdict(list)
+        for day, entries in base_index["days"].items():
+            index[day].extend(("base", offset, length) for offset, length in entries)
+        for position, msg in enumerate(self._load_inline_messages(profile_id)):
+            index[to_local_date(msg.timestamp).isoformat()].append(("inline", position, 0))
+
+        # 日志段索引: 最后一项的结尾必须正好是日志段的大小，否则 (如写入中断) 重新扫描
+        log_path = self.get_message_log_path(profile_id)
+        log_size = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+        log_index_path = self.get_day_index_log_path(profile_id)
+        log_entries = []
+        if os.path.exists(log_index_path):
+            try:
+                with open(log_index_path, 'rb') as f:
+                    log_entries = [serializer.loads(line) for line in f if line.strip()]
+            except Exception as e:
+                print(f"Warning: Could not load day index log {log_index_path}: {e}")
+                log_entries = None
+        expected_end = max((offset + length for _, offset, length in log_entries), default=0) if log_entries else 0
+        if log_entries is None or expected_end != log_size:
+            log_entries = [
+                [day, offset, length]
+                for day, entries in self._scan_segment_days(log_path, keep_unreadable=True).items()
+                for offset, length in entries
+            ]
+            log_entries.sort(key=lambda e: e[1])
+            self._atomic_write(log_index_path, b"".join(serializer.dumps(e) + b"\n" for e in log_entries))
+
+        for day, offset, length in log_entries:
+            if day:  # 空日期是无法解析的行，只用来占位
+                index[day].append(("log", offset, length))
+        return dict(index)
+
+    def _load_day_index(self, profile_id: str) -> Dict[str, List[DayIndexEntry]]:
+        stamp = tuple(self._file_stamp(p) for p in (
+            self.get_profile_path(profile_id),
+            self.get_messages_path(profile_id),
+            self.get_message_log_path(profile_id),
+            self.get_day_index_path(profile_id),
+            self.get_day_index_log_path(profile_id),
+        ))
+        return self._read_cache.get_or_load(
+            "day_index", profile_id, lambda: self._build_day_index(profile_id), stamp
+        )
+
+    def list_message_dates(self, profile_id: str) -> List[datetime.date]:
+        with self._message_lock(profile_id):
+            if not self.profile_exists(profile_id):
+                return []
+            return sorted(datetime.date.fromisoformat(day) for day in self._load_day_index(profile_id))
+
+    def load_messages_for_dates(self, profile_id: str, dates: Iterable[datetime.date]) -> List[Message]:
+        """按索引中的字节偏移直接读取指定日期的消息，耗时只与这些日期的消息数有关"""
+        with self._message_lock(profile_id):
+            if not self.profile_exists(profile_id):
+                return []
+            index = self._load_day_index(profile_id)
+            by_segment: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+            for day in set(dates):
+                for segment, offset, length in index.get(day.isoformat(), []):
+                    by_segment[segment].append((offset, length))
+
+            segment_paths = {
+                "base": self.get_messages_path(profile_id),
+                "log": self.get_message_log_path(profile_id),
+            }
+            base_messages, log_messages = [], []
+            for segment, target in (("base", base_messages), ("log", log_messages)):
+                entries = sorted(by_segment.get(segment, []))
+                if not entries:
+                    continue
+                with open(segment_paths[segment], 'rb') as f:
+                    for offset, length in entries:
+                        f.seek(offset)
+                        try:
+                            target.append(Message.model_validate_json(f.read(length)))
+                        except Exception as e:
+                            print(f"Warning: Skipping unreadable message at offset {offset} in {segment_paths[segment]}: {e}")
+            if by_segment.get("inline"):
+                # 未迁移的内联消息与基础段去重 (同 load_profile)
+                inline = self._load_inline_messages(profile_id)
+                inline_messages = [inline[position] for position, _ in by_segment["inline"] if position < len(inline)]
+                base_messages = sorted(
+                    {msg.message_id: msg for msg in inline_messages + base_messages}.values(), key=timestamp_key
+                )
+            return self._merge_message_segments(base_messages, log_messages)
+
+    # --- 时间范围 / 分页查询 (消息走按天索引，事件在一个小文件里，直接在排序后的列表上筛选) ---
+
+    def load_messages_between(self, profile_id, start=None, end=None) -> List[Message]:
+        dates = self.list_message_dates(profile_id)
+        if start is not None:
+            dates = [d for d in dates if d >= to_local_date(start)]
+        if end is not None:
+            dates = [d for d in dates if d <= to_local_date(end)]
+        return filter_by_time(self.load_messages_for_dates(profile_id, dates), start, end)
+
+    def load_page(self, kind, profile_id, cursor, limit, forward):
+        if kind == "events":
+            return page_sorted_items(self._load_sorted_events(profile_id), "event_id", cursor, limit, forward)
+
+        # 消息: 从游标所在的日期开始按天 (每批 _PAGE_CHUNK_DAYS 天) 读取，凑够一页就停止
+        dates = self.list_message_dates(profile_id)
+        if cursor is not None:
+            cursor_date = to_local_date(cursor[0])
+            dates = [d for d in dates if (d >= cursor_date if forward else d <= cursor_date)]
+        if not forward:
+            dates.reverse()
+        items: List[Message] = []
+        for i in range(0, len(dates), _PAGE_CHUNK_DAYS):
+            items = merge_sorted(items, self.load_messages_for_dates(profile_id, dates[i:i + _PAGE_CHUNK_DAYS]))
+            page, has_more = page_sorted_items(items, "message_id", cursor, limit, forward)
+            if has_more:
+                # 离游标更近的日期都已读取，这一页已经完整
+                return page, True
+        return page_sorted_items(items, "message_id", cursor, limit, forward)
+
+    def _load_sorted_events(self, profile_id: str) -> List[Event]:
+        """按时间排序的事件列表 (缓存，调用方不能修改)；有尚未落盘的写入时直接使用待写内容"""
+        filepath = self.get_event_path(profile_id)
+        if self._get_pending(filepath) is not None:
+            return sorted(self.load_events(profile_id), key=timestamp_key)
+        return self._read_cache.get_or_load(
+            "events", profile_id, lambda: sorted(self.load_events(profile_id), key=timestamp_key),
+            self._file_stamp(filepath)
+        )
+
+    def load_events_between(self, profile_id, start=None, end=None) -> List[Event]:
+        return filter_by_time(self._load_sorted_events(profile_id), start, end)
+
+    def list_event_dates(self, profile_id: str) -> List[datetime.date]:
+        return sorted({to_local_date(e.timestamp) for e in self._load_sorted_events(profile_id)})
+
+    def load_events_for_dates(self, profile_id: str, dates: Iterable[datetime.date]) -> List[Event]:
+        target_dates = set(dates)
+        return [e for e in self._load_sorted_events(profile_id) if to_local_date(e.timestamp) in target_dates]
+
+    def search_insights(self, profile_id: str, keyword: str) -> List[ContextualInsight]:
+        keyword = keyword.lower()
+        found = [i for i in self.load_insights(profile_id) if keyword in i.summary.lower()]
+        found.sort(key=lambda i: i.analysis_date, reverse=True)
+        return found
+
+    # --- Profile 目录 (catalog) ---
+
+    def _load_catalog_data(self) -> Dict[str, dict]:
+        filepath = self.get_catalog_path()
+        pending = self._get_pending(filepath)
+        if pending is not None:
+            return dict(pending)
+        if not os.path.exists(filepath):
+            return {}
+        try:
+            return serializer.load_file(filepath)
+        except Exception as e:
+            print(f"Warning: Could not load or parse catalog {filepath}: {e}")
+            return {}
+
+    def load_catalog(self) -> Dict[str, ProfileSummary]:
+        return {pid: ProfileSummary(**data) for pid, data in self._load_catalog_data().items()}
+
+    def save_catalog_entry(self, summary: ProfileSummary):
+        # 目录只包含元数据，整体重写的代价与 Profile 数量成正比，与消息数量无关
+        with self._catalog_lock:
+            catalog = self._load_catalog_data()
+            catalog[summary.profile_id] = summary.model_dump(mode='json')
+            self._write_document(self.get_catalog_path(), catalog, self._encode_json())
+
+    # --- Profile 统计信息 ---
+
+    def load_stats(self, profile_id: str) -> Optional[ProfileStats]:
+        filepath = self.get_stats_path(profile_id)
+        pending = self._get_pending(filepath)
+        if pending is not None:
+            return ProfileStats(**pending)
+        if not os.path.exists(filepath):
+            return None
+        try:
+            return ProfileStats(**serializer.load_file(filepath))
+        except Exception as e:
+            print(f"Warning: Could not load or parse stats file {filepath}: {e}")
+            return None  # 由 profile_service 重新统计
+
+    def save_stats(self, stats: ProfileStats):
+        self._write_document(self.get_stats_path(stats.profile_id), stats.model_dump(mode='json'), self._encode_json())
+
+    # --- Event Load/Save ---
+
+    def load_events(self, profile_id: str) -> List[Event]:
+        """从单独的文件加载事件列表"""
+        filepath = self.get_event_path(profile_id)
+        pending = self._get_pending(filepath)
+        if pending is not None:
+            return [Event(**event_dict) for event_dict in pending]
+        if not os.path.exists(filepath):
+            return []
+        try:
+            events_data = serializer.load_file(filepath)
+            # 使用 Pydantic 解析列表中的每个事件字典
+            return [Event(**event_dict) for event_dict in events_data]
+        except (json.JSONDecodeError, Exception) as e:
+            print(f"Warning: Could not load or parse events file {filepath}: {e}")
+            return []  # 出错时返回空列表
+
+    def save_events(self, profile_id: str, events: List[Event]):
+        """将事件列表保存到单独的文件"""
+        filepath = self.get_event_path(profile_id)
+        # 将 Event 对象列表转换为字典列表以便 JSON 序列化
+        events_dict_list = [event.model_dump(mode='json') for event in events]
+        self._write_document(filepath, events_dict_list, self._encode_json())
+
+    # --- Persona Load/Save ---
+
+    def load_user_persona(self, profile_id: str) -> Optional[UserPersona]:
+        """从单独的文件加载用户画像"""
+        filepath = self.get_user_persona_path(profile_id)
+        pending = self._get_pending(filepath)
+        if pending is not None:
+            return UserPersona(**pending)
+        if not os.path.exists(filepath):
+            return None
+        try:
+            data = serializer.load_file(filepath)
+            return UserPersona(**data)
+        except Exception as e:
+            print(f"Warning: Could not load or parse user persona {filepath}: {e}")
+            return None
+
+    def save_user_persona(self, persona: UserPersona):
+        """将用户画像保存到单独的文件"""
+        filepath = self.get_user_persona_path(persona.profile_id)
+        self._write_document(filepath, persona.model_dump(mode='json'), self._encode_json())
+
+    def load_opponent_persona(self, profile_id: str) -> Optional[OpponentPersona]:
+        """从单独的文件加载对方画像"""
+        filepath = self.get_opponent_persona_path(profile_id)
+        pending = self._get_pending(filepath)
+        if pending is not None:
+            return OpponentPersona(**pending)
+        if not os.path.exists(filepath):
+            return None
+        try:
+            data = serializer.load_file(filepath)
+            return OpponentPersona(**data)
+        except Exception as e:
+            print(f"Warning: Could not load or parse opponent persona {filepath}: {e}")
+            return None
+
+    def save_opponent_persona(self, persona: OpponentPersona):
+        """将对方画像保存到单独的文件"""
+        filepath = self.get_opponent_persona_path(persona.profile_id)
+        self._write_document(filepath, persona.model_dump(mode='json'), self._encode_json())
+
+    # --- Contextual Insight Load/Save ---
+
+    def load_insights(self, profile_id: str) -> List[ContextualInsight]:
+        """
+        从单独的文件加载上下文洞察列表。
+        兼容旧数据（可能没有 importance_score 字段）。
+        """
+        filepath = self.get_insights_path(profile_id)
+        pending = self._get_pending(filepath)
+        if pending is None and not os.path.exists(filepath):
+            return []
+        try:
+            if pending is not None:
+                data_list = [dict(data) for data in pending]
+            else:
+                data_list = serializer.load_file(filepath)
+            insights = []
+            for data in data_list:
+                # 手动处理日期和 Set 的转换
+                data['analysis_date'] = datetime.date.fromisoformat(data['analysis_date'])
+                data['processed_item_ids'] = set(data.get('processed_item_ids', []))
+
+                # 使用 Pydantic 解析，它会自动处理缺失字段 (如 importance_score) 的默认值
+                try:
+                    insights.append(ContextualInsight(**data))
+                except Exception as pydantic_error:  # 捕获可能的 Pydantic 解析错误
+                    print(f"Warning: Could not parse insight data: {data}. Error: {pydantic_error}")
+                    continue  # 跳过无法解析的数据
+
+            return insights
+        except Exception as e:
+            print(f"Warning: Could not load or parse insights {filepath}: {e}")
+            return []
+
+    def save_insights(self, profile_id: str, insights: List[ContextualInsight]):
+        """将上下文洞察列表保存到单独的文件"""
+        filepath = self.get_insights_path(profile_id)
+
+        def json_serializer(obj):
+            if isinstance(obj, datetime.date): return obj.isoformat()
+            if isinstance(obj, set): return list(obj)
+            raise TypeError(f"Type {type(obj)} not serializable")
+
+        self._write_document(
+            filepath,
+            # model_dump 会自动包含 importance_score
+            [item.model_dump(mode='json') for item in insights],
+            self._encode_json(default=json_serializer)
+        )
@@ -1,16 +1,18 @@
 from openai import AsyncOpenAI
 from app.core.config import settings
+from app.services.metering import MeteredClient
 
 # VLM 客户端 (用于解析截图)
 # 使用 VLM_API_KEY 和 VLM_API_BASE
-vlm_client = AsyncOpenAI(
+# [修改] 两个客户端都经过计量 (Token 用量 / 耗时写入账本，见 metering)
+vlm_client = MeteredClient(AsyncOpenAI(
     api_key=settings.VLM_API_KEY,
     base_url=settings.VLM_API_BASE,
-)
+), "vlm")
 
 # LLM 客户端 (未来用于对话辅助)
 # 使用 LLM_API_KEY 和 LLM_API_BASE
-llm_client = AsyncOpenAI(
+llm_client = MeteredClient(AsyncOpenAI(
     api_key=settings.LLM_API_KEY,
     base_url=settings.LLM_API_BASE,
-)
\ No newline at end of file
+), "llm")
\ No newline at end of file
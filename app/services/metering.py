@@ -0,0 +1,285 @@
+"""
+[新增] LLM / VLM 调用计量。
+
+llm_client / vlm_client 外面包一层 MeteredClient: 每次 chat.completions.create 调用都记录
+prompt / completion / total tokens 和耗时，并按 Profile、接口 (路由或后台任务类型)、模型打标签，
+写入一个滚动保留 METERING_RETENTION_DAYS 天的 SQLite 账本 (METERING_DB_PATH)。
+
+标签通过 contextvars 传递: 每个 HTTP 请求由 tag_request (应用级依赖) 设置，后台任务由 job_service 设置；
+在其中创建的 asyncio Task (如并发解析截图) 会继承这些标签。
+
+每个 Profile 可以设置每日 Token 预算 (默认 DAILY_TOKEN_BUDGET，0 表示不限)，
+超出后新的后台任务会被拒绝，已排队的任务推迟到第二天执行 (见 job_service)。
+"""
+import asyncio
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar, copy_context
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from fastapi import Request
+
+from app.core.config import settings
+from app.core.models import BudgetStatus, UsageBucket
+from app.services.storage_backend import LOCAL_TZ, to_local_date
+
+_tags: ContextVar[Dict[str, Optional[str]]] = ContextVar("metering_tags", default={})
+
+# 可用于分组的列 (也是账本的标签列)
+GROUP_COLUMNS = ("day", "profile_id", "endpoint", "model", "client")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT NOT NULL,
+    day TEXT NOT NULL,
+    profile_id TEXT,
+    endpoint TEXT,
+    model TEXT,
+    client TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    latency_ms REAL NOT NULL,
+    success INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_usage_day ON usage (day);
+CREATE INDEX IF NOT EXISTS idx_usage_profile_day ON usage (profile_id, day);
+CREATE TABLE IF NOT EXISTS budgets (
+    profile_id TEXT PRIMARY KEY,
+    daily_tokens INTEGER NOT NULL
+);
+"""
+
+
+def set_tags(**tags: Optional[str]):
+    """为当前上下文 (请求 / 任务) 设置计量标签 (profile_id、endpoint)"""
+    _tags.set({**_tags.get(), **tags})
+
+
+def current_tags() -> Dict[str, Optional[str]]:
+    return _tags.get()
+
+
+async def tag_request(request: Request):
+    """应用级依赖: 以路由模板 (不含具体 id) 作为 endpoint 标签，路径参数中的 profile_id 作为 Profile 标签"""
+    route = request.scope.get("route")
+    set_tags(
+        endpoint=f"{request.method} {getattr(route, 'path', request.url.path)}",
+        profile_id=request.path_params.get("profile_id"),
+    )
+
+
+def today() -> datetime.date:
+    """预算和按天统计都按本地日期"""
+    return to_local_date(datetime.datetime.now(datetime.timezone.utc))
+
+
+class UsageLedger:
+    """调用账本和每个 Profile 的预算设置，独立的 SQLite 文件"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._last_prune = 0.0
+
+    def record(self, client: str, model: Optional[str], prompt_tokens: int, completion_tokens: int,
+               total_tokens: int, latency_ms: float, success: bool):
+        tags = current_tags()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO usage (ts, day, profile_id, endpoint, model, client, prompt_tokens, completion_tokens, "
+                "total_tokens, latency_ms, success) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (now.isoformat(), to_local_date(now).isoformat(), tags.get("profile_id"), tags.get("endpoint"),
+                 model, client, prompt_tokens, completion_tokens, total_tokens, latency_ms, int(success))
+            )
+        if time.monotonic() - self._last_prune > 3600:
+            self.prune()
+
+    def prune(self):
+        """删除保留期之前的记录 (最多每小时一次，随写入触发)"""
+        self._last_prune = time.monotonic()
+        cutoff = today() - datetime.timedelta(days=settings.METERING_RETENTION_DAYS)
+        with self._lock, self._conn:
+            deleted = self._conn.execute("DELETE FROM usage WHERE day < ?", (cutoff.isoformat(),)).rowcount
+        if deleted:
+            print(f"[Metering] Pruned {deleted} usage records before {cutoff.isoformat()}")
+
+    def aggregate(
+            self,
+            group_by: List[str],
+            profile_id: Optional[str] = None,
+            since: Optional[datetime.date] = None,
+            until: Optional[datetime.date] = None
+    ) -> List[UsageBucket]:
+        columns = [column for column in group_by if column in GROUP_COLUMNS]
+        clauses, args = [], []
+        if profile_id:
+            clauses.append("profile_id = ?")
+            args.append(profile_id)
+        if since:
+            clauses.append("day >= ?")
+            args.append(since.isoformat())
+        if until:
+            clauses.append("day <= ?")
+            args.append(until.isoformat())
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        select = "".join(f"{column}, " for column in columns)
+        group = f"GROUP BY {', '.join(columns)} ORDER BY {', '.join(columns)}" if columns else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {select}COUNT(*), SUM(1 - success), SUM(prompt_tokens), SUM(completion_tokens), "
+                f"SUM(total_tokens), SUM(latency_ms), MAX(latency_ms) FROM usage {where} {group}", args
+            ).fetchall()
+        buckets = []
+        for row in rows:
+            keys, (calls, failed, prompt, completion, total, latency, max_latency) = row[:len(columns)], row[len(columns):]
+            if not calls:
+                continue
+            buckets.append(UsageBucket(
+                **dict(zip(columns, keys)),
+                calls=calls, failed_calls=failed, prompt_tokens=prompt, completion_tokens=completion,
+                total_tokens=total, total_latency_ms=latency, avg_latency_ms=latency / calls, max_latency_ms=max_latency
+            ))
+        return buckets
+
+    def tokens_on(self, profile_id: str, day: datetime.date) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COALESCE(SUM(total_tokens), 0) FROM usage WHERE profile_id = ? AND day = ?",
+                (profile_id, day.isoformat())
+            ).fetchone()
+        return row[0]
+
+    def get_budget(self, profile_id: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute("SELECT daily_tokens FROM budgets WHERE profile_id = ?", (profile_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_budget(self, profile_id: str, daily_tokens: Optional[int]):
+        with self._lock, self._conn:
+            if daily_tokens is None:
+                self._conn.execute("DELETE FROM budgets WHERE profile_id = ?", (profile_id,))
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO budgets (profile_id, daily_tokens) VALUES (?, ?)", (profile_id, daily_tokens)
+                )
+
+
+_ledger: Optional[UsageLedger] = None
+
+
+def get_ledger() -> UsageLedger:
+    global _ledger
+    if _ledger is None:
+        _ledger = UsageLedger(settings.METERING_DB_PATH)
+    return _ledger
+
+
+def _record_call(client: str, model: Optional[str], usage: Any, latency_ms: float, success: bool):
+    if not settings.METERING_ENABLED:
+        return
+    try:
+        get_ledger().record(
+            client, model,
+            getattr(usage, "prompt_tokens", 0) or 0,
+            getattr(usage, "completion_tokens", 0) or 0,
+            getattr(usage, "total_tokens", 0) or 0,
+            latency_ms, success
+        )
+    except Exception as e:
+        # 计量失败不能影响业务调用
+        print(f"Warning: Could not record {client} usage: {e}")
+
+
+def _record_in_thread(*args) -> asyncio.Future:
+    """在线程池中写账本 (SQLite 写入和提交不占用事件循环)；_record_call 自己吞掉异常，返回的 Future 不会失败"""
+    loop = asyncio.get_running_loop()
+    try:
+        # 在调用方上下文的副本中执行，计量标签 (contextvars) 随之带到线程里
+        return loop.run_in_executor(None, copy_context().run, _record_call, *args)
+    except RuntimeError:
+        # 线程池已关闭 (应用退出过程中)，直接写入
+        _record_call(*args)
+        done = loop.create_future()
+        done.set_result(None)
+        return done
+
+
+class _MeteredCompletions:
+    def __init__(self, completions, client_name: str):
+        self._completions = completions
+        self._client_name = client_name
+
+    async def create(self, **kwargs):
+        started = time.perf_counter()
+        try:
+            completion = await self._completions.create(**kwargs)
+        except BaseException:
+            # 失败 (包括被取消) 的调用不等待记录完成，直接抛出原来的异常
+            _record_in_thread(self._client_name, kwargs.get("model"), None, (time.perf_counter() - started) * 1000, False)
+            raise
+        # 等待写入完成，返回后立刻查询用量 / 预算也能看到这次调用；shield 保证调用方被取消时记录照常写入
+        await asyncio.shield(_record_in_thread(
+            self._client_name, kwargs.get("model"), getattr(completion, "usage", None),
+            (time.perf_counter() - started) * 1000, True
+        ))
+        return completion
+
+
+class MeteredClient:
+    """包装 AsyncOpenAI: chat.completions.create 经过计量，其余属性原样转发"""
+
+    def __init__(self, client, name: str):
+        self._client = client
+        self.chat = SimpleNamespace(completions=_MeteredCompletions(client.chat.completions, name))
+
+    def __getattr__(self, item):
+        return getattr(self._client, item)
+
+
+# --- 预算 ---
+
+def get_daily_budget(profile_id: str) -> int:
+    """该 Profile 的每日 Token 预算 (单独设置的优先，否则为 DAILY_TOKEN_BUDGET)；0 表示不限"""
+    budget = get_ledger().get_budget(profile_id)
+    return settings.DAILY_TOKEN_BUDGET if budget is None else budget
+
+
+def get_budget_status(profile_id: str) -> BudgetStatus:
+    day = today()
+    budget = get_daily_budget(profile_id)
+    used = get_ledger().tokens_on(profile_id, day)
+    return BudgetStatus(
+        profile_id=profile_id,
+        day=day,
+        daily_token_budget=budget,
+        used_tokens=used,
+        remaining_tokens=max(budget - used, 0) if budget else None,
+        exceeded=bool(budget) and used >= budget,
+        custom=get_ledger().get_budget(profile_id) is not None,
+    )
+
+
+def budget_exceeded(profile_id: str) -> bool:
+    if not settings.METERING_ENABLED:
+        return False
+    budget = get_daily_budget(profile_id)
+    return bool(budget) and get_ledger().tokens_on(profile_id, today()) >= budget
+
+
+def seconds_until_tomorrow() -> float:
+    """距离本地时间的下一个 0 点的秒数 (被推迟的任务在这之后重新检查预算)"""
+    local_now = datetime.datetime.now(LOCAL_TZ)
+    tomorrow = datetime.datetime.combine(local_now.date() + datetime.timedelta(days=1), datetime.time(), LOCAL_TZ)
+    return max((tomorrow - local_now).total_seconds(), 1.0)
@@ -0,0 +1,94 @@
+"""
+[新增] 近似重复截图检测 (在调用 VLM 之前)。
+
+按 SHA-256 去重只能发现完全相同的文件；同一屏内容重新截取、被聊天软件重新压缩或略有裁剪后
+Hash 就变了，又会产生一次 VLM 调用。这里为每张新上传的截图计算 dHash (在预处理进程池中)，
+与该 Profile 已导入截图的 dHash 索引以及同批次中之前的截图比较汉明距离。
+
+聊天截图的布局高度相似，文字不同的两张截图 dHash 也可能非常接近，因此默认只报告、仍然解析。
+开启 NEAR_DUPLICATE_SKIP 后，dHash 足够接近的截图还要与对方逐像素比较，确认内容相同才跳过。
+"""
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.models import NearDuplicate
+from app.services import profile_service
+from app.services.blob_store import get_image_store, get_phash_store
+from app.services.image_preprocess import compare_images, compute_dhash
+
+Upload = Tuple[int, str, bytes]  # (在 files 中的下标, image_hash, image_bytes)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+async def _load_image(image_hash: str, batch_images: Dict[str, bytes]) -> Optional[bytes]:
+    """同批次的截图直接使用上传内容，之前导入的截图从图片存储读取 (可能已被淘汰)"""
+    if image_hash in batch_images:
+        return batch_images[image_hash]
+    try:
+        return await asyncio.to_thread(get_image_store().get, image_hash)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not load image {image_hash} for comparison: {e}")
+        return None
+
+
+async def filter_near_duplicates(
+        profile_id: str,
+        uploads: List[Upload],
+        force: bool = False
+) -> Tuple[List[Upload], List[NearDuplicate]]:
+    """
+    返回 (需要解析的上传, 检测到的近似重复)。
+    只有开启 NEAR_DUPLICATE_SKIP 且逐像素比较确认内容相同的截图才被跳过；
+    force 为 True 时近似重复的截图一律解析，只在结果中报告。
+    """
+    if not settings.NEAR_DUPLICATE_ENABLED or not uploads:
+        return uploads, []
+
+    dhashes = await asyncio.gather(*(compute_dhash(image_bytes) for _, _, image_bytes in uploads))
+    store = get_phash_store()
+    for (_, image_hash, _), dhash in zip(uploads, dhashes):
+        if dhash is not None:
+            try:
+                store.put(image_hash, dhash.encode('ascii'), overwrite=False)
+            except OSError as e:
+                print(f"Warning: Could not store perceptual hash for {image_hash}: {e}")
+
+    may_skip = settings.NEAR_DUPLICATE_SKIP and not force
+    known = list(profile_service.load_dhash_index(profile_id).items())
+    batch_images: Dict[str, bytes] = {}
+    kept, near_duplicates = [], []
+    for upload, dhash in zip(uploads, dhashes):
+        index, image_hash, image_bytes = upload
+        if dhash is None:
+            kept.append(upload)  # 无法识别的图片交给后续流程报错
+            continue
+        value = int(dhash, 16)
+        match = min(
+            ((hamming_distance(value, other), other_hash) for other_hash, other in known if other_hash != image_hash),
+            default=None
+        )
+        if match is not None and match[0] <= settings.NEAR_DUPLICATE_MAX_DISTANCE:
+            distance, duplicate_of = match
+            pixel_difference = None
+            if may_skip and distance <= settings.NEAR_DUPLICATE_SKIP_MAX_DISTANCE:
+                other_bytes = await _load_image(duplicate_of, batch_images)
+                if other_bytes is not None:
+                    pixel_difference = await compare_images(image_bytes, other_bytes)
+            skipped = pixel_difference is not None and pixel_difference <= settings.NEAR_DUPLICATE_MAX_PIXEL_DIFF
+            near_duplicates.append(NearDuplicate(
+                index=index, image_hash=image_hash, duplicate_of=duplicate_of, distance=distance,
+                pixel_difference=pixel_difference, skipped=skipped
+            ))
+            print(f"[Near Duplicate] {image_hash[:12]} ~ {duplicate_of[:12]} (distance {distance}"
+                  f"{'' if pixel_difference is None else f', pixel difference {pixel_difference:.4f}'})"
+                  f"{', skipped' if skipped else ', parsing anyway'}")
+            if skipped:
+                continue
+        kept.append(upload)
+        known.append((image_hash, value))
+        batch_images[image_hash] = image_bytes
+    return kept, near_duplicates
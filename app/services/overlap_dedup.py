@@ -0,0 +1,182 @@
+"""
+[新增] 截图之间重叠消息的去重。
+
+连续的聊天截图通常会重叠几条气泡，逐张解析后这些消息会重复出现。这里把每条消息
+映射为指纹 (发送者, 类型, 归一化文本)，用 KMP 在线性时间内找出 "前文的后缀 == 当前截图的前缀"
+的最长重叠，再用消息上识别出的时间 (非自动填充的) 校验对齐: 对齐位置上时间冲突时退回到更短的重叠。
+
+前文由 Profile 中最新的若干条消息和本批次中之前截图保留下来的消息组成，按上传顺序逐张合并。
+同样的对齐也用于拼接一张长截图切片解析的结果 (stitch_tiles)。
+"""
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.models import ImportResult, Message
+from app.services import profile_service
+from app.services.storage_backend import normalize_to_utc
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+Fingerprint = Tuple[str, str, str]
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """全半角 / 大小写统一，去掉空白和标点 (OCR 对这些最不稳定)；只剩标点或表情时保留去空白后的原文"""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return _NON_WORD.sub("", text) or "".join(text.split())
+
+
+def message_fingerprint(msg: Message) -> Fingerprint:
+    if msg.is_editable:
+        # VLM 失败的模板永远不与其他消息相同
+        return ("", "error", msg.message_id)
+    return (msg.sender, msg.content_type, normalize_text(msg.text))
+
+
+def _times_conflict(a: Message, b: Message) -> bool:
+    """两条消息都带有从截图中识别出的时间且不一致 (只比较到分钟；日期都识别出时才比较日期)"""
+    if a.auto_filled_time or b.auto_filled_time:
+        return False
+    ta, tb = normalize_to_utc(a.timestamp), normalize_to_utc(b.timestamp)
+    if not (a.auto_filled_date or b.auto_filled_date):
+        return ta.replace(second=0, microsecond=0) != tb.replace(second=0, microsecond=0)
+    return (ta.hour, ta.minute) != (tb.hour, tb.minute)
+
+
+def _failure_table(pattern: List[Fingerprint]) -> List[int]:
+    """KMP 前缀函数: failure[i] 为 pattern[:i+1] 的最长真前后缀长度"""
+    failure = [0] * len(pattern)
+    k = 0
+    for i in range(1, len(pattern)):
+        while k and pattern[i] != pattern[k]:
+            k = failure[k - 1]
+        if pattern[i] == pattern[k]:
+            k += 1
+        failure[i] = k
+    return failure
+
+
+def find_overlap(previous: List[Message], current: List[Message], min_overlap: int = 1) -> int:
+    """
+    返回 current 开头有多少条消息与 previous 的结尾重复 (0 表示没有重叠)。
+    O(len(previous) + len(current))；候选重叠按长度从大到小逐个校验时间。
+    """
+    if not previous or not current:
+        return 0
+    pattern = [message_fingerprint(m) for m in current]
+    failure = _failure_table(pattern)
+    # 重叠不可能比 current 更长，只需扫描 previous 的最后 len(current) 条
+    q = 0
+    for msg in previous[-len(pattern):]:
+        fp = message_fingerprint(msg)
+        while q and (q == len(pattern) or pattern[q] != fp):
+            q = failure[q - 1]
+        if pattern[q] == fp:
+            q += 1
+
+    # q 是最长的 "previous 后缀 == current 前缀"；沿前缀函数依次得到更短的候选
+    while q >= max(1, min_overlap):
+        offset = len(previous) - q
+        if not any(_times_conflict(previous[offset + i], current[i]) for i in range(q)):
+            return q
+        q = failure[q - 1]
+    return 0
+
+
+def _is_fragment(part: Message, whole: Message) -> bool:
+    """part 是否可能是 whole 在切片边缘被截断后识别出的一部分 (完全相同也算)"""
+    if part.is_editable or whole.is_editable or (part.sender, part.content_type) != (whole.sender, whole.content_type):
+        return False
+    part_text = normalize_text(part.text)
+    return bool(part_text) and part_text in normalize_text(whole.text)
+
+
+def _stitch_pair(previous: List[Message], current: List[Message]) -> List[Message]:
+    if not previous or not current:
+        return previous + current
+    # 切口处的气泡可能只有一部分: 下一片开头是上一片末尾某条的片段，或上一片最后一条是下一片开头某条的片段
+    cut_head = any(_is_fragment(current[0], msg) for msg in previous[-3:])
+    cut_tail = any(_is_fragment(previous[-1], msg) for msg in current[:3])
+    candidates = [(previous, current)]
+    if cut_head:
+        candidates.append((previous, current[1:]))
+    if cut_tail:
+        candidates.append((previous[:-1], current))
+    if cut_head and cut_tail:
+        candidates.append((previous[:-1], current[1:]))
+    for head, tail in candidates:
+        # 同一张图相邻的片必然重叠，一条相同的消息就足以对齐
+        overlap = find_overlap(head, tail, min_overlap=1)
+        if overlap:
+            return head + tail[overlap:]
+    # 重叠区只有一条被截断的气泡
+    if cut_tail:
+        return previous[:-1] + current
+    if cut_head:
+        return previous + current[1:]
+    return previous + current
+
+
+def stitch_tiles(tiles: List[List[Message]]) -> List[Message]:
+    """[新增] 把长截图各片 (从上到下) 的解析结果拼接起来，去掉相邻片重叠区域重复识别的气泡"""
+    merged: List[Message] = []
+    for messages in tiles:
+        merged = _stitch_pair(merged, list(messages))
+    return merged
+
+
+class OverlapMerger:
+    """
+    按上传顺序合并一批截图的解析结果，去掉每张截图开头与前文重叠的消息。
+    结果可以按完成顺序 add，只有前面的截图都已到达时才能确定它的重叠，因此按输入顺序产出。
+    """
+
+    def __init__(self, tail: Optional[List[Message]] = None, min_overlap: Optional[int] = None, context_size: int = 200):
+        self.min_overlap = settings.OVERLAP_MIN_MESSAGES if min_overlap is None else min_overlap
+        self.context_size = context_size
+        self._context: List[Message] = list(tail or [])[-context_size:]
+        self._pending: Dict[int, ImportResult] = {}
+        self._next_index = 0
+
+    def add(self, index: int, result: ImportResult) -> List[Tuple[int, ImportResult]]:
+        """加入第 index 张截图的结果，返回现在可以确定的 (下标, 去重后的结果)，按下标升序"""
+        self._pending[index] = result
+        ready = []
+        while self._next_index in self._pending:
+            ready.append((self._next_index, self._merge(self._pending.pop(self._next_index))))
+            self._next_index += 1
+        return ready
+
+    def _merge(self, result: ImportResult) -> ImportResult:
+        if all(msg.is_editable for msg in result.messages):
+            return result  # 解析失败的截图不参与对齐，也不打断前后截图的对齐
+        overlap = find_overlap(self._context, result.messages, self.min_overlap)
+        kept = result.messages[overlap:]
+        self._context.extend(msg for msg in kept if not msg.is_editable)
+        del self._context[:-self.context_size]
+        if not overlap:
+            return result
+        print(f"[Overlap Dedup] Dropped {overlap} overlapping messages from {result.image_hash[:12]}")
+        return result.model_copy(update={"messages": kept, "duplicates_removed": overlap})
+
+
+def load_profile_tail(profile_id: str) -> List[Message]:
+    """Profile 中最新的 OVERLAP_PROFILE_TAIL 条消息 (时间升序)，作为第一张截图的前文"""
+    if not settings.OVERLAP_DEDUP_ENABLED or settings.OVERLAP_PROFILE_TAIL <= 0:
+        return []
+    return profile_service.get_message_page(profile_id, limit=settings.OVERLAP_PROFILE_TAIL, direction="backward").items
+
+
+def merge_overlaps(results: List[ImportResult], tail: Optional[List[Message]] = None) -> List[ImportResult]:
+    """对按上传顺序排列的一批结果去重 (OVERLAP_DEDUP_ENABLED 关闭时原样返回)"""
+    if not settings.OVERLAP_DEDUP_ENABLED:
+        return results
+    merger = OverlapMerger(tail)
+    merged = []
+    for index, result in enumerate(results):
+        merged.extend(result for _, result in merger.add(index, result))
+    return merged
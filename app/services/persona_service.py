@@ -2,7 +2,7 @@
 
 import json
 import datetime
-from typing import Dict, Any, List, Set, Tuple, Union  # [!!] 修复：导入 Union
+from typing import Callable, Dict, Any, List, Optional, Set, Tuple, Union  # [!!] 修复：导入 Union
 from zoneinfo import ZoneInfo
 from fastapi import HTTPException
 
@@ -140,25 +140,31 @@ async def extract_opponent_basic_info(profile_id: str, description: str) -> Oppo
 
 
 # --- [!!! 修改核心自动分析逻辑 !!!] ---
-async def analyze_profile_incrementally(profile_id: str) -> Dict[str, Any]:
+async def analyze_profile_incrementally(
+        profile_id: str,
+        on_progress: Optional[Callable[[int, int], None]] = None
+) -> Dict[str, Any]:
     """
     [Phase 2 - 核心自动分析 - 已修改]
     按天进行:
     1. 提取当天信息更新 Opponent basic_info。
     2. 生成当天 ContextualInsight 摘要，并计算重要性评分。
     3. 基于前一天 chat_analysis 和当天日志，更新 Opponent chat_analysis。
+    [新增] on_progress(已处理天数, 总天数) 在每天开始前和全部结束后调用 (后台任务用来汇报进度)。
     """
     # ... (1. 获取日期范围 - 不变) ...
     # ... (2. 加载 Profile 数据 - 不变) ...
     # ... (3. 加载现有 Insights - 不变) ...
     # ... (4. 加载 Opponent Persona - 不变) ...
-    date_range = profile_service.get_profile_date_range(profile_id)
-    if not date_range: raise HTTPException(status_code=400, detail="无法确定日期范围，可能没有数据。")
-    min_date, max_date = date_range
-    try: profile = profile_service.get_profile(profile_id)
-    except HTTPException as e: raise e
+    # [修改] 日期范围、有数据的日期都来自写入时维护的统计信息，名称来自目录，不再加载全部消息
+    stats = profile_service.get_profile_stats(profile_id)
+    if stats.min_date is None: raise HTTPException(status_code=400, detail="无法确定日期范围，可能没有数据。")
+    min_date, max_date = stats.min_date, stats.max_date
+    profile = profile_service.get_profile_summary(profile_id)
     existing_insights = profile_service.load_insights(profile_id)
     analyzed_dates = {insight.analysis_date for insight in existing_insights}
+    # 每天的数据只按天读取
+    active_dates = set(stats.day_counts)
     opponent_persona = profile_service.load_opponent_persona(profile_id)
     if not opponent_persona: opponent_persona = OpponentPersona(profile_id=profile_id)
 
@@ -170,6 +176,7 @@ async def analyze_profile_incrementally(profile_id: str) -> Dict[str, Any]:
     new_insights_list = []
 
     while current_date <= max_date:
+        if on_progress: on_progress((current_date - min_date).days, total_days)
         print(f"--- Analyzing date: {current_date.isoformat()} for profile {profile_id} ---")
 
         # 检查是否已分析 (不变)
@@ -180,9 +187,13 @@ async def analyze_profile_incrementally(profile_id: str) -> Dict[str, Any]:
             continue
 
         # [!!] 修改: 获取消息数和事件数
-        # 格式化当天数据 (现在返回4个值)
+        # 格式化当天数据 (现在返回4个值)；没有数据的日期不读取
+        day_messages, day_events = [], []
+        if current_date in active_dates:
+            day_messages = profile_service.get_messages_for_dates(profile_id, [current_date])
+            day_events = profile_service.get_events_for_dates(profile_id, [current_date])
         chat_log, processed_ids, day_message_count, day_event_count = _format_data_for_llm(
-            profile.messages, profile.events, profile.user_name, profile.opponent_name, current_date
+            day_messages, day_events, profile.user_name, profile.opponent_name, current_date
         )
 
         # 如果当天没有数据，则跳过 (不变)
@@ -241,6 +252,7 @@ async def analyze_profile_incrementally(profile_id: str) -> Dict[str, Any]:
 
         # 移动到下一天 (不变)
         current_date += datetime.timedelta(days=1)
+    if on_progress: on_progress(total_days, total_days)
 
     # 6. 循环结束后，统一保存更新 (不变)
     try:
@@ -0,0 +1,99 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class VersionedLRUCache:
+    """
+    按 (kind, profile_id) 缓存已解析的对象 (Profile / 事件 / 洞察 / 画像)。
+
+    每个条目记录写入时的两个版本信息:
+    - 进程内的 per-profile 版本号: 由 save_* 调用 invalidate() 递增；
+    - 存储后端提供的 stamp (JSON 后端为文件 mtime/size)，可以发现进程外的修改。
+    两者任一变化，条目即视为失效。超过容量时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[int, Hashable, Any]]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_load(
+            self,
+            kind: str,
+            profile_id: str,
+            loader: Callable[[], Any],
+            stamp: Optional[Hashable] = None
+    ) -> Any:
+        key = (kind, profile_id)
+        with self._lock:
+            version = self._versions.get(profile_id, 0)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version and entry[1] == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        # 在锁外加载，避免慢 IO 阻塞其他 Profile 的读取
+        value = loader()
+
+        with self._lock:
+            # 加载期间如果发生了写入，版本号已变化，结果不再缓存
+            if self._versions.get(profile_id, 0) == version and self.max_entries > 0:
+                self._entries[key] = (version, stamp, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def peek(self, kind: str, profile_id: str, stamp: Optional[Hashable] = None) -> Any:
+        """返回仍然有效的缓存值，没有时返回 None (不会触发加载)"""
+        with self._lock:
+            entry = self._entries.get((kind, profile_id))
+            if entry is not None and entry[0] == self._versions.get(profile_id, 0) and entry[1] == stamp:
+                return entry[2]
+            return None
+
+    def put(self, kind: str, profile_id: str, value: Any, stamp: Optional[Hashable] = None):
+        """
+        直接写入一个缓存值 (对应当前版本号)。
+        用于写入后就地更新缓存，例如把新消息合并进已缓存的 Profile，而不是失效后整体重新加载。
+        """
+        with self._lock:
+            if self.max_entries <= 0:
+                return
+            key = (kind, profile_id)
+            self._entries[key] = (self._versions.get(profile_id, 0), stamp, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, profile_id: str):
+        """递增该 Profile 的版本号，并丢弃它的所有缓存条目"""
+        with self._lock:
+            self._versions[profile_id] = self._versions.get(profile_id, 0) + 1
+            for key in [k for k in self._entries if k[1] == profile_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
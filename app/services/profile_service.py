@@ -1,218 +1,557 @@
-import json
-import os
 # [MODIFIED] 导入 List 和 Optional
-from typing import List, Optional, Tuple, Set
-from app.core.config import settings
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Set
 # [MODIFIED] 导入所有需要的模型，包括新的 Persona 和 Insight 模型
 from app.core.models import (
     Profile, Message, Event, UpdateProfileNamesRequest,
-    UserPersona, OpponentPersona, ContextualInsight
+    UserPersona, OpponentPersona, ContextualInsight,
+    ProfileSummary, ProfileSummaryPage, MessagePage, EventPage, ProfileStats, DayCount
 )
 from fastapi import HTTPException
-import glob
+import asyncio
+import bisect
+import hashlib
+from collections import defaultdict
 import datetime
-from zoneinfo import ZoneInfo # [新增] 用于时区转换
+import operator
+import threading
+
+from app.core.config import settings
+# [新增] 所有读写都经由可插拔的存储后端 (settings.STORAGE_BACKEND: json / sqlite)
+from app.services.storage_backend import (
+    get_storage, to_local_date, normalize_to_utc as _normalize_to_utc,
+    timestamp_key, with_utc_timestamp, merge_sorted
+)
+from app.services.profile_cache import VersionedLRUCache
+from app.services.blob_store import get_raw_output_store, get_image_store, get_phash_store
+from app.services import serializer
+
+# [新增] 已解析对象的进程内缓存。save_* 会递增对应 Profile 的版本号使其失效；
+# JSON 后端还会用文件 mtime/size 校验，进程外的修改同样能被发现。
+# 注意: 缓存返回的是容器的浅拷贝，列表可以随意修改，但不要原地修改其中的 Message / Event 对象。
+_cache = VersionedLRUCache(settings.PROFILE_CACHE_SIZE)
+_message_id = operator.attrgetter("message_id")
+
+
+def _cached(kind: str, profile_id: str, loader, stamp_kind: Optional[str] = None):
+    """stamp_kind: 由哪类存储数据派生 (默认与 kind 相同)，用于校验进程外的修改"""
+    storage = get_storage()
+    return _cache.get_or_load(kind, profile_id, loader, storage.get_version_stamp(profile_id, stamp_kind or kind))
+
+
+def get_cache_stats() -> dict:
+    """返回缓存的命中 / 未命中计数等统计信息"""
+    return _cache.stats()
+
+
+# --- [新增] 每个 Profile 的锁 ---
+# 同一 Profile 上的 读-改-写 (如追加事件、改名) 需要串行，否则并发请求会互相覆盖。
+# 同步函数 (在线程池中执行) 使用可重入的 threading 锁；
+# 跨 await 的流程 (如 LLM 分析后保存洞察 / 画像) 在外层再使用 asyncio 锁。
+
+_locks_guard = threading.Lock()
+_profile_locks: Dict[str, threading.RLock] = {}
+_async_profile_locks: Dict[str, asyncio.Lock] = {}
+
+
+def profile_lock(profile_id: str) -> threading.RLock:
+    with _locks_guard:
+        lock = _profile_locks.get(profile_id)
+        if lock is None:
+            lock = _profile_locks[profile_id] = threading.RLock()
+        return lock
+
+
+def async_profile_lock(profile_id: str) -> asyncio.Lock:
+    with _locks_guard:
+        lock = _async_profile_locks.get(profile_id)
+        if lock is None:
+            lock = _async_profile_locks[profile_id] = asyncio.Lock()
+        return lock
+
+
+# --- [新增] Profile 统计信息 ---
+# 计数、时间范围、每天条数在每次写入时增量更新；日期范围 / 概览查询直接读取统计记录，不加载消息。
+# 目录条目 (catalog) 中的计数和日期范围也由统计记录派生。
+
+def _load_stats(profile_id: str) -> Optional[ProfileStats]:
+    return _cached("stats", profile_id, lambda: get_storage().load_stats(profile_id))
+
+
+def _timestamp_bounds(items, *known: Optional[datetime.datetime]):
+    """items 的时间戳 (UTC) 与已知边界合并后的 (最早, 最晚)"""
+    timestamps = [_normalize_to_utc(item.timestamp) for item in items]
+    timestamps.extend(ts for ts in known if ts is not None)
+    return min(timestamps, default=None), max(timestamps, default=None)
+
+
+def _count_by_day(stats: ProfileStats, items, field: str, replace: bool) -> Dict[datetime.date, DayCount]:
+    """把 items 计入每天的条数 (field: messages / events)；replace 为 True 时先清零该字段"""
+    day_counts = {day: count.model_copy() for day, count in stats.day_counts.items()}
+    if replace:
+        for count in day_counts.values():
+            setattr(count, field, 0)
+    for item in items:
+        day = to_local_date(item.timestamp)
+        count = day_counts.get(day)
+        if count is None:
+            count = day_counts[day] = DayCount()
+        setattr(count, field, getattr(count, field) + 1)
+    return {day: count for day, count in sorted(day_counts.items()) if count.messages or count.events}
+
+
+def _finish_stats(stats: ProfileStats, update: dict) -> ProfileStats:
+    """应用更新并重新计算合并后的时间范围"""
+    stats = stats.model_copy(update=update)
+    min_ts = min((ts for ts in (stats.message_min_ts, stats.event_min_ts) if ts), default=None)
+    max_ts = max((ts for ts in (stats.message_max_ts, stats.event_max_ts) if ts), default=None)
+    return stats.model_copy(update={
+        "min_timestamp": min_ts,
+        "max_timestamp": max_ts,
+        "min_date": to_local_date(min_ts) if min_ts else None,
+        "max_date": to_local_date(max_ts) if max_ts else None,
+        "updated_at": datetime.datetime.now(datetime.timezone.utc),
+    })
+
+
+def _stats_with_messages(stats: ProfileStats, messages: List[Message], replace: bool = False) -> ProfileStats:
+    """replace 为 False 时把 messages 作为新增消息计入；为 True 时以 messages 为全部消息重新统计"""
+    known = () if replace else (stats.message_min_ts, stats.message_max_ts)
+    min_ts, max_ts = _timestamp_bounds(messages, *known)
+    return _finish_stats(stats, {
+        "message_count": len(messages) + (0 if replace else stats.message_count),
+        "message_min_ts": min_ts,
+        "message_max_ts": max_ts,
+        "day_counts": _count_by_day(stats, messages, "messages", replace),
+    })
+
+
+def _stats_with_events(stats: ProfileStats, events: List[Event]) -> ProfileStats:
+    """事件列表总是整体保存，以 events 为全部事件重新统计事件部分"""
+    min_ts, max_ts = _timestamp_bounds(events)
+    return _finish_stats(stats, {
+        "event_count": len(events),
+        "event_min_ts": min_ts,
+        "event_max_ts": max_ts,
+        "day_counts": _count_by_day(stats, events, "events", replace=True),
+    })
+
+
+def _build_stats(profile: Profile) -> ProfileStats:
+    """由完整数据 (消息 + 事件) 计算统计信息"""
+    stats = _stats_with_messages(ProfileStats(profile_id=profile.profile_id), profile.messages, replace=True)
+    return _stats_with_events(stats, profile.events)
+
+
+def _publish_stats(stats: ProfileStats, header: Optional[Profile] = None) -> ProfileSummary:
+    """
+    保存统计信息 (并直接写入缓存，不使 Profile 的其他缓存失效)，同时更新目录条目。
+    header 提供名称等元数据；未提供时沿用目录中已有的条目。
+    """
+    storage = get_storage()
+    profile_id = stats.profile_id
+    storage.save_stats(stats)
+    _cache.put("stats", profile_id, stats, storage.get_version_stamp(profile_id, "stats"))
+
+    entry = None if header is not None else _load_catalog().get(profile_id)
+    if entry is None:
+        header = header or storage.load_profile_header(profile_id)
+        entry = ProfileSummary(
+            profile_id=profile_id,
+            profile_name=header.profile_name,
+            user_name=header.user_name,
+            opponent_name=header.opponent_name,
+            created_at=header.created_at,
+        )
+    summary = entry.model_copy(update={
+        "profile_name": header.profile_name if header else entry.profile_name,
+        "user_name": header.user_name if header else entry.user_name,
+        "opponent_name": header.opponent_name if header else entry.opponent_name,
+        "message_count": stats.message_count,
+        "event_count": stats.event_count,
+        "min_date": stats.min_date,
+        "max_date": stats.max_date,
+        "last_activity": stats.updated_at,
+    })
+    _save_catalog_entry(summary)
+    return summary
+
+
+def _rebuild_stats(profile_id: str) -> Optional[ProfileStats]:
+    """统计记录缺失 (如旧数据) 时，完整加载一次 Profile 来补齐"""
+    try:
+        profile = get_profile(profile_id)
+    except HTTPException:
+        return None
+    stats = _build_stats(profile)
+    _publish_stats(stats, profile)
+    return stats
+
+
+def _stats_on_profile_saved(profile: Profile):
+    try:
+        stats = _load_stats(profile.profile_id)
+        if stats is None:
+            # 保存 Profile 时不带事件，事件部分从事件文件统计一次
+            stats = _stats_with_events(ProfileStats(profile_id=profile.profile_id), load_events(profile.profile_id))
+        _publish_stats(_stats_with_messages(stats, profile.messages, replace=True), profile)
+    except Exception as e:
+        print(f"Warning: Could not update stats for profile {profile.profile_id}: {e}")
+
+
+def _stats_on_messages_added(profile: Profile, new_messages: List[Message]):
+    """profile 是追加后的完整 Profile；计数对不上 (如消息 id 重复、编辑后重新保存) 时由它重新统计"""
+    try:
+        stats = _load_stats(profile.profile_id)
+        if stats is None or stats.message_count + len(new_messages) != len(profile.messages):
+            stats = _build_stats(profile)
+        else:
+            stats = _stats_with_messages(stats, new_messages)
+        _publish_stats(stats, profile)
+    except Exception as e:
+        print(f"Warning: Could not update stats for profile {profile.profile_id}: {e}")
+
+
+def _stats_on_events_saved(profile_id: str, events: List[Event]):
+    try:
+        stats = _load_stats(profile_id)
+        if stats is None:
+            _rebuild_stats(profile_id)
+            return
+        _publish_stats(_stats_with_events(stats, events))
+    except Exception as e:
+        print(f"Warning: Could not update stats for profile {profile_id}: {e}")
 
-# 确保数据目录存在
-os.makedirs(settings.DATA_PATH, exist_ok=True)
 
+def get_profile_stats(profile_id: str) -> ProfileStats:
+    """[新增] 获取 Profile 的统计信息 (计数、时间范围、每天条数)，O(1) 读取"""
+    if not get_storage().profile_exists(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    stats = _load_stats(profile_id) or _rebuild_stats(profile_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return stats
 
-def get_profile_path(profile_id: str) -> str:
-    """获取主 Profile JSON 文件的路径"""
-    return os.path.join(settings.DATA_PATH, f"profile_{profile_id}.json")
 
+# --- [新增] Profile 目录 (catalog) ---
+# 每个 Profile 的名称、计数、日期范围等元数据；列表页只读目录，不加载消息
 
-# [新增] 获取 Event JSON 文件的路径
-def get_event_path(profile_id: str) -> str:
-    """获取事件 JSON 文件的路径"""
-    return os.path.join(settings.DATA_PATH, f"event_{profile_id}.json")
+_CATALOG_KEY = "*"  # 目录是全局的，在缓存中占用一个特殊的 profile_id
 
 
-# --- [新增] Persona 路径辅助函数 ---
-def get_user_persona_path(profile_id: str) -> str:
-    """获取用户画像 JSON 文件的路径"""
-    return os.path.join(settings.DATA_PATH, f"persona_user_{profile_id}.json")
+def _load_catalog() -> dict:
+    return _cached("catalog", _CATALOG_KEY, lambda: get_storage().load_catalog())
 
 
-def get_opponent_persona_path(profile_id: str) -> str:
-    """获取对方画像 JSON 文件的路径"""
-    return os.path.join(settings.DATA_PATH, f"persona_opponent_{profile_id}.json")
+def _save_catalog_entry(summary: ProfileSummary):
+    try:
+        get_storage().save_catalog_entry(summary)
+    finally:
+        _cache.invalidate(_CATALOG_KEY)
+
+
+def _rebuild_catalog_entry(profile_id: str) -> Optional[ProfileSummary]:
+    """目录中缺少条目时，由统计信息和 Profile 头部补齐 (统计信息也缺失时完整加载一次)"""
+    stats = _load_stats(profile_id)
+    if stats is None:
+        if _rebuild_stats(profile_id) is None:
+            return None
+        return _load_catalog().get(profile_id)
+    header = get_storage().load_profile_header(profile_id)
+    if header is None:
+        return None
+    return _publish_stats(stats, header)
 
 
-# --- [新增] Insight 路径辅助函数 ---
-def get_insights_path(profile_id: str) -> str:
-    """获取上下文洞察 JSON 文件的路径"""
-    return os.path.join(settings.DATA_PATH, f"insights_{profile_id}.json")
+def get_profile_summary(profile_id: str) -> ProfileSummary:
+    """[新增] 获取单个 Profile 的元数据摘要 (不加载消息)"""
+    if not get_storage().profile_exists(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    summary = _load_catalog().get(profile_id) or _rebuild_catalog_entry(profile_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return summary
+
+
+def list_profile_summaries(offset: int = 0, limit: int = 50) -> ProfileSummaryPage:
+    """分页返回 Profile 元数据摘要 (按创建时间倒序)，不加载任何消息"""
+    catalog = dict(_load_catalog())
+    for profile_id in get_storage().list_profile_ids():
+        if profile_id not in catalog:
+            summary = _rebuild_catalog_entry(profile_id)
+            if summary:
+                catalog[profile_id] = summary
+    existing_ids = set(get_storage().list_profile_ids())
+    items = [item for pid, item in catalog.items() if pid in existing_ids]
+    items.sort(key=lambda item: item.created_at, reverse=True)
+    return ProfileSummaryPage(items=items[offset:offset + limit], total=len(items), offset=offset, limit=limit)
 
 
 # --- Event Load/Save ---
 
 def load_events(profile_id: str) -> List[Event]:
-    """从单独的文件加载事件列表"""
-    filepath = get_event_path(profile_id)
-    if not os.path.exists(filepath):
-        return []
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            events_data = json.load(f)
-            # 使用 Pydantic 解析列表中的每个事件字典
-            return [Event(**event_dict) for event_dict in events_data]
-    except (json.JSONDecodeError, Exception) as e:
-        print(f"Warning: Could not load or parse events file {filepath}: {e}")
-        return []  # 出错时返回空列表
+    """加载事件列表"""
+    return list(_cached("events", profile_id, lambda: get_storage().load_events(profile_id)))
 
 
 def save_events(profile_id: str, events: List[Event]):
-    """将事件列表保存到单独的文件"""
-    filepath = get_event_path(profile_id)
-    try:
-        # 将 Event 对象列表转换为字典列表以便 JSON 序列化
-        events_dict_list = [event.model_dump(mode='json') for event in events]
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(events_dict_list, f, indent=4, ensure_ascii=False)
-    except Exception as e:
-        print(f"!!! ERROR SAVING EVENTS for profile {profile_id}: {e}")
-        # raise HTTPException(status_code=500, detail=f"Failed to save events: {e}")
+    """保存事件列表"""
+    with profile_lock(profile_id):
+        try:
+            get_storage().save_events(profile_id, events)
+        except Exception as e:
+            print(f"!!! ERROR SAVING EVENTS for profile {profile_id}: {e}")
+            # raise HTTPException(status_code=500, detail=f"Failed to save events: {e}")
+            return
+        finally:
+            _cache.invalidate(profile_id)
+        _stats_on_events_saved(profile_id, events)
 
 
 # --- Persona (User) Load/Save ---
 
 def load_user_persona(profile_id: str) -> Optional[UserPersona]:
-    """从单独的文件加载用户画像"""
-    filepath = get_user_persona_path(profile_id)
-    if not os.path.exists(filepath):
-        return None
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return UserPersona(**data)
-    except Exception as e:
-        print(f"Warning: Could not load or parse user persona {filepath}: {e}")
-        return None
+    """加载用户画像"""
+    persona = _cached("user_persona", profile_id, lambda: get_storage().load_user_persona(profile_id))
+    return persona.model_copy(deep=True) if persona else None
 
 
 def save_user_persona(persona: UserPersona):
-    """将用户画像保存到单独的文件"""
-    filepath = get_user_persona_path(persona.profile_id)
-    try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(persona.model_dump(mode='json'), f, indent=4, ensure_ascii=False)
-    except Exception as e:
-        print(f"!!! ERROR SAVING USER PERSONA for profile {persona.profile_id}: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to save user persona: {e}")
+    """保存用户画像"""
+    with profile_lock(persona.profile_id):
+        try:
+            get_storage().save_user_persona(persona)
+        except Exception as e:
+            print(f"!!! ERROR SAVING USER PERSONA for profile {persona.profile_id}: {e}")
+            raise HTTPException(status_code=500, detail=f"Failed to save user persona: {e}")
+        finally:
+            _cache.invalidate(persona.profile_id)
 
 
 # --- Persona (Opponent) Load/Save ---
 
 def load_opponent_persona(profile_id: str) -> Optional[OpponentPersona]:
-    """从单独的文件加载对方画像"""
-    filepath = get_opponent_persona_path(profile_id)
-    if not os.path.exists(filepath):
-        return None
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return OpponentPersona(**data)
-    except Exception as e:
-        print(f"Warning: Could not load or parse opponent persona {filepath}: {e}")
-        return None
+    """加载对方画像"""
+    persona = _cached("opponent_persona", profile_id, lambda: get_storage().load_opponent_persona(profile_id))
+    return persona.model_copy(deep=True) if persona else None
 
 
 def save_opponent_persona(persona: OpponentPersona):
-    """将对方画像保存到单独的文件"""
-    filepath = get_opponent_persona_path(persona.profile_id)
-    try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(persona.model_dump(mode='json'), f, indent=4, ensure_ascii=False)
-    except Exception as e:
-        print(f"!!! ERROR SAVING OPPONENT PERSONA for profile {persona.profile_id}: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to save opponent persona: {e}")
+    """保存对方画像"""
+    with profile_lock(persona.profile_id):
+        try:
+            get_storage().save_opponent_persona(persona)
+        except Exception as e:
+            print(f"!!! ERROR SAVING OPPONENT PERSONA for profile {persona.profile_id}: {e}")
+            raise HTTPException(status_code=500, detail=f"Failed to save opponent persona: {e}")
+        finally:
+            _cache.invalidate(persona.profile_id)
 
 
 # --- [新增] Contextual Insight Load/Save ---
 
-def get_insights_path(profile_id: str) -> str:
-    """获取上下文洞察 JSON 文件的路径"""
-    return os.path.join(settings.DATA_PATH, f"insights_{profile_id}.json")
-
 def load_insights(profile_id: str) -> List[ContextualInsight]:
     """
-    [修改后] 从单独的文件加载上下文洞察列表。
+    加载上下文洞察列表。
     兼容旧数据（可能没有 importance_score 字段）。
     """
-    filepath = get_insights_path(profile_id)
-    if not os.path.exists(filepath):
-        return []
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data_list = json.load(f)
-            insights = []
-            for data in data_list:
-                # 手动处理日期和 Set 的转换 (保持不变)
-                data['analysis_date'] = datetime.date.fromisoformat(data['analysis_date'])
-                data['processed_item_ids'] = set(data.get('processed_item_ids', []))
-
-                # [!! 新增 !!] 为旧数据提供 importance_score 默认值
-                # 如果 JSON 中没有 'importance_score' 键，Pydantic 会使用模型定义的默认值 (0)
-                # 但为了更明确，我们也可以在这里显式处理 .get()
-                # data['importance_score'] = data.get('importance_score', 0) # 这行其实 Pydantic 会自动做
-
-                # 使用 Pydantic 解析，它会自动处理缺失字段的默认值
-                try:
-                    insights.append(ContextualInsight(**data))
-                except Exception as pydantic_error: # 捕获可能的 Pydantic 解析错误
-                    print(f"Warning: Could not parse insight data: {data}. Error: {pydantic_error}")
-                    continue # 跳过无法解析的数据
-
-            return insights
-    except Exception as e:
-        print(f"Warning: Could not load or parse insights {filepath}: {e}")
-        return []
+    return list(_cached("insights", profile_id, lambda: get_storage().load_insights(profile_id)))
 
 def save_insights(profile_id: str, insights: List[ContextualInsight]):
-    """将上下文洞察列表保存到单独的文件。(通常无需修改)"""
-    filepath = get_insights_path(profile_id)
-    try:
-        def json_serializer(obj):
-            if isinstance(obj, datetime.date): return obj.isoformat()
-            if isinstance(obj, set): return list(obj)
-            raise TypeError(f"Type {type(obj)} not serializable")
-
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(
-                # model_dump 会自动包含 importance_score
-                [item.model_dump(mode='json') for item in insights],
-                f, indent=4, ensure_ascii=False, default=json_serializer
-            )
-    except Exception as e:
-        print(f"!!! ERROR SAVING INSIGHTS for profile {profile_id}: {e}")
-        raise HTTPException(status_code=500, detail="Failed to save insights")
+    """保存上下文洞察列表"""
+    with profile_lock(profile_id):
+        try:
+            get_storage().save_insights(profile_id, insights)
+        except Exception as e:
+            print(f"!!! ERROR SAVING INSIGHTS for profile {profile_id}: {e}")
+            raise HTTPException(status_code=500, detail="Failed to save insights")
+        finally:
+            _cache.invalidate(profile_id)
 
-def get_profile_date_range(profile_id: str) -> Optional[Tuple[datetime.date, datetime.date]]:
-    """计算 Profile 中所有消息和事件的最早和最晚日期"""
+
+# --- [新增] 时间范围 / 关键词查询 ---
+# SQLite 后端直接走索引；JSON 后端的消息走按天索引，事件 / 洞察在各自的小文件上筛选
+
+def get_messages_between(
+        profile_id: str,
+        start: Optional[datetime.datetime] = None,
+        end: Optional[datetime.datetime] = None
+) -> List[Message]:
+    """获取 [start, end) 时间区间内的消息，按时间排序"""
+    return get_storage().load_messages_between(profile_id, start, end)
+
+
+def get_events_between(
+        profile_id: str,
+        start: Optional[datetime.datetime] = None,
+        end: Optional[datetime.datetime] = None
+) -> List[Event]:
+    """获取 [start, end) 时间区间内的事件，按时间排序"""
+    return get_storage().load_events_between(profile_id, start, end)
+
+
+# --- [新增] 游标分页 ---
+# 游标 = 上一页边界条目的 "UTC 微秒时间戳:id"，同一时间戳的条目按写入顺序排列
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _encode_cursor(timestamp: datetime.datetime, item_id: str) -> str:
+    ts_us = (_normalize_to_utc(timestamp) - _EPOCH) // datetime.timedelta(microseconds=1)
+    return f"{ts_us}:{item_id}"
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime.datetime, str]:
     try:
-        profile = get_profile(profile_id) # 加载 Profile (包含 messages 和 events)
-    except HTTPException:
-        return None
+        ts_us, item_id = cursor.split(":", 1)
+        return _EPOCH + datetime.timedelta(microseconds=int(ts_us)), item_id
+    except (ValueError, OverflowError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _get_page(kind: str, profile_id: str, cursor: Optional[str], limit: int, direction: str):
+    if direction not in ("forward", "backward"):
+        raise HTTPException(status_code=400, detail="direction must be 'forward' or 'backward'")
+    forward = direction == "forward"
+    decoded = _decode_cursor(cursor) if cursor else None
+    storage = get_storage()
+    if not storage.profile_exists(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
 
-    all_timestamps = [m.timestamp for m in profile.messages] + [e.timestamp for e in profile.events]
+    id_attr = "message_id" if kind == "messages" else "event_id"
+    items, has_more = storage.load_page(kind, profile_id, decoded, limit, forward)
 
-    if not all_timestamps:
-        return None
+    if items:
+        edge = items[-1] if forward else items[0]
+        next_cursor = _encode_cursor(edge.timestamp, getattr(edge, id_attr))
+    else:
+        next_cursor = cursor
+    return items, next_cursor, has_more
+
+
+def get_message_page(profile_id: str, cursor: Optional[str] = None, limit: int = 100,
+                     direction: str = "backward") -> MessagePage:
+    """
+    [新增] 按游标分页获取消息。
+    direction="backward" 从最新的消息开始向前翻 (聊天窗口向上加载历史)，
+    "forward" 从最早的消息 (或游标之后) 开始向后翻 (例如轮询新消息)。
+    """
+    items, next_cursor, has_more = _get_page("messages", profile_id, cursor, limit, direction)
+    return MessagePage(items=items, next_cursor=next_cursor, has_more=has_more)
+
+
+def get_event_page(profile_id: str, cursor: Optional[str] = None, limit: int = 100,
+                   direction: str = "backward") -> EventPage:
+    """[新增] 按游标分页获取事件，参数含义同 get_message_page"""
+    items, next_cursor, has_more = _get_page("events", profile_id, cursor, limit, direction)
+    return EventPage(items=items, next_cursor=next_cursor, has_more=has_more)
+
+
+def search_insights(profile_id: str, keyword: str) -> List[ContextualInsight]:
+    """按关键词搜索洞察摘要 (不区分大小写)"""
+    return get_storage().search_insights(profile_id, keyword)
 
-    # 确保所有时间戳都是 aware 的 (转换为 UTC)
-    aware_timestamps = [_normalize_to_utc(ts) for ts in all_timestamps]
+# --- [新增] 按本地日期读取 ---
+# 消息走持久化的 本地日期 -> 消息 索引 (写入时维护)，耗时只与目标日期的数据量有关；
+# 事件在 JSON 后端中整体存放在一个小文件里，由后端在缓存的事件列表上按天筛选
 
-    min_ts = min(aware_timestamps)
-    max_ts = max(aware_timestamps)
+def get_active_dates(profile_id: str) -> List[datetime.date]:
+    """返回有消息或事件的本地日期，升序"""
+    storage = get_storage()
+    return sorted(set(storage.list_message_dates(profile_id)) | set(storage.list_event_dates(profile_id)))
 
-    # 转换为本地日期 (假设服务器/用户在东八区)
-    # 注意：这里我们只关心日期，时区影响较小，但最好明确
-    local_tz = ZoneInfo("Asia/Shanghai") # 或者 "Etc/GMT-8"
-    min_date_local = min_ts.astimezone(local_tz).date()
-    max_date_local = max_ts.astimezone(local_tz).date()
 
-    return min_date_local, max_date_local
+def get_messages_for_dates(profile_id: str, dates: Iterable[datetime.date]) -> List[Message]:
+    """获取指定本地日期的消息，按时间排序"""
+    return get_storage().load_messages_for_dates(profile_id, dates)
+
+
+def get_events_for_dates(profile_id: str, dates: Iterable[datetime.date]) -> List[Event]:
+    """获取指定本地日期的事件，按时间排序"""
+    return get_storage().load_events_for_dates(profile_id, dates)
+
+
+def get_items_for_date_range(
+        profile_id: str,
+        start_date: datetime.date,
+        end_date: datetime.date
+) -> Tuple[List[Message], List[Event]]:
+    """获取 [start_date, end_date] (含两端的本地日期) 内的消息和事件"""
+    dates = [d for d in get_active_dates(profile_id) if start_date <= d <= end_date]
+    return get_messages_for_dates(profile_id, dates), get_events_for_dates(profile_id, dates)
+
+
+# --- [新增] 按天流式读取 ---
+
+# 流式读取时每批从存储读取的天数 (内存占用只与这一批的数据量有关)
+_STREAM_CHUNK_DAYS = 31
+
+
+def iter_days(
+        profile_id: str,
+        newest_first: bool = False
+) -> Iterator[Tuple[datetime.date, List[Message], List[Event]]]:
+    """
+    逐天产出 (本地日期, 当天消息, 当天事件)，只包含有数据的日期。
+    数据按批 (_STREAM_CHUNK_DAYS 天) 通过按天索引读取，不会一次性加载全部历史。
+    """
+    dates = get_active_dates(profile_id)
+    if newest_first:
+        dates.reverse()
+    for i in range(0, len(dates), _STREAM_CHUNK_DAYS):
+        chunk = dates[i:i + _STREAM_CHUNK_DAYS]
+        messages_by_day = defaultdict(list)
+        for msg in get_messages_for_dates(profile_id, chunk):
+            messages_by_day[to_local_date(msg.timestamp)].append(msg)
+        events_by_day = defaultdict(list)
+        for evt in get_events_for_dates(profile_id, chunk):
+            events_by_day[to_local_date(evt.timestamp)].append(evt)
+        for day in chunk:
+            yield day, messages_by_day.get(day, []), events_by_day.get(day, [])
+
+
+def stream_profile_json(profile_id: str) -> Iterator[bytes]:
+    """
+    [新增] 以 JSON 字节流的形式导出完整 Profile (结构与 get_profile 的返回值相同)。
+    头部先输出，消息逐天输出，事件最后输出；调用时先检查 Profile 是否存在 (不存在抛出 404)。
+    """
+    storage = get_storage()
+    if not storage.profile_exists(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    # 先读取有数据的日期 (JSON 后端会在这一步把旧格式的内联消息迁移出来)，再读取头部
+    get_active_dates(profile_id)
+    header = storage.load_profile_header(profile_id)
+    if header is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    def generate() -> Iterator[bytes]:
+        head = serializer.dumps(header.model_dump(mode='json', exclude={'messages', 'events'}))
+        yield head[:-1] + b',"messages":['
+        first = True
+        for _, day_messages, _ in iter_days(profile_id):
+            if not day_messages:
+                continue
+            chunk = b",".join(m.model_dump_json().encode('utf-8') for m in day_messages)
+            yield chunk if first else b"," + chunk
+            first = False
+        yield b'],"events":['
+        yield b",".join(e.model_dump_json().encode('utf-8') for e in get_events_between(profile_id))
+        yield b"]}"
+
+    return generate()
+
+
+def get_profile_date_range(profile_id: str) -> Optional[Tuple[datetime.date, datetime.date]]:
+    """
+    Profile 中所有消息和事件的最早和最晚 (本地) 日期。
+    [修改] 直接读取写入时维护的统计信息，不再加载全部数据、逐条比较时间戳。
+    """
+    try:
+        stats = get_profile_stats(profile_id)
+    except HTTPException:
+        return None
+    if stats.min_date is None:
+        return None
+    return stats.min_date, stats.max_date
 
 # --- Core Profile Functions ---
 def check_if_date_analyzed(profile_id: str, analysis_date: datetime.date) -> bool:
@@ -222,56 +561,104 @@ def check_if_date_analyzed(profile_id: str, analysis_date: datetime.date) -> boo
 
 def get_profile(profile_id: str) -> Profile:
     """
-    获取 Profile 数据，并合并从单独文件加载的事件列表。
+    获取 Profile 数据，并合并单独存储的事件列表。
     (注意: 此函数不加载 Persona 或 Insights，它们是独立获取的)
     """
-    filepath = get_profile_path(profile_id)
-    if not os.path.exists(filepath):
+    storage = get_storage()
+    if not storage.profile_exists(profile_id):
         raise HTTPException(status_code=404, detail="Profile not found")
 
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            # 1. 加载主 Profile 数据
-            profile_data = json.load(f)
-            # 2. [重要] 创建 Profile 对象时，忽略文件中的 'events' 字段
-            profile = Profile(**{k: v for k, v in profile_data.items() if k != 'events'})
-
-            # 3. 从单独的文件加载事件
-            loaded_events = load_events(profile_id)
-
-            # 4. 将加载的事件附加到 Profile 对象上
-            profile.events = loaded_events
-
-            return profile
-
+        profile = _cached("profile", profile_id, lambda: storage.load_profile(profile_id))
     except Exception as e:
         print(f"Error loading profile {profile_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to load profile data: {e}")
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    # 返回浅拷贝 (调用方可以修改列表而不影响缓存)，并附加单独存储的事件
+    return profile.model_copy(update={
+        "messages": list(profile.messages),
+        "processed_sources": list(profile.processed_sources),
+        "events": load_events(profile_id),
+    })
 
 
 def save_profile(profile: Profile):
     """
-    保存主 Profile 数据，[重要] 排除 events 字段。
+    保存主 Profile 数据 (头部信息、processed_sources 和全部 messages)，不保存 events。
     (注意: 此函数不保存 Persona 或 Insights)
     """
-    filepath = get_profile_path(profile.profile_id)
+    messages = _externalize_raw_outputs(profile.messages)
+    if messages is not profile.messages:
+        profile = profile.model_copy(update={"messages": messages})
+    with profile_lock(profile.profile_id):
+        try:
+            get_storage().save_profile(profile)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to save profile: {e}")
+        finally:
+            _cache.invalidate(profile.profile_id)
+        _stats_on_profile_saved(profile)
+
+
+def _externalize_raw_outputs(messages: List[Message]) -> List[Message]:
+    """
+    [新增] 把内联在消息中的 VLM 原始输出 (旧数据 / 前端回传) 移入旁路存储，消息只保留引用。
+    同一截图的原始输出只存一份；旁路存储中已有时不覆盖。
+    """
+    if not any(m.raw_vlm_output for m in messages):
+        return messages
+    store = get_raw_output_store()
+    stored = set()
+    result = []
+    for msg in messages:
+        image_hash = msg.source_image_hash
+        if msg.raw_vlm_output and image_hash and image_hash != 'manual_entry':
+            try:
+                if image_hash not in stored:
+                    store.put(image_hash, msg.raw_vlm_output.encode('utf-8'), overwrite=False)
+                    stored.add(image_hash)
+                msg = msg.model_copy(update={"raw_vlm_output": None, "raw_vlm_ref": image_hash})
+            except ValueError as e:
+                print(f"Warning: Keeping raw VLM output inline for message {msg.message_id}: {e}")
+        result.append(msg)
+    return result
+
+
+def get_raw_vlm_output(image_hash: str) -> str:
+    """[新增] 按截图 Hash 读取旁路存储中的 VLM 原始输出 (调试用)"""
     try:
-        # 1. [重要] 序列化时排除 events 字段
-        profile_dict = profile.model_dump(mode='json', exclude={'events'})
+        data = get_raw_output_store().get(image_hash)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid image hash")
+    if data is None:
+        raise HTTPException(status_code=404, detail="Raw VLM output not found")
+    return data.decode('utf-8')
 
-        # 2. 写入主 Profile 文件
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(profile_dict, f, indent=4, ensure_ascii=False)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to save profile: {e}")
+def save_uploaded_image(image_bytes: bytes) -> str:
+    """
+    [新增] 把上传的截图存入内容寻址的图片存储 (跨 Profile 去重)，返回其 SHA-256。
+    之后可以按 Hash 重新解析，无需再次上传。存储失败不影响本次解析。
+    """
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    try:
+        get_image_store().put(image_hash, image_bytes, overwrite=False)
+    except OSError as e:
+        print(f"Warning: Could not store uploaded image {image_hash}: {e}")
+    return image_hash
 
 
-def _normalize_to_utc(ts: datetime.datetime) -> datetime.datetime:
-    """(此函数保持不变)"""
-    if ts.tzinfo is None:
-        return ts.replace(tzinfo=datetime.timezone.utc)
-    return ts.astimezone(datetime.timezone.utc)
+def get_uploaded_image(image_hash: str) -> bytes:
+    """[新增] 按 Hash 读取已存储的截图 (可能已因容量上限被淘汰)"""
+    try:
+        data = get_image_store().get(image_hash)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid image hash")
+    if data is None:
+        raise HTTPException(status_code=404, detail=f"Image {image_hash} not found in store, please upload it again")
+    return data
 
 
 # --- Data Update Functions ---
@@ -280,73 +667,189 @@ def add_event_to_profile(profile_id: str, event: Event) -> Profile:
     """
     添加一个新事件到单独的事件文件，并按时间排序后保存。
     最后返回完整的 Profile 对象 (包含更新后的事件列表)。
+    [修改] 时间戳入库时统一为 UTC；已保存的事件列表始终有序，新事件二分插入，不再整体重新排序。
     """
-    current_events = load_events(profile_id)
-    current_events.append(event)
-    current_events.sort(key=lambda e: _normalize_to_utc(e.timestamp))
-    save_events(profile_id, current_events)
+    event = with_utc_timestamp(event)
+    with profile_lock(profile_id):
+        current_events = load_events(profile_id)
+        bisect.insort_right(current_events, event, key=timestamp_key)
+        save_events(profile_id, current_events)
 
     # 重新加载完整的 Profile (现在会包含新保存的事件) 并返回
     return get_profile(profile_id)
 
 
+def _merge_into_cached_profile(cached_profile: Profile, new_messages: List[Message]):
+    """
+    把刚追加的消息归并进缓存中的 Profile (生成新对象，不修改原缓存值)。
+    新消息与已有消息 id 重复 (即编辑后重新保存) 时放弃，下次读取时从存储重新加载。
+    """
+    new_ids = {m.message_id for m in new_messages}
+    if not new_ids.isdisjoint(map(_message_id, cached_profile.messages)):
+        return
+    known_sources = set(cached_profile.processed_sources)
+    new_sources = []
+    for msg in new_messages:
+        hash_val = msg.source_image_hash
+        if hash_val and hash_val != 'manual_entry' and hash_val not in known_sources:
+            known_sources.add(hash_val)
+            new_sources.append(hash_val)
+    updated = cached_profile.model_copy(update={
+        "messages": merge_sorted(cached_profile.messages, new_messages),
+        "processed_sources": cached_profile.processed_sources + new_sources,
+    })
+    profile_id = cached_profile.profile_id
+    _cache.put("profile", profile_id, updated, get_storage().get_version_stamp(profile_id, "profile"))
+
+
 def add_messages_to_profile(profile_id: str, messages: List[Message]) -> Profile:
-    """(此函数保持不变，它只操作主 profile 文件)"""
-    profile = get_profile(profile_id)
-    profile.messages.extend(messages)
-    profile.messages.sort(key=lambda m: _normalize_to_utc(m.timestamp))
-    new_hashes_to_process = set()
-    for msg in messages:
-        if msg.source_image_hash and msg.source_image_hash != 'manual_entry':
-            new_hashes_to_process.add(msg.source_image_hash)
-    for hash_val in new_hashes_to_process:
-        if hash_val not in profile.processed_sources:
-            profile.processed_sources.append(hash_val)
+    """
+    [修改后] 只追加新消息 (JSON 后端写入 JSONL 追加日志，SQLite 后端插入行)，
+    不再重写整个主文件；图源 Hash 由存储后端一并记录。
+    [修改] 时间戳入库时统一为 UTC；如果 Profile 已在缓存中，新消息直接归并进缓存的有序列表，
+    不再失效后整体重新加载、重新排序。
+    """
+    if not get_storage().profile_exists(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    if messages:
+        with profile_lock(profile_id):
+            new_messages = _append_locked(profile_id, messages)
+            profile = get_profile(profile_id)
+            _stats_on_messages_added(profile, new_messages)
+        return profile
 
-    save_profile(profile)
     return get_profile(profile_id)
 
 
+def _append_locked(profile_id: str, messages: List[Message]) -> List[Message]:
+    """在 profile_lock 内把消息 (按时间排序、统一为 UTC) 追加到存储并归并进缓存，返回实际写入的消息"""
+    storage = get_storage()
+    new_messages = sorted(
+        (with_utc_timestamp(m) for m in _externalize_raw_outputs(messages)), key=timestamp_key
+    )
+    cached_profile = _cache.peek("profile", profile_id, storage.get_version_stamp(profile_id, "profile"))
+    try:
+        storage.append_messages(profile_id, new_messages)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to append messages: {e}")
+    finally:
+        _cache.invalidate(profile_id)
+    if cached_profile is not None:
+        _merge_into_cached_profile(cached_profile, new_messages)
+    return new_messages
+
+
+def append_messages(profile_id: str, messages: List[Message]) -> int:
+    """
+    [新增] 批量追加消息 (如按块导入聊天记录导出文件)。与 add_messages_to_profile 相同，
+    但不重新加载完整的 Profile: 统计信息直接在已有记录上增量更新。返回追加的条数。
+    """
+    if not get_storage().profile_exists(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if not messages:
+        return 0
+    with profile_lock(profile_id):
+        new_messages = _append_locked(profile_id, messages)
+        try:
+            stats = _load_stats(profile_id)
+            if stats is None:
+                _rebuild_stats(profile_id)
+            else:
+                _publish_stats(_stats_with_messages(stats, new_messages))
+        except Exception as e:
+            print(f"Warning: Could not update stats for profile {profile_id}: {e}")
+    return len(new_messages)
+
+
+def profile_exists(profile_id: str) -> bool:
+    """[新增] 只检查 Profile 是否存在，不加载数据"""
+    return get_storage().profile_exists(profile_id)
+
+
+def load_source_hashes(profile_id: str) -> frozenset:
+    """
+    [新增] 返回已处理图源 Hash 的集合 (缓存)。
+    该索引独立于主 Profile 持久化，查询不需要加载消息。
+    """
+    return _cached("sources", profile_id, lambda: frozenset(get_storage().load_source_hashes(profile_id)))
+
+
+def load_dhash_index(profile_id: str) -> Dict[str, int]:
+    """
+    [新增] 该 Profile 已导入截图的感知哈希索引 {image_hash: dHash} (缓存，随图源索引一起失效)。
+    dHash 在上传时计算并按图片 Hash 保存；没有 dHash 的截图 (此功能之前导入的) 不在索引中。
+    """
+    def load():
+        store = get_phash_store()
+        index = {}
+        for image_hash in load_source_hashes(profile_id):
+            try:
+                value = store.get(image_hash)
+            except ValueError:
+                continue
+            if value:
+                index[image_hash] = int(value, 16)
+        return index
+    return _cached("dhash_index", profile_id, load, stamp_kind="sources")
+
+
+def filter_new_sources(profile_id: str, image_hashes: List[str]) -> List[str]:
+    """
+    [新增] 批量查询: 返回 image_hashes 中尚未处理过的 Hash (保持原顺序，批内重复的只保留一次)。
+    Profile 不存在时视为全部未处理。
+    """
+    known = load_source_hashes(profile_id)
+    new_hashes = []
+    seen = set()
+    for image_hash in image_hashes:
+        if image_hash not in known and image_hash not in seen:
+            seen.add(image_hash)
+            new_hashes.append(image_hash)
+    return new_hashes
+
+
 def add_processed_source(profile_id: str, image_hash: str):
-    """(此函数保持不变)"""
-    profile = get_profile(profile_id)
-    if image_hash not in profile.processed_sources:
-        profile.processed_sources.append(image_hash)
-        save_profile(profile)
+    """[修改后] 只向图源索引追加一个 Hash，不再重写整个 Profile"""
+    storage = get_storage()
+    if not storage.profile_exists(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    with profile_lock(profile_id):
+        if image_hash in load_source_hashes(profile_id):
+            return
+        try:
+            storage.add_source_hashes(profile_id, [image_hash])
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to save processed source: {e}")
+        finally:
+            _cache.invalidate(profile_id)
 
 
 def check_if_source_processed(profile_id: str, image_hash: str) -> bool:
-    """(此函数保持不变)"""
-    try:
-        profile = get_profile(profile_id)
-        return image_hash in profile.processed_sources
-    except HTTPException as e:
-        if e.status_code == 404:
-            return False
-        raise e
+    """[修改后] 在图源 Hash 集合中查找，O(1)"""
+    return image_hash in load_source_hashes(profile_id)
 
 
 def list_all_profiles() -> List[Profile]:
-    """(此函数逻辑不变，get_profile 会自动合并事件)"""
+    """(get_profile 会自动合并事件)"""
     profiles = []
-    search_path = os.path.join(settings.DATA_PATH, "profile_*.json")
-    for filepath in glob.glob(search_path):
+    for profile_id in get_storage().list_profile_ids():
         try:
-            profile_id = os.path.basename(filepath).replace("profile_", "").replace(".json", "")
             profiles.append(get_profile(profile_id))
         except Exception as e:
-            print(f"Warning: Skipping profile file {filepath} due to error: {e}")
+            print(f"Warning: Skipping profile {profile_id} due to error: {e}")
             continue
     profiles.sort(key=lambda p: p.created_at, reverse=True)
     return profiles
 
 
 def update_profile(profile_id: str, updates: UpdateProfileNamesRequest) -> Profile:
-    """(此函数保持不变)"""
-    profile = get_profile(profile_id)
-    update_data = updates.model_dump(exclude_unset=True)
-    if not update_data:
-        raise HTTPException(status_code=400, detail="No update data provided")
-    updated_profile = profile.model_copy(update=update_data)
-    save_profile(updated_profile)
-    return get_profile(profile_id)
\ No newline at end of file
+    """[修改] 读-改-写 在 Profile 锁内完成"""
+    with profile_lock(profile_id):
+        profile = get_profile(profile_id)
+        update_data = updates.model_dump(exclude_unset=True)
+        if not update_data:
+            raise HTTPException(status_code=400, detail="No update data provided")
+        updated_profile = profile.model_copy(update=update_data)
+        save_profile(updated_profile)
+        return get_profile(profile_id)
\ No newline at end of file
@@ -0,0 +1,53 @@
+"""
+[新增] 可插拔的 JSON 序列化 (存储层使用)。
+
+按优先级选择已安装的实现: orjson > msgspec > 标准库 json。
+写入统一为紧凑格式 (无缩进、不转义中文)；读取兼容旧的缩进格式文件。
+"""
+import json
+from typing import Any, Callable, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+if orjson is not None:
+    SERIALIZER_NAME = "orjson"
+
+    def dumps(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+        return orjson.dumps(obj, default=default)
+
+    def loads(data) -> Any:
+        return orjson.loads(data)
+
+elif msgspec is not None:
+    SERIALIZER_NAME = "msgspec"
+    _decoder = msgspec.json.Decoder()
+
+    def dumps(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+        return msgspec.json.encode(obj, enc_hook=default)
+
+    def loads(data) -> Any:
+        return _decoder.decode(data)
+
+else:
+    SERIALIZER_NAME = "json"
+
+    def dumps(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=default).encode('utf-8')
+
+    def loads(data) -> Any:
+        return json.loads(data)
+
+
+def load_file(filepath: str) -> Any:
+    """读取并解析整个 JSON 文件 (紧凑格式和旧的缩进格式都可以)"""
+    with open(filepath, 'rb') as f:
+        return loads(f.read())
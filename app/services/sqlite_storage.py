@@ -0,0 +1,474 @@
+import datetime
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app.core.models import (
+    Profile, Message, Event, UserPersona, OpponentPersona, ContextualInsight, ProfileSummary, ProfileStats
+)
+from app.services.storage_backend import StorageBackend, normalize_to_utc, to_local_date
+from app.services import serializer
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# 所有明细表都以 (profile_id, 时间) 建索引，日期范围 / 按天查询不需要全量加载
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    profile_id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS processed_sources (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    profile_id TEXT NOT NULL,
+    image_hash TEXT NOT NULL,
+    UNIQUE (profile_id, image_hash)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    profile_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    ts_us INTEGER NOT NULL,
+    local_date TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (profile_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_profile_ts ON messages (profile_id, ts_us);
+CREATE TABLE IF NOT EXISTS events (
+    profile_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    ts_us INTEGER NOT NULL,
+    local_date TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (profile_id, event_id)
+);
+CREATE INDEX IF NOT EXISTS idx_events_profile_ts ON events (profile_id, ts_us);
+CREATE TABLE IF NOT EXISTS insights (
+    profile_id TEXT NOT NULL,
+    insight_id TEXT NOT NULL,
+    analysis_date TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (profile_id, insight_id)
+);
+CREATE INDEX IF NOT EXISTS idx_insights_profile_date ON insights (profile_id, analysis_date);
+CREATE TABLE IF NOT EXISTS catalog (
+    profile_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stats (
+    profile_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS personas (
+    profile_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (profile_id, kind)
+);
+"""
+
+
+# 按本地日期的索引 (local_date 列在旧版本的数据库中不存在，由 _migrate_schema 补齐)
+_DATE_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_messages_profile_date ON messages (profile_id, local_date);
+CREATE INDEX IF NOT EXISTS idx_events_profile_date ON events (profile_id, local_date);
+"""
+
+
+def _to_us(ts: datetime.datetime) -> int:
+    """将时间戳转换为 UTC 微秒整数，用作可排序的索引列"""
+    return (normalize_to_utc(ts) - _EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def _from_us(ts_us: int) -> datetime.datetime:
+    return _EPOCH + datetime.timedelta(microseconds=ts_us)
+
+
+class SqliteStorageBackend(StorageBackend):
+    """
+    本地 SQLite 存储后端。
+    每个线程持有一个连接 (同步路由运行在线程池中)，数据库使用 WAL 模式以便读写并发。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        self._migrate_schema(conn)
+        conn.executescript(_DATE_INDEXES)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _migrate_schema(conn: sqlite3.Connection):
+        """为旧数据库补上 local_date 列，并根据 ts_us 回填"""
+        for table, id_column in (("messages", "message_id"), ("events", "event_id")):
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if "local_date" in columns:
+                continue
+            with conn:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN local_date TEXT")
+                rows = conn.execute(f"SELECT profile_id, {id_column}, ts_us FROM {table}").fetchall()
+                conn.executemany(
+                    f"UPDATE {table} SET local_date = ? WHERE profile_id = ? AND {id_column} = ?",
+                    [(to_local_date(_from_us(ts_us)).isoformat(), pid, item_id) for pid, item_id, ts_us in rows]
+                )
+
+    # --- Profile ---
+
+    def profile_exists(self, profile_id: str) -> bool:
+        row = self._conn().execute(
+            "SELECT 1 FROM profiles WHERE profile_id = ?", (profile_id,)
+        ).fetchone()
+        return row is not None
+
+    def list_profile_ids(self) -> List[str]:
+        rows = self._conn().execute("SELECT profile_id FROM profiles").fetchall()
+        return [row[0] for row in rows]
+
+    def load_profile_header(self, profile_id: str) -> Optional[Profile]:
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT data FROM profiles WHERE profile_id = ?", (profile_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        profile = Profile(**serializer.loads(row[0]))
+        profile.processed_sources = [
+            r[0] for r in conn.execute(
+                "SELECT image_hash FROM processed_sources WHERE profile_id = ? ORDER BY seq",
+                (profile_id,)
+            )
+        ]
+        return profile
+
+    def load_profile(self, profile_id: str) -> Optional[Profile]:
+        profile = self.load_profile_header(profile_id)
+        if profile is None:
+            return None
+        profile.messages = [
+            Message.model_validate_json(r[0]) for r in self._conn().execute(
+                "SELECT data FROM messages WHERE profile_id = ? ORDER BY ts_us, rowid",
+                (profile_id,)
+            )
+        ]
+        return profile
+
+    def save_profile(self, profile: Profile):
+        header = profile.model_dump(mode='json', exclude={'events', 'messages', 'processed_sources'})
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO profiles (profile_id, created_at, data) VALUES (?, ?, ?)",
+                (profile.profile_id, header['created_at'], serializer.dumps(header).decode('utf-8'))
+            )
+            conn.execute("DELETE FROM messages WHERE profile_id = ?", (profile.profile_id,))
+            self._insert_messages(conn, profile.profile_id, profile.messages)
+            conn.execute("DELETE FROM processed_sources WHERE profile_id = ?", (profile.profile_id,))
+            self._insert_sources(conn, profile.profile_id, profile.processed_sources)
+
+    def append_messages(self, profile_id: str, messages: List[Message]):
+        conn = self._conn()
+        with conn:
+            self._insert_messages(conn, profile_id, messages)
+            self._insert_sources(conn, profile_id, [
+                msg.source_image_hash for msg in messages
+                if msg.source_image_hash and msg.source_image_hash != 'manual_entry'
+            ])
+
+    @staticmethod
+    def _insert_messages(conn: sqlite3.Connection, profile_id: str, messages: List[Message]):
+        conn.executemany(
+            "INSERT OR REPLACE INTO messages (profile_id, message_id, ts_us, local_date, data) VALUES (?, ?, ?, ?, ?)",
+            [
+                (profile_id, m.message_id, _to_us(m.timestamp), to_local_date(m.timestamp).isoformat(),
+                 m.model_dump_json())
+                for m in messages
+            ]
+        )
+
+    @staticmethod
+    def _insert_sources(conn: sqlite3.Connection, profile_id: str, hashes: List[str]):
+        conn.executemany(
+            "INSERT OR IGNORE INTO processed_sources (profile_id, image_hash) VALUES (?, ?)",
+            [(profile_id, h) for h in hashes]
+        )
+
+    # --- 已处理图源索引 (processed_sources 表上有唯一索引) ---
+
+    def load_source_hashes(self, profile_id: str) -> Set[str]:
+        return {
+            r[0] for r in self._conn().execute(
+                "SELECT image_hash FROM processed_sources WHERE profile_id = ?", (profile_id,)
+            )
+        }
+
+    def add_source_hashes(self, profile_id: str, hashes: List[str]):
+        conn = self._conn()
+        with conn:
+            self._insert_sources(conn, profile_id, hashes)
+
+    # --- Profile 目录 (catalog) ---
+
+    def load_catalog(self) -> Dict[str, ProfileSummary]:
+        return {
+            pid: ProfileSummary.model_validate_json(data)
+            for pid, data in self._conn().execute("SELECT profile_id, data FROM catalog")
+        }
+
+    def save_catalog_entry(self, summary: ProfileSummary):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO catalog (profile_id, data) VALUES (?, ?)",
+                (summary.profile_id, summary.model_dump_json())
+            )
+
+    # --- Profile 统计信息 ---
+
+    def load_stats(self, profile_id: str) -> Optional[ProfileStats]:
+        row = self._conn().execute("SELECT data FROM stats WHERE profile_id = ?", (profile_id,)).fetchone()
+        return ProfileStats.model_validate_json(row[0]) if row else None
+
+    def save_stats(self, stats: ProfileStats):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO stats (profile_id, data) VALUES (?, ?)",
+                (stats.profile_id, stats.model_dump_json())
+            )
+
+    # --- Event ---
+
+    def load_events(self, profile_id: str) -> List[Event]:
+        return [
+            Event.model_validate_json(r[0]) for r in self._conn().execute(
+                "SELECT data FROM events WHERE profile_id = ? ORDER BY ts_us, rowid",
+                (profile_id,)
+            )
+        ]
+
+    def save_events(self, profile_id: str, events: List[Event]):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM events WHERE profile_id = ?", (profile_id,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO events (profile_id, event_id, ts_us, local_date, data) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (profile_id, e.event_id, _to_us(e.timestamp), to_local_date(e.timestamp).isoformat(),
+                     e.model_dump_json())
+                    for e in events
+                ]
+            )
+
+    # --- Insight ---
+
+    def load_insights(self, profile_id: str) -> List[ContextualInsight]:
+        insights = []
+        for (data,) in self._conn().execute(
+                "SELECT data FROM insights WHERE profile_id = ? ORDER BY analysis_date DESC",
+                (profile_id,)
+        ):
+            try:
+                insights.append(ContextualInsight.model_validate_json(data))
+            except Exception as e:
+                print(f"Warning: Could not parse insight data: {data}. Error: {e}")
+        return insights
+
+    def save_insights(self, profile_id: str, insights: List[ContextualInsight]):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM insights WHERE profile_id = ?", (profile_id,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO insights "
+                "(profile_id, insight_id, analysis_date, summary, data) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (profile_id, i.insight_id, i.analysis_date.isoformat(), i.summary, i.model_dump_json())
+                    for i in insights
+                ]
+            )
+
+    # --- Persona ---
+
+    def _load_persona(self, profile_id: str, kind: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT data FROM personas WHERE profile_id = ? AND kind = ?", (profile_id, kind)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _save_persona(self, profile_id: str, kind: str, data: str):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO personas (profile_id, kind, data) VALUES (?, ?, ?)",
+                (profile_id, kind, data)
+            )
+
+    def load_user_persona(self, profile_id: str) -> Optional[UserPersona]:
+        data = self._load_persona(profile_id, "user")
+        return UserPersona.model_validate_json(data) if data else None
+
+    def save_user_persona(self, persona: UserPersona):
+        self._save_persona(persona.profile_id, "user", persona.model_dump_json())
+
+    def load_opponent_persona(self, profile_id: str) -> Optional[OpponentPersona]:
+        data = self._load_persona(profile_id, "opponent")
+        return OpponentPersona.model_validate_json(data) if data else None
+
+    def save_opponent_persona(self, persona: OpponentPersona):
+        self._save_persona(persona.profile_id, "opponent", persona.model_dump_json())
+
+    # --- 索引查询 ---
+
+    @staticmethod
+    def _range_clause(start, end) -> Tuple[str, list]:
+        clause, params = "", []
+        if start is not None:
+            clause += " AND ts_us >= ?"
+            params.append(_to_us(start))
+        if end is not None:
+            clause += " AND ts_us < ?"
+            params.append(_to_us(end))
+        return clause, params
+
+    def load_messages_between(self, profile_id, start=None, end=None) -> List[Message]:
+        clause, params = self._range_clause(start, end)
+        return [
+            Message.model_validate_json(r[0]) for r in self._conn().execute(
+                f"SELECT data FROM messages WHERE profile_id = ?{clause} ORDER BY ts_us, rowid",
+                [profile_id, *params]
+            )
+        ]
+
+    def load_events_between(self, profile_id, start=None, end=None) -> List[Event]:
+        clause, params = self._range_clause(start, end)
+        return [
+            Event.model_validate_json(r[0]) for r in self._conn().execute(
+                f"SELECT data FROM events WHERE profile_id = ?{clause} ORDER BY ts_us, rowid",
+                [profile_id, *params]
+            )
+        ]
+
+    def load_page(self, kind, profile_id, cursor, limit, forward):
+        table, id_column, model = {
+            "messages": ("messages", "message_id", Message),
+            "events": ("events", "event_id", Event),
+        }[kind]
+        conn = self._conn()
+        clause, params = "", []
+        if cursor is not None:
+            cursor_ts, cursor_id = cursor
+            row = conn.execute(
+                f"SELECT ts_us, rowid FROM {table} WHERE profile_id = ? AND {id_column} = ?",
+                (profile_id, cursor_id)
+            ).fetchone()
+            # 游标条目已不存在时，跳过与它同一时间戳的所有条目
+            ts_us, rowid = row if row is not None else (_to_us(cursor_ts), 2 ** 63 - 1 if forward else -1)
+            clause = " AND (ts_us, rowid) > (?, ?)" if forward else " AND (ts_us, rowid) < (?, ?)"
+            params = [ts_us, rowid]
+        order = "ts_us, rowid" if forward else "ts_us DESC, rowid DESC"
+        rows = conn.execute(
+            f"SELECT data FROM {table} WHERE profile_id = ?{clause} ORDER BY {order} LIMIT ?",
+            [profile_id, *params, limit + 1]
+        ).fetchall()
+        items = [model.model_validate_json(r[0]) for r in rows[:limit]]
+        if not forward:
+            items.reverse()
+        return items, len(rows) > limit
+
+    def search_insights(self, profile_id: str, keyword: str) -> List[ContextualInsight]:
+        return [
+            ContextualInsight.model_validate_json(r[0]) for r in self._conn().execute(
+                "SELECT data FROM insights WHERE profile_id = ? AND instr(lower(summary), ?) > 0"
+                " ORDER BY analysis_date DESC",
+                (profile_id, keyword.lower())
+            )
+        ]
+
+
+    # --- 按天查询 (走 (profile_id, local_date) 索引) ---
+
+    def _list_dates(self, table: str, profile_id: str) -> List[datetime.date]:
+        rows = self._conn().execute(
+            f"SELECT DISTINCT local_date FROM {table} WHERE profile_id = ? ORDER BY local_date",
+            (profile_id,)
+        ).fetchall()
+        return [datetime.date.fromisoformat(row[0]) for row in rows]
+
+    def _load_for_dates(self, table: str, profile_id: str, dates: Iterable[datetime.date]):
+        days = sorted({d.isoformat() for d in dates})
+        if not days:
+            return []
+        placeholders = ", ".join("?" for _ in days)
+        return [
+            row[0] for row in self._conn().execute(
+                f"SELECT data FROM {table} WHERE profile_id = ? AND local_date IN ({placeholders})"
+                " ORDER BY ts_us, rowid",
+                [profile_id, *days]
+            )
+        ]
+
+    def list_message_dates(self, profile_id: str) -> List[datetime.date]:
+        return self._list_dates("messages", profile_id)
+
+    def load_messages_for_dates(self, profile_id: str, dates: Iterable[datetime.date]) -> List[Message]:
+        return [Message.model_validate_json(d) for d in self._load_for_dates("messages", profile_id, dates)]
+
+    def list_event_dates(self, profile_id: str) -> List[datetime.date]:
+        return self._list_dates("events", profile_id)
+
+    def load_events_for_dates(self, profile_id: str, dates: Iterable[datetime.date]) -> List[Event]:
+        return [Event.model_validate_json(d) for d in self._load_for_dates("events", profile_id, dates)]
+
+
+def migrate_json_to_sqlite(data_path: str, db_path: str) -> int:
+    """
+    一次性迁移：把 data_path 下所有 JSON 文件中的 Profile / 事件 / 洞察 / 画像写入 SQLite。
+    重复执行是安全的 (整体覆盖同一 profile_id 的数据)。返回迁移的 Profile 数量。
+    """
+    from app.services.json_storage import JsonStorageBackend
+
+    source = JsonStorageBackend(data_path)
+    target = SqliteStorageBackend(db_path)
+    migrated = 0
+    for profile_id in source.list_profile_ids():
+        try:
+            profile = source.load_profile(profile_id)
+            if profile is None:
+                continue
+            target.save_profile(profile)
+            target.save_events(profile_id, source.load_events(profile_id))
+            target.save_insights(profile_id, source.load_insights(profile_id))
+            user_persona = source.load_user_persona(profile_id)
+            if user_persona:
+                target.save_user_persona(user_persona)
+            opponent_persona = source.load_opponent_persona(profile_id)
+            if opponent_persona:
+                target.save_opponent_persona(opponent_persona)
+            stats = source.load_stats(profile_id)
+            if stats:
+                target.save_stats(stats)
+            migrated += 1
+            print(f"Migrated profile {profile_id} ({len(profile.messages)} messages)")
+        except Exception as e:
+            print(f"Warning: Skipping profile {profile_id} during migration due to error: {e}")
+    return migrated
+
+
+if __name__ == "__main__":
+    # 用法: python -m app.services.sqlite_storage
+    from app.core.config import settings
+
+    count = migrate_json_to_sqlite(settings.DATA_PATH, settings.SQLITE_PATH)
+    print(f"Migration finished: {count} profiles written to {settings.SQLITE_PATH}")
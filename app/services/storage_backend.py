@@ -0,0 +1,273 @@
+import bisect
+import datetime
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from app.core.config import settings
+from app.core.models import (
+    Profile, Message, Event, UserPersona, OpponentPersona, ContextualInsight, ProfileSummary, ProfileStats
+)
+
+
+def normalize_to_utc(ts: datetime.datetime) -> datetime.datetime:
+    """将时间戳统一为 aware 的 UTC 时间 (naive 时间按 UTC 处理)"""
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=datetime.timezone.utc)
+    return ts.astimezone(datetime.timezone.utc)
+
+
+# 用于"分天"的本地时区 (与 persona_service / assist_tools / timeline_service 保持一致)
+LOCAL_TZ = ZoneInfo("Asia/Shanghai")
+
+
+def to_local_date(ts: datetime.datetime) -> datetime.date:
+    """将时间戳转换为本地日期 (naive 时间按 UTC 处理)"""
+    return normalize_to_utc(ts).astimezone(LOCAL_TZ).date()
+
+
+class StorageBackend:
+    """
+    Profile 数据的存储后端接口。
+    profile_service 只通过这些方法读写数据，具体的文件格式 / 数据库由子类决定。
+    """
+
+    # --- Profile ---
+    def profile_exists(self, profile_id: str) -> bool:
+        raise NotImplementedError
+
+    def list_profile_ids(self) -> List[str]:
+        raise NotImplementedError
+
+    def load_profile(self, profile_id: str) -> Optional[Profile]:
+        """加载 Profile (包含 messages，不包含 events)。不存在时返回 None。"""
+        raise NotImplementedError
+
+    def load_profile_header(self, profile_id: str) -> Optional[Profile]:
+        """只加载 Profile 的头部信息和 processed_sources (messages 为空)，用于流式导出等场景"""
+        raise NotImplementedError
+
+    def save_profile(self, profile: Profile):
+        """整体保存 Profile 的头部信息、processed_sources 和 messages (不包含 events)"""
+        raise NotImplementedError
+
+    def append_messages(self, profile_id: str, messages: List[Message]):
+        """追加新消息，并把它们的图源 Hash 记入 processed_sources"""
+        raise NotImplementedError
+
+    # --- 已处理图源索引 ---
+    def load_source_hashes(self, profile_id: str) -> Set[str]:
+        """返回已处理过的图源 Hash 集合 (与 processed_sources 一致)。Profile 不存在时返回空集合。"""
+        raise NotImplementedError
+
+    def add_source_hashes(self, profile_id: str, hashes: List[str]):
+        """把图源 Hash 追加进 processed_sources，已存在的会被忽略"""
+        raise NotImplementedError
+
+    # --- Event ---
+    def load_events(self, profile_id: str) -> List[Event]:
+        raise NotImplementedError
+
+    def save_events(self, profile_id: str, events: List[Event]):
+        raise NotImplementedError
+
+    # --- Insight ---
+    def load_insights(self, profile_id: str) -> List[ContextualInsight]:
+        raise NotImplementedError
+
+    def save_insights(self, profile_id: str, insights: List[ContextualInsight]):
+        raise NotImplementedError
+
+    # --- Persona ---
+    def load_user_persona(self, profile_id: str) -> Optional[UserPersona]:
+        raise NotImplementedError
+
+    def save_user_persona(self, persona: UserPersona):
+        raise NotImplementedError
+
+    def load_opponent_persona(self, profile_id: str) -> Optional[OpponentPersona]:
+        raise NotImplementedError
+
+    def save_opponent_persona(self, persona: OpponentPersona):
+        raise NotImplementedError
+
+    # --- 按天读取 (两个后端都维护了 本地日期 -> 消息 的持久索引) ---
+    def list_message_dates(self, profile_id: str) -> List[datetime.date]:
+        """返回有消息的本地日期，升序"""
+        raise NotImplementedError
+
+    def load_messages_for_dates(self, profile_id: str, dates: Iterable[datetime.date]) -> List[Message]:
+        """只读取指定本地日期的消息，按时间排序"""
+        raise NotImplementedError
+
+    # --- Profile 目录 (catalog) ---
+    def load_catalog(self) -> Dict[str, ProfileSummary]:
+        """加载所有 Profile 的元数据摘要，{profile_id: ProfileSummary}"""
+        raise NotImplementedError
+
+    def save_catalog_entry(self, summary: ProfileSummary):
+        """新增或更新一个 Profile 的元数据摘要"""
+        raise NotImplementedError
+
+    # --- Profile 统计信息 ---
+    def load_stats(self, profile_id: str) -> Optional[ProfileStats]:
+        """加载 Profile 的统计信息，尚未生成时返回 None"""
+        raise NotImplementedError
+
+    def save_stats(self, stats: ProfileStats):
+        """保存 (覆盖) Profile 的统计信息"""
+        raise NotImplementedError
+
+    def flush(self):
+        """把延迟写入 (write-behind) 的数据落盘；没有延迟写入的后端无需处理"""
+        pass
+
+    def migrate(self) -> int:
+        """启动时执行的一次性数据迁移 (如旧格式的数据)，返回迁移的 Profile 数量；默认无需处理"""
+        return 0
+
+    def close(self):
+        """关闭服务时调用: 停止后台写入并把延迟写入的数据落盘"""
+        self.flush()
+
+    # --- 缓存版本 ---
+    def get_version_stamp(self, profile_id: str, kind: str) -> Optional[Hashable]:
+        """
+        返回某类数据 (kind: profile / sources / events / insights / user_persona / opponent_persona / stats / catalog)
+        当前的版本标记，供 profile_service 的缓存发现进程外的修改。
+        返回 None 表示后端无法提供，缓存只依赖进程内的版本号。
+        """
+        return None
+
+    # --- 时间范围 / 分页 / 关键词查询 ---
+
+    def load_messages_between(
+            self,
+            profile_id: str,
+            start: Optional[datetime.datetime] = None,
+            end: Optional[datetime.datetime] = None
+    ) -> List[Message]:
+        """返回 [start, end) 区间内 (UTC) 的消息，按时间排序"""
+        raise NotImplementedError
+
+    def load_events_between(
+            self,
+            profile_id: str,
+            start: Optional[datetime.datetime] = None,
+            end: Optional[datetime.datetime] = None
+    ) -> List[Event]:
+        """返回 [start, end) 区间内 (UTC) 的事件，按时间排序"""
+        raise NotImplementedError
+
+    def load_page(
+            self,
+            kind: str,
+            profile_id: str,
+            cursor: Optional[Tuple[datetime.datetime, str]],
+            limit: int,
+            forward: bool
+    ) -> Tuple[list, bool]:
+        """
+        游标分页读取消息 (kind="messages") 或事件 (kind="events")。
+        cursor 为上一页边界条目的 (时间戳, id)；forward 为 True 时取其后 (更新) 的 limit 条，
+        否则取其前 (更早) 的 limit 条；没有游标时分别从最早 / 最新开始。
+        返回 (按时间升序的条目, 该方向上是否还有更多)。
+        """
+        raise NotImplementedError
+
+    def search_insights(self, profile_id: str, keyword: str) -> List[ContextualInsight]:
+        """按关键词 (不区分大小写) 搜索洞察摘要"""
+        raise NotImplementedError
+
+    def list_event_dates(self, profile_id: str) -> List[datetime.date]:
+        """返回有事件的本地日期，升序"""
+        raise NotImplementedError
+
+    def load_events_for_dates(self, profile_id: str, dates: Iterable[datetime.date]) -> List[Event]:
+        """只读取指定本地日期的事件，按时间排序"""
+        raise NotImplementedError
+
+
+def timestamp_key(item) -> datetime.datetime:
+    """消息 / 事件按时间排序的键 (UTC)"""
+    return normalize_to_utc(item.timestamp)
+
+
+def with_utc_timestamp(item):
+    """入库时统一把时间戳转为 aware 的 UTC 时间 (已是 UTC 时原样返回)"""
+    if item.timestamp.tzinfo is not None and item.timestamp.utcoffset() == datetime.timedelta(0):
+        return item
+    return item.model_copy(update={"timestamp": normalize_to_utc(item.timestamp)})
+
+
+def merge_sorted(existing: list, new_items: Iterable) -> list:
+    """
+    把一批新的消息 / 事件合并进已按时间排序的列表，返回新列表 (不修改 existing)。
+    只对新批次排序 (O(k log k))，每条新数据用 bisect 在已有列表中二分定位 (O(k log n) 次比较)，
+    已有数据按切片整段拷贝 (O(n + k))，不再对全部历史重新排序、也不再逐条计算时间键。
+    时间相同时，新数据排在已有数据之后 (与 追加后稳定排序 的结果一致)。
+    """
+    new_items = sorted(new_items, key=timestamp_key)
+    merged = []
+    lo = 0
+    for item in new_items:
+        pos = bisect.bisect_right(existing, timestamp_key(item), lo=lo, key=timestamp_key)
+        merged.extend(existing[lo:pos])
+        merged.append(item)
+        lo = pos
+    merged.extend(existing[lo:])
+    return merged
+
+
+def page_sorted_items(items: list, id_attr: str, cursor, limit: int, forward: bool) -> Tuple[list, bool]:
+    """
+    在已按时间排序的列表上做游标分页 (参数和返回值同 StorageBackend.load_page):
+    二分定位游标所在的时间戳，再在同一时间戳的条目中找 id
+    """
+    if cursor is None:
+        start = end = 0 if forward else len(items)
+    else:
+        cursor_ts, cursor_id = cursor
+        lo = bisect.bisect_left(items, cursor_ts, key=timestamp_key)
+        hi = bisect.bisect_right(items, cursor_ts, lo=lo, key=timestamp_key)
+        # 游标条目已不存在时，跳过与它同一时间戳的所有条目
+        start, end = hi, lo
+        for idx in range(lo, hi):
+            if getattr(items[idx], id_attr) == cursor_id:
+                start, end = idx + 1, idx
+                break
+    if forward:
+        return items[start:start + limit], start + limit < len(items)
+    begin = max(0, end - limit)
+    return items[begin:end], begin > 0
+
+
+def filter_by_time(items, start=None, end=None):
+    """在内存中筛选 [start, end) 区间内的消息 / 事件，并按 UTC 时间排序"""
+    start = normalize_to_utc(start) if start is not None else None
+    end = normalize_to_utc(end) if end is not None else None
+    selected = [
+        item for item in items
+        if (start is None or normalize_to_utc(item.timestamp) >= start)
+        and (end is None or normalize_to_utc(item.timestamp) < end)
+    ]
+    selected.sort(key=lambda item: normalize_to_utc(item.timestamp))
+    return selected
+
+
+_storage: Optional[StorageBackend] = None
+
+
+def get_storage() -> StorageBackend:
+    """根据 settings.STORAGE_BACKEND 创建 (并缓存) 当前使用的存储后端"""
+    global _storage
+    if _storage is None:
+        backend = settings.STORAGE_BACKEND.lower()
+        if backend == "json":
+            from app.services.json_storage import JsonStorageBackend
+            _storage = JsonStorageBackend(settings.DATA_PATH)
+        elif backend == "sqlite":
+            from app.services.sqlite_storage import SqliteStorageBackend
+            _storage = SqliteStorageBackend(settings.SQLITE_PATH)
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {settings.STORAGE_BACKEND}")
+    return _storage
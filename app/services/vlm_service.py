@@ -1,33 +1,45 @@
-import base64
+import asyncio
 import datetime
+import hashlib
 import json
-from typing import List, Tuple
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from openai import APIError
-from PIL import Image
-import io
 
 from app.core.config import settings
 # [修改] 导入 VLMUsage
-from app.core.models import Message, VLMResponseModel, VLMMessageItem, VLMUsage
-from app.core.prompts import VLM_CHAT_PARSE_PROMPT
+from app.core.models import (
+    Message, VLMResponseModel, VLMMessageItem, VLMUsage, ImportResult, BatchImportResponse, ImagePreprocessStats,
+    VLMBatchResponseModel
+)
+from app.core.prompts import VLM_CHAT_PARSE_PROMPT, VLM_BATCH_PARSE_PROMPT
 from app.services.llm_client import vlm_client
+from app.services.blob_store import get_raw_output_store, get_vlm_cache_store
+from app.services.image_preprocess import PreparedImage, prepare_image, split_tall_image, image_size
+from app.services import overlap_dedup
 
 # 定义 CST 时区 (UTC+8) - 根据您的实际时区调整
 # 如果需要更灵活的时区处理，未来可以考虑 pytz 或 zoneinfo
 CST_TZ = datetime.timezone(datetime.timedelta(hours=8))
 
 
-def get_image_base64(image_bytes: bytes) -> str:
-    # ... (此函数保持不变) ...
+def _store_raw_output(image_hash: str, raw_text: str, overwrite: bool = True) -> Optional[str]:
+    """
+    [新增] 把 VLM 原始输出写入旁路存储 (以截图 Hash 为键)，返回引用键。
+    一张截图解析出的所有消息共享同一份原始输出，不再逐条内联。
+    overwrite 为 False 时只在还没有记录时写入 (不覆盖之前保存的真实模型输出)。
+    """
     try:
-        Image.open(io.BytesIO(image_bytes))
-    except Exception:
-        raise ValueError("Invalid image file")
-    return base64.b64encode(image_bytes).decode('utf-8')
+        get_raw_output_store().put(image_hash, raw_text.encode('utf-8'), overwrite=overwrite)
+        return image_hash
+    except Exception as e:
+        print(f"Warning: Could not store raw VLM output for {image_hash}: {e}")
+        return None
 
 
 def create_error_template(image_hash: str, error_msg: str) -> Message:
     # ... (此函数保持不变, 已确保使用 aware time) ...
+    # [修改] 错误详情 (可能包含原始输出) 也移入旁路存储；已有之前成功解析的原始输出时保留它
     return Message(
         timestamp=datetime.datetime.now(datetime.timezone.utc),
         sender="system",
@@ -35,7 +47,7 @@ def create_error_template(image_hash: str, error_msg: str) -> Message:
         text=f"VLM解析失败，请手动编辑此条目。错误: {error_msg}",
         source_image_hash=image_hash,
         is_editable=True,
-        raw_vlm_output=error_msg,
+        raw_vlm_ref=_store_raw_output(image_hash, error_msg, overwrite=False),
         auto_filled_date=True,
         auto_filled_time=True
     )
@@ -114,60 +126,195 @@ def process_vlm_item(item: VLMMessageItem, image_hash: str) -> Message:
     )
 
 
-async def parse_image_to_messages(image_bytes: bytes, image_hash: str) -> Tuple[List[Message], VLMUsage]:
-    """
-    调用VLM解析单张截图，返回 Message 列表 和 Token用量。
-    """
-    usage = VLMUsage()
+# --- [新增] VLM 解析结果缓存 ---
+# temperature=0 时，同一张图、同一模型、同一提示词的解析结果是确定的。
+# 解析成功的 VLMResponseModel 以 (图片 Hash, 模型名, 提示词 Hash, 预处理参数) 为键存入磁盘 (按大小 LRU 淘汰)；
+# 同一个键的并发请求共享一次进行中的调用，只有一次真正发给模型。
+
+_PROMPT_HASH = hashlib.sha256(VLM_CHAT_PARSE_PROMPT.encode('utf-8')).hexdigest()[:16]
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+class _InflightAbandoned(Exception):
+    """批量请求没有产生这张图的结果 (退回逐张解析或被取消)，等待它的请求需要自己重新解析"""
+
+
+class _VLMFormatError(Exception):
+    """模型返回的内容不符合 VLMResponseModel (不缓存)"""
+
+    def __init__(self, raw_text: str, usage: VLMUsage, error: Exception):
+        super().__init__(str(error))
+        self.raw_text = raw_text
+        self.usage = usage
+        self.error = error
+
+
+def _parse_cache_key(image_hash: str) -> str:
+    # 预处理参数决定了实际发送给模型的图片，也是键的一部分
+    if settings.IMAGE_PREPROCESS_ENABLED:
+        preprocess = (f"{settings.IMAGE_MAX_DIMENSION}:{settings.IMAGE_OUTPUT_FORMAT.upper()}:"
+                      f"{settings.IMAGE_QUALITY}:{settings.IMAGE_GRAYSCALE}")
+    else:
+        preprocess = "original"
+    material = "\0".join((image_hash, settings.VLM_MODEL_NAME, _PROMPT_HASH, preprocess))
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def _load_cached_parse(cache_key: str) -> Optional[VLMResponseModel]:
+    if not settings.VLM_CACHE_ENABLED:
+        return None
+    try:
+        data = get_vlm_cache_store().get(cache_key)
+        return VLMResponseModel.model_validate_json(data) if data is not None else None
+    except Exception as e:
+        print(f"Warning: Ignoring unreadable VLM cache entry {cache_key}: {e}")
+        return None
+
+
+def _store_cached_parse(cache_key: str, parsed: VLMResponseModel):
+    if not settings.VLM_CACHE_ENABLED:
+        return
     try:
-        image_b64 = get_image_base64(image_bytes)
-
-        completion = await vlm_client.chat.completions.create(
-            model=settings.VLM_MODEL_NAME,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": VLM_CHAT_PARSE_PROMPT},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_b64}"
-                            },
+        get_vlm_cache_store().put(cache_key, parsed.model_dump_json().encode('utf-8'))
+    except OSError as e:
+        print(f"Warning: Could not store VLM cache entry {cache_key}: {e}")
+
+
+def is_parse_cached(image_hash: str) -> bool:
+    """这张图在当前模型 / 提示词 / 预处理参数下是否已有缓存的解析结果"""
+    return settings.VLM_CACHE_ENABLED and get_vlm_cache_store().exists(_parse_cache_key(image_hash))
+
+
+async def _call_vlm(image_bytes: bytes, prepared: Optional[PreparedImage]) -> Tuple[str, VLMUsage]:
+    """真正调用 VLM，返回原始输出和 Token 用量"""
+    if prepared is None:
+        prepared = await prepare_image(image_bytes)
+
+    completion = await vlm_client.chat.completions.create(
+        model=settings.VLM_MODEL_NAME,
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": VLM_CHAT_PARSE_PROMPT},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": prepared.data_url
                         },
-                    ],
-                }
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.0
+                    },
+                ],
+            }
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.0
+    )
+
+    return _read_completion(completion)
+
+
+def _read_completion(completion) -> Tuple[str, VLMUsage]:
+    raw_response_text = completion.choices[0].message.content
+
+    print("\n" + "=" * 50)
+    print(f"[VLM Service] Received raw JSON from model ({settings.VLM_MODEL_NAME}):")
+    print(raw_response_text)
+    print("=" * 50 + "\n")
+
+    usage = VLMUsage()
+    if completion.usage:
+        usage = VLMUsage(
+            prompt_tokens=completion.usage.prompt_tokens,
+            completion_tokens=completion.usage.completion_tokens,
+            total_tokens=completion.usage.total_tokens
         )
+    return raw_response_text, usage
+
 
-        raw_response_text = completion.choices[0].message.content
+async def _fetch_parse(
+        cache_key: str,
+        image_bytes: bytes,
+        prepared: Optional[PreparedImage]
+) -> Tuple[VLMResponseModel, str, VLMUsage]:
+    raw_response_text, usage = await _call_vlm(image_bytes, prepared)
+    try:
+        parsed_response = VLMResponseModel(**json.loads(raw_response_text))
+    except Exception as e:
+        raise _VLMFormatError(raw_response_text, usage, e)
+    _store_cached_parse(cache_key, parsed_response)
+    return parsed_response, raw_response_text, usage
 
-        print("\n" + "=" * 50)
-        print(f"[VLM Service] Received raw JSON from model ({settings.VLM_MODEL_NAME}):")
-        print(raw_response_text)
-        print("=" * 50 + "\n")
 
-        if completion.usage:
-            usage = VLMUsage(
-                prompt_tokens=completion.usage.prompt_tokens,
-                completion_tokens=completion.usage.completion_tokens,
-                total_tokens=completion.usage.total_tokens
-            )
+def _forget_inflight(cache_key: str, task: asyncio.Future):
+    if _inflight.get(cache_key) is task:  # 同一个键可能已经登记了新的调用
+        del _inflight[cache_key]
+    if not task.cancelled():
+        task.exception()  # 标记异常已被读取 (等待方可能都已取消)
+
+
+async def _get_parse(
+        image_hash: str,
+        image_bytes: bytes,
+        prepared: Optional[PreparedImage],
+        use_cache: bool
+) -> Tuple[VLMResponseModel, str, VLMUsage]:
+    """
+    返回 (解析结果, 原始输出, 本次产生的 Token 用量)。
+    命中缓存或加入了其他请求进行中的调用时，用量为 0 并标记 cached。
+    use_cache 为 False 时跳过读取缓存 (重新解析)，结果仍会写回缓存。
+    """
+    cache_key = _parse_cache_key(image_hash)
+    if use_cache:
+        cached = _load_cached_parse(cache_key)
+        if cached is not None:
+            print(f"[VLM Service] Cache hit for {image_hash[:12]}")
+            return cached, cached.model_dump_json(), VLMUsage(cached=True)
+
+    task = _inflight.get(cache_key)
+    if task is not None:
+        try:
+            parsed_response, raw_response_text, _ = await asyncio.shield(task)
+        except _VLMFormatError as e:
+            raise _VLMFormatError(e.raw_text, VLMUsage(cached=True), e.error)
+        except _InflightAbandoned:
+            return await _get_parse(image_hash, image_bytes, prepared, use_cache)
+        return parsed_response, raw_response_text, VLMUsage(cached=True)
+
+    task = asyncio.ensure_future(_fetch_parse(cache_key, image_bytes, prepared))
+    _inflight[cache_key] = task
+    task.add_done_callback(lambda done: _forget_inflight(cache_key, done))
+    return await asyncio.shield(task)
+
 
+async def parse_image_to_messages(
+        image_bytes: bytes,
+        image_hash: str,
+        prepared: Optional[PreparedImage] = None,
+        use_cache: bool = True
+) -> Tuple[List[Message], VLMUsage]:
+    """
+    调用VLM解析单张截图，返回 Message 列表 和 Token用量。
+    [修改] 发送前先做预处理 (缩放 / 重新编码)；调用方已预处理过时可以直接传入 prepared。
+    [修改] 解析结果经由磁盘缓存，同一张图不会重复付费调用 (use_cache=False 强制重新解析)。
+    """
+    usage = VLMUsage()
+    try:
         try:
-            vlm_data = json.loads(raw_response_text)
-            parsed_response = VLMResponseModel(**vlm_data)
-        except (json.JSONDecodeError, Exception) as pydantic_error:
-            error_msg = f"VLM返回格式错误: {pydantic_error}. 原始输出: {raw_response_text}"
-            return [create_error_template(image_hash, error_msg)], usage
+            parsed_response, raw_response_text, usage = await _get_parse(
+                image_hash, image_bytes, prepared, use_cache
+            )
+        except _VLMFormatError as e:
+            error_msg = f"VLM返回格式错误: {e.error}. 原始输出: {e.raw_text}"
+            return [create_error_template(image_hash, error_msg)], e.usage
 
         processed_messages = []
+        # 命中缓存 / 共享进行中的调用时，raw_response_text 不是这次的模型输出 (缓存中是重新序列化的结果)，
+        # 只在旁路存储中还没有记录时补上
+        raw_ref = _store_raw_output(image_hash, raw_response_text, overwrite=not usage.cached)
         for item in parsed_response.messages:
             # [修改] 调用更新后的 process_vlm_item
             msg = process_vlm_item(item, image_hash)
-            msg.raw_vlm_output = raw_response_text
+            msg.raw_vlm_ref = raw_ref  # [修改] 只保存引用，原始输出通过调试接口按需获取
             processed_messages.append(msg)
 
         return processed_messages, usage
@@ -178,3 +325,373 @@ async def parse_image_to_messages(image_bytes: bytes, image_hash: str) -> Tuple[
     except Exception as e:
         error_msg = f"Unknown Error: {str(e)}"
         return [create_error_template(image_hash, error_msg)], usage
+
+
+async def _parse_with_limit(
+        semaphore: asyncio.Semaphore,
+        image_hash: str,
+        image_bytes: bytes,
+        use_cache: bool,
+        prepared: Optional[PreparedImage] = None
+) -> Tuple[List[Message], VLMUsage, Optional[ImagePreprocessStats], float]:
+    """
+    预处理后在 semaphore 限制下解析一张图 (或长截图的一片)，返回 (消息, 用量, 预处理效果, 解析耗时 ms)。
+    预处理在进程池中进行，不占用 VLM 并发名额；已有缓存结果的图片不需要预处理。
+    """
+    if prepared is None and not (use_cache and is_parse_cached(image_hash)):
+        prepared = await prepare_image(image_bytes)
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            messages, usage = await parse_image_to_messages(
+                image_bytes, image_hash, prepared=prepared, use_cache=use_cache
+            )
+        except Exception as e:
+            messages, usage = [create_error_template(image_hash, f"Unknown Error: {e}")], VLMUsage()
+        latency_ms = (time.perf_counter() - started) * 1000
+    return messages, usage, prepared.stats if prepared else None, latency_ms
+
+
+def _carry_dates_forward(messages: List[Message]):
+    """
+    长截图只有第一片能看到顶部的日期分隔条，后面的片识别出时间但没有日期时会被填成今天。
+    这里沿用前面最近一条识别出的日期 (auto_filled_date 仍保持 True，提示用户核对)。
+    """
+    last_date = None
+    for msg in messages:
+        local = msg.timestamp.astimezone(CST_TZ)
+        if not msg.auto_filled_date:
+            last_date = local.date()
+        elif last_date is not None and not msg.auto_filled_time:
+            msg.timestamp = datetime.datetime.combine(last_date, local.time(), CST_TZ).astimezone(datetime.timezone.utc)
+
+
+async def _parse_tiles(
+        semaphore: asyncio.Semaphore,
+        image_hash: str,
+        image_bytes: bytes,
+        tiles: List[bytes],
+        use_cache: bool
+) -> Tuple[List[Message], VLMUsage, Optional[ImagePreprocessStats], float]:
+    """
+    [新增] 并发解析长截图的各片并拼接。每片以自身内容的 Hash 缓存和保存原始输出，
+    拼接后的消息的 source_image_hash 仍是整张截图的 Hash。耗时为各片从第一片开始到最后一片完成的墙钟时间。
+    """
+    started = time.perf_counter()
+    tile_hashes = [hashlib.sha256(tile).hexdigest() for tile in tiles]
+    outcomes = await asyncio.gather(*(
+        _parse_with_limit(semaphore, tile_hash, tile, use_cache) for tile_hash, tile in zip(tile_hashes, tiles)
+    ))
+    latency_ms = (time.perf_counter() - started) * 1000
+
+    messages = overlap_dedup.stitch_tiles([tile_messages for tile_messages, _, _, _ in outcomes])
+    for msg in messages:
+        msg.source_image_hash = image_hash
+    _carry_dates_forward(messages)
+
+    usage = VLMUsage(cached=all(tile_usage.cached for _, tile_usage, _, _ in outcomes))
+    for _, tile_usage, _, _ in outcomes:
+        usage.prompt_tokens += tile_usage.prompt_tokens
+        usage.completion_tokens += tile_usage.completion_tokens
+        usage.total_tokens += tile_usage.total_tokens
+
+    tile_stats = [stats for _, _, stats, _ in outcomes if stats is not None]
+    stats = None
+    if tile_stats:
+        # 字节数和尺寸的原图一侧按整张长截图计，处理后一侧及 token 估计为各片之和 (含重叠部分)
+        stats = ImagePreprocessStats(
+            original_bytes=len(image_bytes),
+            processed_bytes=sum(item.processed_bytes for item in tile_stats),
+            original_size=image_size(image_bytes),
+            processed_size=(tile_stats[0].processed_size[0], sum(item.processed_size[1] for item in tile_stats)),
+            mime_type=tile_stats[0].mime_type,
+            estimated_tokens_before=sum(item.estimated_tokens_before for item in tile_stats),
+            estimated_tokens_after=sum(item.estimated_tokens_after for item in tile_stats),
+        )
+    print(f"[VLM Service] Parsed long screenshot {image_hash[:12]} as {len(tiles)} tiles, "
+          f"{len(messages)} messages after stitching")
+    return messages, usage, stats, latency_ms
+
+
+# --- [新增] 多图批量解析 ---
+# 每个请求都带着完整的解析提示词，图片多时重复的提示词 token 占了不小的比例，每个请求也各有一次往返延迟。
+# VLM_BATCH_SIZE > 1 时把连续的几张截图放进同一个请求，让模型按图分别返回消息，再拆回每张图的结果。
+
+async def _call_vlm_batch(prepared: List[PreparedImage]) -> Tuple[str, VLMUsage]:
+    content = [{"type": "text", "text": VLM_CHAT_PARSE_PROMPT + VLM_BATCH_PARSE_PROMPT.format(count=len(prepared))}]
+    for number, image in enumerate(prepared, start=1):
+        content.append({"type": "text", "text": f"第 {number} 张截图:"})
+        content.append({"type": "image_url", "image_url": {"url": image.data_url}})
+
+    completion = await vlm_client.chat.completions.create(
+        model=settings.VLM_MODEL_NAME,
+        messages=[{"role": "user", "content": content}],
+        response_format={"type": "json_object"},
+        temperature=0.0
+    )
+    return _read_completion(completion)
+
+
+def _split_usage(usage: VLMUsage, count: int) -> List[VLMUsage]:
+    """把一个批量请求的用量平均分摊到其中的各张图 (余数计入前几张)，合计与实际用量相同"""
+    def share(total: int, position: int) -> int:
+        return total // count + (1 if position < total % count else 0)
+
+    return [
+        VLMUsage(
+            prompt_tokens=share(usage.prompt_tokens, position),
+            completion_tokens=share(usage.completion_tokens, position),
+            total_tokens=share(usage.total_tokens, position)
+        )
+        for position in range(count)
+    ]
+
+
+def _register_batch_inflight(cache_keys: List[str]) -> List[asyncio.Future]:
+    """把批量请求中的每张图登记为进行中的调用，其他请求解析同一张图时会等待这次的结果"""
+    loop = asyncio.get_running_loop()
+    futures = []
+    for cache_key in cache_keys:
+        future = loop.create_future()
+        _inflight[cache_key] = future
+        future.add_done_callback(lambda done, key=cache_key: _forget_inflight(key, done))
+        futures.append(future)
+    return futures
+
+
+def _abandon_batch_inflight(cache_keys: List[str], futures: List[asyncio.Future], error: Exception):
+    for cache_key, future in zip(cache_keys, futures):
+        if future.done():
+            continue
+        # 先取消登记，等待方收到异常后重新解析时不会再找到这个 future
+        if _inflight.get(cache_key) is future:
+            del _inflight[cache_key]
+        future.set_exception(error)
+
+
+async def _parse_batch(
+        semaphore: asyncio.Semaphore,
+        images: List[Tuple[str, bytes]],
+        use_cache: bool
+) -> List[Tuple[Tuple[List[Message], VLMUsage, Optional[ImagePreprocessStats], float], int]]:
+    """
+    在一个请求中解析多张截图 (只占一个并发名额)，按输入顺序返回每张图的 ((消息, 用量, 预处理效果, 耗时 ms), 请求中的图片数)。
+    已有缓存结果或其他请求正在解析的图片不放进批量请求，单独解析 (直接使用缓存 / 加入进行中的调用)；
+    批量请求中的图片同样登记为进行中的调用。拆分后的结果按单张图的键写入解析缓存。
+    返回内容无法解析或与输入的图片对不上时，整批退回逐张解析，已经产生的批量请求用量仍分摊计入各张图；
+    API / 网络错误 (限流、5xx、超时) 不逐张重试 (以免在上游过载时成倍增加请求)，批量中的每张图都返回错误模板。
+    """
+    prepared = await asyncio.gather(*(prepare_image(image_bytes) for _, image_bytes in images))
+    cache_keys = [_parse_cache_key(image_hash) for image_hash, _ in images]
+    batched = [
+        position for position, (image_hash, _) in enumerate(images)
+        if cache_keys[position] not in _inflight and not (use_cache and is_parse_cached(image_hash))
+    ]
+    if len(batched) < 2:
+        batched = []
+    singles = [position for position in range(len(images)) if position not in batched]
+
+    async def parse_single(position: int):
+        image_hash, image_bytes = images[position]
+        return await _parse_with_limit(semaphore, image_hash, image_bytes, use_cache, prepared=prepared[position])
+
+    async def parse_batched() -> list:
+        if not batched:
+            return []
+        futures = _register_batch_inflight([cache_keys[position] for position in batched])
+        try:
+            raw_response_text, usage, parsed, latency_ms = await _send_batch(
+                semaphore, [prepared[position] for position in batched]
+            )
+        except APIError as e:
+            _abandon_batch_inflight([cache_keys[position] for position in batched], futures, e)
+            error_msg = f"API Error: {e.code} - {e.message}"
+            return [
+                (([create_error_template(images[position][0], error_msg)], VLMUsage(), prepared[position].stats, 0.0), 1)
+                for position in batched
+            ]
+        except BaseException as e:
+            _abandon_batch_inflight([cache_keys[position] for position in batched], futures,
+                                    e if isinstance(e, Exception) else _InflightAbandoned())
+            raise
+        shares = _split_usage(usage, len(batched))
+
+        if parsed is None:
+            _abandon_batch_inflight([cache_keys[position] for position in batched], futures, _InflightAbandoned())
+            fallbacks = await asyncio.gather(*(parse_single(position) for position in batched))
+            outcomes = []
+            for (messages, single_usage, stats, single_latency_ms), share in zip(fallbacks, shares):
+                total = VLMUsage(
+                    prompt_tokens=share.prompt_tokens + single_usage.prompt_tokens,
+                    completion_tokens=share.completion_tokens + single_usage.completion_tokens,
+                    total_tokens=share.total_tokens + single_usage.total_tokens
+                )
+                outcomes.append(((messages, total, stats, latency_ms + single_latency_ms), 1))
+            return outcomes
+
+        by_index = {item.index: item for item in parsed.images}
+        outcomes = []
+        for number, (position, share, future) in enumerate(zip(batched, shares, futures), start=1):
+            image_hash = images[position][0]
+            response = VLMResponseModel(messages=by_index[number].messages)
+            _store_cached_parse(cache_keys[position], response)
+            future.set_result((response, raw_response_text, share))
+            # 原始输出保存整个请求的真实模型输出 (包含同批其他截图，按 index 对应)
+            raw_ref = _store_raw_output(image_hash, raw_response_text)
+            messages = []
+            for item in response.messages:
+                msg = process_vlm_item(item, image_hash)
+                msg.raw_vlm_ref = raw_ref
+                messages.append(msg)
+            outcomes.append(((messages, share, prepared[position].stats, latency_ms), len(batched)))
+        print(f"[VLM Service] Parsed {len(batched)} images in one request ({usage.total_tokens} tokens)")
+        return outcomes
+
+    single_outcomes, batch_outcomes = await asyncio.gather(
+        asyncio.gather(*(parse_single(position) for position in singles)), parse_batched()
+    )
+    outcomes: list = [None] * len(images)
+    for position, outcome in zip(singles, single_outcomes):
+        outcomes[position] = (outcome, 1)
+    for position, outcome in zip(batched, batch_outcomes):
+        outcomes[position] = outcome
+    return outcomes
+
+
+async def _send_batch(
+        semaphore: asyncio.Semaphore,
+        prepared: List[PreparedImage]
+) -> Tuple[str, VLMUsage, Optional[VLMBatchResponseModel], float]:
+    """
+    发送批量请求，返回 (原始输出, 用量, 拆分后的结果, 耗时 ms)。
+    只有返回内容的 JSON / 结构错误在这里处理 (结果为 None)；API / 网络错误直接抛出。
+    """
+    async with semaphore:
+        started = time.perf_counter()
+        raw_response_text, usage = await _call_vlm_batch(prepared)
+        try:
+            parsed = VLMBatchResponseModel(**json.loads(raw_response_text))
+            if sorted(item.index for item in parsed.images) != list(range(1, len(prepared) + 1)):
+                raise ValueError(f"expected images 1..{len(prepared)}, got {[item.index for item in parsed.images]}")
+        except (ValueError, TypeError) as e:  # ValidationError / JSONDecodeError 都是 ValueError 的子类
+            print(f"[VLM Service] Batch of {len(prepared)} images could not be split ({e}), parsing one by one")
+            parsed = None
+        return raw_response_text, usage, parsed, (time.perf_counter() - started) * 1000
+
+
+async def iter_parsed_images(
+        images: List[Tuple[str, bytes]],
+        max_concurrency: Optional[int] = None,
+        use_cache: bool = True
+) -> AsyncIterator[Tuple[int, ImportResult]]:
+    """
+    [新增] 并发解析一批截图 (image_hash, image_bytes)，同时进行的 VLM 请求不超过 max_concurrency
+    (默认 settings.VLM_MAX_CONCURRENCY)。每张图解析完成后立即产出 (在 images 中的下标, 结果)，
+    即按完成顺序而不是输入顺序；单张图片失败时产出错误模板，不影响其他图片。
+    [新增] 长截图切片后各片同样在这个并发限制内并行解析。
+    [新增] VLM_BATCH_SIZE > 1 时按输入顺序每 VLM_BATCH_SIZE 张分为一组，组内需要调用 VLM 的普通截图合并为一个请求
+    (长截图和已有缓存结果的截图仍单独解析)，同一组的结果一起产出。
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency or settings.VLM_MAX_CONCURRENCY))
+    batch_size = max(1, settings.VLM_BATCH_SIZE)
+
+    def failed(index: int, error: Exception) -> Tuple[int, ImportResult]:
+        image_hash = images[index][0]
+        return index, ImportResult(
+            messages=[create_error_template(image_hash, f"Unknown Error: {error}")],
+            usage=VLMUsage(), image_hash=image_hash
+        )
+
+    def finished(index: int, outcome, tile_count: int = 1, in_request: int = 1) -> Tuple[int, ImportResult]:
+        image_hash = images[index][0]
+        messages, usage, stats, latency_ms = outcome
+        print(f"[VLM Service] Parsed {image_hash[:12]} in {latency_ms:.0f} ms")
+        return index, ImportResult(
+            messages=messages, usage=usage, image_hash=image_hash, latency_ms=latency_ms,
+            preprocess=stats, tile_count=tile_count, batch_size=in_request
+        )
+
+    async def parse_one(index: int, tiles: Optional[List[bytes]]) -> List[Tuple[int, ImportResult]]:
+        image_hash, image_bytes = images[index]
+        try:
+            if tiles:
+                outcome = await _parse_tiles(semaphore, image_hash, image_bytes, tiles, use_cache)
+            else:
+                outcome = await _parse_with_limit(semaphore, image_hash, image_bytes, use_cache)
+        except Exception as e:
+            return [failed(index, e)]
+        return [finished(index, outcome, tile_count=len(tiles) if tiles else 1)]
+
+    async def parse_batch(indices: List[int]) -> List[Tuple[int, ImportResult]]:
+        try:
+            outcomes = await _parse_batch(semaphore, [images[index] for index in indices], use_cache)
+        except Exception as e:
+            return [failed(index, e) for index in indices]
+        return [finished(index, outcome, in_request=size) for index, (outcome, size) in zip(indices, outcomes)]
+
+    async def parse_group(indices: List[int]) -> List[Tuple[int, ImportResult]]:
+        try:
+            group_tiles = await asyncio.gather(*(split_tall_image(images[index][1]) for index in indices))
+        except Exception as e:
+            return [failed(index, e) for index in indices]
+        batched = [
+            index for index, tiles in zip(indices, group_tiles)
+            if not tiles and not (use_cache and is_parse_cached(images[index][0]))
+        ]
+        parts = [parse_one(index, tiles) for index, tiles in zip(indices, group_tiles) if index not in batched]
+        if len(batched) > 1:
+            parts.append(parse_batch(batched))
+        elif batched:
+            parts.append(parse_one(batched[0], None))
+        results = [item for part in await asyncio.gather(*parts) for item in part]
+        return sorted(results, key=lambda item: item[0])
+
+    tasks = [
+        asyncio.ensure_future(parse_group(list(range(start, min(start + batch_size, len(images))))))
+        for start in range(0, len(images), batch_size)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for item in await next_done:
+                yield item
+    finally:
+        # 调用方提前停止迭代 (如客户端断开流式连接) 时，取消尚未完成的解析
+        for task in tasks:
+            task.cancel()
+
+
+async def parse_images_concurrently(
+        images: List[Tuple[str, bytes]],
+        max_concurrency: Optional[int] = None,
+        use_cache: bool = True
+) -> List[ImportResult]:
+    """[新增] 并发解析一批截图，结果按输入顺序返回 (见 iter_parsed_images)"""
+    results: List[Optional[ImportResult]] = [None] * len(images)
+    async for index, result in iter_parsed_images(images, max_concurrency, use_cache):
+        results[index] = result
+    return results
+
+
+def summarize_batch(batch_results: List[ImportResult], started: float) -> BatchImportResponse:
+    """汇总一批解析结果的 Token 用量、耗时、预处理 / 缓存效果和去重的消息数"""
+    total_usage = VLMUsage()
+    bytes_saved = tokens_saved = cache_hits = duplicates_removed = 0
+    for result in batch_results:
+        cache_hits += result.usage.cached
+        duplicates_removed += result.duplicates_removed
+        if result.preprocess:
+            bytes_saved += result.preprocess.bytes_saved
+            tokens_saved += result.preprocess.tokens_saved
+        # [修改] 累加全部三项用量 (之前只累加了 prompt_tokens)
+        total_usage.prompt_tokens += result.usage.prompt_tokens
+        total_usage.completion_tokens += result.usage.completion_tokens
+        total_usage.total_tokens += result.usage.total_tokens
+    return BatchImportResponse(
+        results=batch_results,
+        total_usage=total_usage,
+        total_latency_ms=(time.perf_counter() - started) * 1000,
+        bytes_saved=bytes_saved,
+        estimated_tokens_saved=tokens_saved,
+        cache_hits=cache_hits,
+        duplicates_removed=duplicates_removed
+    )
@@ -0,0 +1,136 @@
+"""
+序列化基准: 对比旧的存储路径 (json.dump(indent=4) + Model(**dict)) 和
+新的存储路径 (可插拔序列化器 + 紧凑格式 + JSONL 消息段) 在大 Profile 上的耗时与文件大小。
+
+用法 (在项目根目录执行):
+    python -m benchmarks.bench_serialization [--messages 100000] [--events 2000] [--repeat 3]
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+# 基准不调用任何模型，Settings 中必填的 API 配置给个占位值即可
+for _key in ("VLM_API_KEY", "VLM_API_BASE", "VLM_MODEL_NAME", "LLM_API_KEY", "LLM_API_BASE", "LLM_MODEL_NAME"):
+    os.environ.setdefault(_key, "benchmark")
+
+from app.core.models import Profile, Message, Event  # noqa: E402
+from app.services import serializer  # noqa: E402
+from app.services.json_storage import JsonStorageBackend  # noqa: E402
+
+_SAMPLE_TEXTS = ["好的", "明天下午三点开会", "收到，我晚点回复你", "[图片]", "哈哈哈哈", "这个方案需要再改一下细节"]
+
+
+def build_profile(n_messages: int, n_events: int) -> Profile:
+    rng = random.Random(42)
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    messages = [
+        Message(
+            timestamp=start + datetime.timedelta(seconds=37 * i),
+            sender=rng.choice(["User 1", "User 2"]),
+            content_type="text",
+            text=rng.choice(_SAMPLE_TEXTS),
+            source_image_hash=f"{i // 20:064x}",
+        )
+        for i in range(n_messages)
+    ]
+    events = [
+        Event(summary=f"事件 {i}: {rng.choice(_SAMPLE_TEXTS)}", timestamp=start + datetime.timedelta(hours=5 * i))
+        for i in range(n_events)
+    ]
+    return Profile(
+        profile_name="Bench", opponent_name="Bench",
+        processed_sources=sorted({m.source_image_hash for m in messages}),
+        messages=messages, events=events,
+    )
+
+
+# --- 旧路径: 主文件内联全部消息，indent=4 的标准库 json ---
+
+def old_save(data_path: str, profile: Profile):
+    with open(os.path.join(data_path, f"profile_{profile.profile_id}.json"), 'w', encoding='utf-8') as f:
+        json.dump(profile.model_dump(mode='json', exclude={'events'}), f, indent=4, ensure_ascii=False)
+    with open(os.path.join(data_path, f"event_{profile.profile_id}.json"), 'w', encoding='utf-8') as f:
+        json.dump([e.model_dump(mode='json') for e in profile.events], f, indent=4, ensure_ascii=False)
+
+
+def old_load(data_path: str, profile_id: str) -> Profile:
+    with open(os.path.join(data_path, f"profile_{profile_id}.json"), 'r', encoding='utf-8') as f:
+        profile = Profile(**{k: v for k, v in json.load(f).items() if k != 'events'})
+    with open(os.path.join(data_path, f"event_{profile_id}.json"), 'r', encoding='utf-8') as f:
+        profile.events = [Event(**d) for d in json.load(f)]
+    return profile
+
+
+# --- 新路径: 存储后端 ---
+
+def new_save(backend: JsonStorageBackend, profile: Profile):
+    backend.save_profile(profile)
+    backend.save_events(profile.profile_id, profile.events)
+
+
+def new_load(backend: JsonStorageBackend, profile_id: str) -> Profile:
+    profile = backend.load_profile(profile_id)
+    profile.events = backend.load_events(profile_id)
+    return profile
+
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def best_of(repeat: int, fn) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--events", type=int, default=2_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"Building profile with {args.messages} messages / {args.events} events ...")
+    profile = build_profile(args.messages, args.events)
+    print(f"Serializer: {serializer.SERIALIZER_NAME}")
+
+    old_dir = tempfile.mkdtemp(prefix="bench_old_")
+    new_dir = tempfile.mkdtemp(prefix="bench_new_")
+    try:
+        backend = JsonStorageBackend(new_dir)
+        results = {
+            "old": (
+                best_of(args.repeat, lambda: old_save(old_dir, profile)),
+                best_of(args.repeat, lambda: old_load(old_dir, profile.profile_id)),
+                dir_size(old_dir),
+            ),
+            "new": (
+                best_of(args.repeat, lambda: new_save(backend, profile)),
+                best_of(args.repeat, lambda: new_load(backend, profile.profile_id)),
+                dir_size(new_dir),
+            ),
+        }
+        assert len(new_load(backend, profile.profile_id).messages) == args.messages
+
+        print(f"{'path':<6}{'save (s)':>12}{'load (s)':>12}{'size (MB)':>12}")
+        for name, (save_s, load_s, size) in results.items():
+            print(f"{name:<6}{save_s:>12.3f}{load_s:>12.3f}{size / 1024 / 1024:>12.2f}")
+        (old_save_s, old_load_s, old_size), (new_save_s, new_load_s, new_size) = results["old"], results["new"]
+        print(f"speedup: save x{old_save_s / new_save_s:.2f}, load x{old_load_s / new_load_s:.2f}, "
+              f"size x{new_size / old_size:.2f}")
+    finally:
+        shutil.rmtree(old_dir, ignore_errors=True)
+        shutil.rmtree(new_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+有序插入微基准: 对比 "追加后整体重新排序" (旧路径) 与 "新批次归并进有序列表" (merge_sorted)
+在历史记录不断增长时，每插入一批消息的耗时。
+
+用法 (在项目根目录执行):
+    python -m benchmarks.bench_sorted_insert [--batch 20] [--sizes 1000,10000,100000] [--repeat 5]
+"""
+import argparse
+import datetime
+import os
+import random
+import time
+
+# 基准不调用任何模型，Settings 中必填的 API 配置给个占位值即可
+for _key in ("VLM_API_KEY", "VLM_API_BASE", "VLM_MODEL_NAME", "LLM_API_KEY", "LLM_API_BASE", "LLM_MODEL_NAME"):
+    os.environ.setdefault(_key, "benchmark")
+
+from app.core.models import Message  # noqa: E402
+from app.services.storage_backend import normalize_to_utc, merge_sorted  # noqa: E402
+
+_START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def make_messages(rng: random.Random, count: int, span_seconds: int) -> list:
+    return [
+        Message(
+            timestamp=_START + datetime.timedelta(seconds=rng.randrange(span_seconds)),
+            sender="User 1", content_type="text", text="benchmark",
+        )
+        for _ in range(count)
+    ]
+
+
+def old_insert(history: list, batch: list) -> list:
+    merged = history + batch
+    merged.sort(key=lambda m: normalize_to_utc(m.timestamp))
+    return merged
+
+
+def new_insert(history: list, batch: list) -> list:
+    return merge_sorted(history, batch)
+
+
+def best_of(repeat: int, fn) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=20, help="每次插入的消息条数")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="历史记录条数，逗号分隔")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    sizes = [int(s) for s in args.sizes.split(",")]
+    print(f"batch = {args.batch} messages per insert")
+    print(f"{'history':>10}{'full sort (ms)':>18}{'merge (ms)':>14}{'speedup':>10}")
+    for size in sizes:
+        span = max(size * 30, 1)
+        history = sorted(make_messages(rng, size, span), key=lambda m: m.timestamp)
+        # 新批次落在历史的末尾附近 (最常见的情况是导入最近的聊天截图)
+        batch = make_messages(rng, args.batch, span + 3600)
+
+        assert [m.message_id for m in old_insert(history, batch)] == [m.message_id for m in new_insert(history, batch)]
+        old_s = best_of(args.repeat, lambda: old_insert(history, batch))
+        new_s = best_of(args.repeat, lambda: new_insert(history, batch))
+        print(f"{size:>10}{old_s * 1000:>18.2f}{new_s * 1000:>14.2f}{old_s / new_s:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -57,7 +57,6 @@ function ChatUpload() {
   };
 
   const handleVLMUpload = async () => {
-    // ... (此函数保持不变) ...
     if (files.length === 0) return;
     setIsLoading(true);
     setProgress({ current: 0, total: files.length });
@@ -72,23 +71,25 @@ function ChatUpload() {
     }
     let currentRunMessages = [];
     const currentRunImageMap = {};
-    const currentRunUsage = { prompt_tokens: 0, completion_tokens: 0, total_tokens: 0 };
+    let completed = 0;
     try {
-      for (let i = 0; i < files.length; i++) {
-        const file = files[i];
-        setProgress({ current: i + 1, total: files.length });
-        const formData = new FormData();
-        formData.append('files', file);
-        const response = await apiClient.post(
-          `/import/${profileId}/upload_screenshots`,
-          formData,
-          { headers: { 'Content-Type': 'multipart/form-data' } }
-        );
-        const { results, total_usage } = response.data;
-        if (results && results.length > 0) {
-          const result = results[0];
+      // [修改] 一次上传整批截图，使用流式接口 (NDJSON)：每张图解析完成就立即显示，不必等待整批结束
+      const formData = new FormData();
+      files.forEach(file => formData.append('files', file));
+      const response = await fetch(
+        `${apiClient.defaults.baseURL}/import/${profileId}/upload_screenshots/stream`,
+        { method: 'POST', body: formData }
+      );
+      if (!response.ok) {
+        const errorBody = await response.json().catch(() => ({}));
+        throw new Error(errorBody.detail || `HTTP ${response.status}`);
+      }
+
+      const handleEvent = (event) => {
+        if (event.type === 'result') {
+          const result = event.result;
           const imageHash = result.image_hash;
-          const dataUrl = fileDataUrls[i];
+          const dataUrl = fileDataUrls[event.index];
           if (imageHash && dataUrl) {
             currentRunImageMap[imageHash] = dataUrl;
           }
@@ -97,20 +98,39 @@ function ChatUpload() {
             source_image_hash: imageHash
           }));
           currentRunMessages.push(...messagesWithHash);
+          completed += 1;
+          setProgress({ current: completed, total: files.length });
+          const sortedMessages = [...currentRunMessages].sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
+          setEditableMessages(sortedMessages);
+          setImagePreviewMap({...currentRunImageMap});
+        } else if (event.type === 'summary' && event.summary?.total_usage) {
+          const { prompt_tokens, completion_tokens, total_tokens } = event.summary.total_usage;
+          setTotalUsage({ prompt_tokens, completion_tokens, total_tokens });
+          // [新增] 与已导入截图近似重复的图片没有解析
+          const skipped = (event.summary.near_duplicates || []).filter(item => item.skipped);
+          if (skipped.length > 0) {
+            alert(`${skipped.length} 张截图与已导入的截图几乎相同，已跳过解析`);
+          }
         }
-        if (total_usage) {
-          currentRunUsage.prompt_tokens += total_usage.prompt_tokens;
-          currentRunUsage.completion_tokens += total_usage.completion_tokens;
-          currentRunUsage.total_tokens += total_usage.total_tokens;
-        }
-        const sortedMessages = [...currentRunMessages].sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
-        setEditableMessages(sortedMessages);
-        setImagePreviewMap({...currentRunImageMap});
-        setTotalUsage({...currentRunUsage});
+      };
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffered = '';
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = lines.pop();
+        lines.filter(line => line.trim()).forEach(line => handleEvent(JSON.parse(line)));
+      }
+      if (buffered.trim()) {
+        handleEvent(JSON.parse(buffered));
       }
     } catch (error) {
       console.error("VLM upload failed:", error);
-      alert("解析失败: " + (error.response?.data?.detail || error.message));
+      alert("解析失败: " + error.message);
     } finally {
       setIsLoading(false);
       setProgress({ current: 0, total: 0 });
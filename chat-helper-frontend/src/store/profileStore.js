@@ -26,8 +26,9 @@ export const useProfileStore = create((set, get) => ({
   fetchProfiles: async () => {
     set({ isLoading: true });
     try {
-      const response = await apiClient.get('/profiles/');
-      set({ profiles: response.data, isLoading: false });
+      // 列表页只需要元数据摘要，不必下载每个 Profile 的全部消息
+      const response = await apiClient.get('/profiles/summary', { params: { limit: 500 } });
+      set({ profiles: response.data.items, isLoading: false });
     } catch (error) {
       console.error("Failed to fetch profiles:", error);
       set({ isLoading: false });
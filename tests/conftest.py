@@ -0,0 +1,19 @@
+"""
+测试公共配置: 在导入 app 之前把所有数据路径指向临时目录，并填入模型配置的占位值
+(测试不会真正调用 VLM / LLM)。
+"""
+import os
+import tempfile
+
+_DATA_DIR = tempfile.mkdtemp(prefix="chat_helper_tests_")
+
+for _key in ("VLM_API_KEY", "LLM_API_KEY", "VLM_MODEL_NAME", "LLM_MODEL_NAME"):
+    os.environ.setdefault(_key, "test")
+for _key in ("VLM_API_BASE", "LLM_API_BASE"):
+    os.environ.setdefault(_key, "http://127.0.0.1:9")
+os.environ["DATA_PATH"] = os.path.join(_DATA_DIR, "profiles")
+os.environ["SQLITE_PATH"] = os.path.join(_DATA_DIR, "chat_helper.db")
+os.environ["BLOB_PATH"] = os.path.join(_DATA_DIR, "blobs")
+os.environ["JOBS_DB_PATH"] = os.path.join(_DATA_DIR, "jobs.db")
+os.environ["METERING_DB_PATH"] = os.path.join(_DATA_DIR, "metering.db")
+os.environ["STORAGE_BACKEND"] = "json"
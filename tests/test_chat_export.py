@@ -0,0 +1,166 @@
+import datetime
+import io
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.core.models import Message, Profile
+from app.services import chat_export, profile_service
+
+
+@pytest.fixture
+def profile_id():
+    profile = Profile(profile_name="老板", opponent_name="老板", user_name="小王")
+    profile_service.save_profile(profile)
+    return profile.profile_id
+
+
+def _text_export(entries):
+    """entries: (本地时间 "YYYY-MM-DD HH:MM:SS", 发送者, 内容)"""
+    return "".join(f"{when} {sender}\n{text}\n\n" for when, sender, text in entries).encode("utf-8")
+
+
+def _import(profile_id, data, filename="export.txt", **kwargs):
+    return chat_export.import_chat_export(profile_id, io.BytesIO(data), filename, self_names=["小王"], **kwargs)
+
+
+def _texts(profile_id):
+    return sorted(msg.text for msg in profile_service.get_profile(profile_id).messages)
+
+
+# --- 去重 ---
+
+def test_repeated_message_in_unsorted_export_is_not_dropped(profile_id, monkeypatch):
+    monkeypatch.setattr(settings, "EXPORT_IMPORT_CHUNK_SIZE", 2)
+    # 09:30 的两条 "好" 被 09:31 的消息隔开，未按时间排序时落在不同的块里
+    data = _text_export([
+        ("2024-03-01 09:30:05", "小王", "好"),
+        ("2024-03-01 09:31:00", "老板", "收到"),
+        ("2024-03-01 09:30:40", "小王", "好"),
+        ("2024-03-01 09:29:00", "老板", "在吗"),
+    ])
+    result = _import(profile_id, data)
+    assert (result.imported, result.duplicates_skipped) == (4, 0)
+    assert _texts(profile_id) == ["在吗", "好", "好", "收到"]
+
+    again = _import(profile_id, data)
+    assert (again.imported, again.duplicates_skipped) == (0, 4)
+
+
+def test_existing_message_is_matched_only_once_across_chunks(profile_id, monkeypatch):
+    monkeypatch.setattr(settings, "EXPORT_IMPORT_CHUNK_SIZE", 2)
+    existing = chat_export.parse_timestamp("2024-03-01 09:30:00")
+    profile_service.append_messages(profile_id, [Message(timestamp=existing, sender="User 1", content_type="text", text="好")])
+    data = _text_export([
+        ("2024-03-01 09:30:05", "小王", "好"),
+        ("2024-03-01 09:31:00", "老板", "收到"),
+        ("2024-03-01 09:30:40", "小王", "好"),
+    ])
+    result = _import(profile_id, data, dry_run=True)
+    assert (result.imported, result.duplicates_skipped) == (2, 1)
+    result = _import(profile_id, data)
+    assert (result.imported, result.duplicates_skipped) == (2, 1)
+    assert _texts(profile_id) == ["好", "好", "收到"]
+
+
+# --- JSON 包装对象 ---
+
+_RECORDS = '[{"time": "2024-03-01 09:30:00", "sender": "老板", "content": "在吗"},\n' \
+           ' {"time": "2024-03-01 09:31:00", "sender": "小王", "content": "在的"}]'
+
+
+@pytest.mark.parametrize("wrapper", [
+    # 多行对象，元数据中的数组在消息数组之前
+    '{\n  "meta": {"tags": ["工作", "重要"], "members": [{"name": "老板"}]},\n  "messages": %s\n}',
+    # 键名不是常见别名，按元素内容识别
+    '{\n  "tags": ["a"],\n  "chat_log":\n  %s\n}',
+    # 单行对象
+    '{"tags": ["a", "b"], "data": %s}',
+])
+def test_message_array_is_found_inside_wrapper(wrapper):
+    text = wrapper % (_RECORDS if "\n" in wrapper else _RECORDS.replace("\n", ""))
+    records = list(chat_export.iter_json_records(io.StringIO(text)))
+    assert [record.text for record in records] == ["在吗", "在的"]
+
+
+def test_wrapper_without_message_array_is_rejected():
+    with pytest.raises(HTTPException) as excinfo:
+        list(chat_export.iter_json_records(io.StringIO('{\n  "tags": ["a", "b"],\n  "count": 2\n}')))
+    assert excinfo.value.status_code == 400
+
+
+# --- 逐条解析 ---
+
+def _local(text):
+    return chat_export.parse_timestamp(text)
+
+
+def test_iter_text_records_qq_and_wechat_headers():
+    lines = io.StringIO(
+        "消息记录（此消息记录为文本格式，不支持重新导入）\n"
+        "================================================================\n"
+        "消息对象:老板\n\n"
+        "2024-03-01 09:30:12 老板(123456789)\n在吗？\n\n"
+        "小王 2024/3/1 9:31\n在的\n第二行\n\n"
+        "2024-03-01 09:32:00 小王<me@qq.com>\n\n"
+        "2024年03月01日 09:33 老板\n[图片]\n"
+    )
+    records = list(chat_export.iter_text_records(lines))
+    assert records[0] == chat_export.ExportRecord(_local("2024-03-01 09:30:12"), "老板", "在吗？", "text")
+    assert records[1] == chat_export.ExportRecord(_local("2024-03-01 09:31"), "小王", "在的\n第二行", "text")
+    assert records[2] is None  # 没有内容
+    assert (records[3].sender, records[3].content_type) == ("老板", "image")
+
+
+def test_iter_csv_records():
+    lines = io.StringIO(
+        "localId,Type,IsSender,CreateTime,StrContent,NickName\n"
+        "1,1,1,1709256600,好的,小王\n"
+        "2,3,0,1709256660000,[图片],老板\n"
+        "3,1,0,,没有时间,老板\n"
+    )
+    records = list(chat_export.iter_csv_records(lines))
+    assert records[0].timestamp == datetime.datetime(2024, 3, 1, 1, 30, tzinfo=datetime.timezone.utc)
+    assert (records[0].text, records[0].is_self, records[0].content_type) == ("好的", True, "text")
+    assert (records[1].is_self, records[1].content_type) == (False, "image")
+    assert records[1].timestamp == datetime.datetime(2024, 3, 1, 1, 31, tzinfo=datetime.timezone.utc)
+    assert records[2] is None
+
+
+def test_iter_csv_records_requires_time_and_text_columns():
+    with pytest.raises(HTTPException) as excinfo:
+        list(chat_export.iter_csv_records(io.StringIO("name,content\n老板,在吗\n")))
+    assert excinfo.value.status_code == 400
+
+
+def test_iter_json_records_json_lines():
+    lines = io.StringIO(
+        '\n{"time": "2024-03-01T09:30:00+08:00", "from": "老板", "msg": "在吗"}\n'
+        'not json\n'
+        '{"time": "2024-03-01T09:31:00+08:00", "from": "小王", "msg": ""}\n'
+    )
+    records = list(chat_export.iter_json_records(lines))
+    assert records[0].timestamp == datetime.datetime(2024, 3, 1, 1, 30, tzinfo=datetime.timezone.utc)
+    assert records[1:] == [None, None]
+    assert list(chat_export.iter_json_records(io.StringIO("\n\n"))) == []
+
+
+def test_iter_json_records_top_level_array():
+    text = '[\n' + ',\n'.join(
+        '{"timestamp": %d, "sender": "老板", "text": "m%d"}' % (1709256600 + i, i) for i in range(50)
+    ) + '\n]'
+    assert [record.text for record in chat_export.iter_json_records(io.StringIO(text))] == [f"m{i}" for i in range(50)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64 * 1024])
+def test_iter_json_array_across_chunk_boundaries(chunk_size):
+    text = ' {"a": [1, 2]}, 12345 ,"x,]y", [3], -0.5e3 ] trailing'
+    items = list(chat_export._iter_json_array(io.StringIO(text), chunk_size=chunk_size))
+    assert items == [{"a": [1, 2]}, 12345, "x,]y", [3], -500.0]
+
+
+def test_iter_json_array_unterminated():
+    assert list(chat_export._iter_json_array(io.StringIO(' {"a": 1}, 2'), chunk_size=4)) == [{"a": 1}, 2]
+    with pytest.raises(HTTPException):
+        list(chat_export._iter_json_array(io.StringIO(' {"a": 1}, {"b": '), chunk_size=4))
@@ -0,0 +1,76 @@
+import asyncio
+import io
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+from app.core.config import settings
+from app.services import image_preprocess, near_duplicate
+
+
+def _chat_screenshot(seed: int, image_format: str = "PNG") -> bytes:
+    """1080x2340 的合成聊天截图: 气泡布局固定，只有文字由 seed 决定"""
+    rnd = random.Random(seed)
+    image = Image.new("RGB", (1080, 2340), (237, 237, 237))
+    draw = ImageDraw.Draw(image)
+    y = 200
+    for i in range(10):
+        left = i % 2 == 0
+        x0 = 150 if left else 380
+        draw.rounded_rectangle([x0, y, x0 + 550, y + 140], 20, fill=(255, 255, 255) if left else (149, 236, 105))
+        for j in range(rnd.randint(8, 14)):
+            # 用小方块模拟一个个字
+            x = x0 + 30 + j * 36
+            draw.rectangle([x, y + 50, x + 26, y + 50 + rnd.randint(20, 40)], fill=(0, 0, 0))
+        y += 200
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **({"quality": 85} if image_format == "JPEG" else {}))
+    return buffer.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def _near_duplicate_settings(monkeypatch):
+    monkeypatch.setattr(settings, "NEAR_DUPLICATE_ENABLED", True)
+    # 让任意两张截图的 dHash 都算 "足够接近"，只靠逐像素比较区分 (模拟布局相同、dHash 只差几位的情况)
+    monkeypatch.setattr(settings, "NEAR_DUPLICATE_MAX_DISTANCE", 256)
+    monkeypatch.setattr(settings, "NEAR_DUPLICATE_SKIP_MAX_DISTANCE", 256)
+    yield
+    image_preprocess.shutdown_executor()
+
+
+def _filter(images, force=False):
+    uploads = [(index, f"{index:064x}", image_bytes) for index, image_bytes in enumerate(images)]
+    return asyncio.run(near_duplicate.filter_near_duplicates("prof_missing", uploads, force))
+
+
+def test_pixel_difference_separates_text_from_recompression():
+    original = _chat_screenshot(1)
+    assert image_preprocess._pixel_difference(original, _chat_screenshot(1, "JPEG"), 256) <= settings.NEAR_DUPLICATE_MAX_PIXEL_DIFF
+    assert image_preprocess._pixel_difference(original, _chat_screenshot(2), 256) > settings.NEAR_DUPLICATE_MAX_PIXEL_DIFF
+
+
+def test_reports_without_skipping_by_default(monkeypatch):
+    monkeypatch.setattr(settings, "NEAR_DUPLICATE_SKIP", False)
+    kept, near_duplicates = _filter([_chat_screenshot(1), _chat_screenshot(1, "JPEG")])
+    assert len(kept) == 2
+    assert [item.skipped for item in near_duplicates] == [False]
+
+
+def test_same_layout_different_conversation_is_not_skipped(monkeypatch):
+    monkeypatch.setattr(settings, "NEAR_DUPLICATE_SKIP", True)
+    kept, near_duplicates = _filter([_chat_screenshot(1), _chat_screenshot(2)])
+    assert len(kept) == 2
+    assert len(near_duplicates) == 1
+    assert not near_duplicates[0].skipped
+    assert near_duplicates[0].pixel_difference > settings.NEAR_DUPLICATE_MAX_PIXEL_DIFF
+
+
+def test_recompressed_copy_is_skipped_when_enabled(monkeypatch):
+    monkeypatch.setattr(settings, "NEAR_DUPLICATE_SKIP", True)
+    kept, near_duplicates = _filter([_chat_screenshot(1), _chat_screenshot(1, "JPEG")])
+    assert [index for index, _, _ in kept] == [0]
+    assert near_duplicates[0].skipped and near_duplicates[0].duplicate_of == f"{0:064x}"
+
+    kept, near_duplicates = _filter([_chat_screenshot(1), _chat_screenshot(1, "JPEG")], force=True)
+    assert len(kept) == 2 and not near_duplicates[0].skipped
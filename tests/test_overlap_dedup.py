@@ -0,0 +1,68 @@
+import datetime
+
+from app.core.models import Message
+from app.services.overlap_dedup import find_overlap, normalize_text, stitch_tiles
+
+T0 = datetime.datetime(2024, 3, 1, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+def _msg(text, minute=0, sender="User 2", auto_time=False, editable=False):
+    return Message(timestamp=T0 + datetime.timedelta(minutes=minute), sender=sender, content_type="text", text=text,
+                   auto_filled_time=auto_time, is_editable=editable)
+
+
+def _texts(messages):
+    return [m.text for m in messages]
+
+
+def test_normalize_text_ignores_width_case_and_punctuation():
+    assert normalize_text("ＯＫ， 好的！") == normalize_text("ok好的")
+    assert normalize_text("？？") == "??"
+    assert normalize_text(None) == ""
+
+
+def test_find_overlap():
+    previous = [_msg("a", 0), _msg("b", 1), _msg("c", 2)]
+    assert find_overlap(previous, [_msg("b", 1), _msg("c", 2), _msg("d", 3)]) == 2
+    assert find_overlap(previous, [_msg("x", 5)]) == 0
+    assert find_overlap([], [_msg("a")]) == 0
+    # 只重叠一条时受 min_overlap 限制
+    assert find_overlap(previous, [_msg("c", 2), _msg("d", 3)], min_overlap=2) == 0
+
+
+def test_find_overlap_uses_sender_and_skips_editable_templates():
+    previous = [_msg("好", 0, sender="User 1")]
+    assert find_overlap(previous, [_msg("好", 0, sender="User 2")]) == 0
+    # 两张截图各自的失败模板文本相同，但不是同一条消息
+    assert find_overlap([_msg("VLM解析失败", 0, editable=True)], [_msg("VLM解析失败", 0, editable=True)]) == 0
+
+
+def test_conflicting_times_fall_back_to_shorter_overlap():
+    # "好 好" 与 "好 好" 按指纹可以重叠两条，但时间只对得上一条
+    previous = [_msg("好", 0), _msg("好", 5)]
+    current = [_msg("好", 5), _msg("好", 6)]
+    assert find_overlap(previous, current) == 1
+    # 自动填充的时间不参与校验
+    current = [_msg("好", 9, auto_time=True), _msg("好", 9, auto_time=True)]
+    assert find_overlap(previous, current) == 2
+
+
+def test_stitch_tiles_removes_repeated_bubbles():
+    tiles = [
+        [_msg("a", 0), _msg("b", 1), _msg("c", 2)],
+        [_msg("b", 1), _msg("c", 2), _msg("d", 3)],
+        [_msg("d", 3), _msg("e", 4)],
+    ]
+    assert _texts(stitch_tiles(tiles)) == ["a", "b", "c", "d", "e"]
+    assert _texts(stitch_tiles([[_msg("a")], [], [_msg("b")]])) == ["a", "b"]
+
+
+def test_stitch_tiles_drops_bubbles_cut_at_the_edge():
+    # 上一片末尾的气泡被切掉一半，下一片完整地识别出了它
+    first = [_msg("早上好", 0), _msg("今天开会", 1)]
+    second = [_msg("今天开会时间改到下午三点", 1), _msg("收到", 2)]
+    assert _texts(stitch_tiles([first, second])) == ["早上好", "今天开会时间改到下午三点", "收到"]
+    # 下一片开头只剩上一片最后一条的后半部分
+    second = [_msg("改到下午三点", 1), _msg("收到", 2)]
+    first = [_msg("早上好", 0), _msg("今天开会时间改到下午三点", 1)]
+    assert _texts(stitch_tiles([first, second])) == ["早上好", "今天开会时间改到下午三点", "收到"]
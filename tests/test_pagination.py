@@ -0,0 +1,86 @@
+import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.models import Message, Profile
+from app.services import profile_service
+from app.services.storage_backend import LOCAL_TZ, page_sorted_items
+
+UTC = datetime.timezone.utc
+T0 = datetime.datetime(2024, 3, 1, 12, 0, tzinfo=UTC)
+
+
+@pytest.mark.parametrize("timestamp", [
+    T0,
+    T0.replace(microsecond=123456),
+    datetime.datetime(2024, 3, 1, 20, 0, 0, 1, tzinfo=LOCAL_TZ),
+    datetime.datetime(1969, 12, 31, 23, 59, 59, tzinfo=UTC),
+])
+def test_cursor_round_trip(timestamp):
+    cursor = profile_service._encode_cursor(timestamp, "msg_a:b")
+    decoded_ts, decoded_id = profile_service._decode_cursor(cursor)
+    assert decoded_ts == timestamp
+    assert decoded_ts.tzinfo is not None
+    assert decoded_id == "msg_a:b"
+
+
+@pytest.mark.parametrize("cursor", ["", "abc", "12x:msg_1", "99999999999999999999999:msg_1"])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as excinfo:
+        profile_service._decode_cursor(cursor)
+    assert excinfo.value.status_code == 400
+
+
+def _items(count, same_timestamp_every=3):
+    """每 same_timestamp_every 条共用一个时间戳，id 在同一时间戳内有序"""
+    return [
+        Message(message_id=f"msg_{i:03d}", timestamp=T0 + datetime.timedelta(seconds=i // same_timestamp_every),
+                sender="User 1", content_type="text", text=str(i))
+        for i in range(count)
+    ]
+
+
+def _walk(items, limit, forward):
+    collected, cursor = [], None
+    while True:
+        page, has_more = page_sorted_items(items, "message_id", cursor, limit, forward)
+        collected.extend(page if forward else reversed(page))
+        if not has_more:
+            return collected
+        edge = page[-1] if forward else page[0]
+        cursor = (edge.timestamp, edge.message_id)
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 4, 100])
+def test_paging_with_equal_timestamps_visits_every_item_once(limit):
+    items = _items(10)
+    assert _walk(items, limit, True) == items
+    assert _walk(items, limit, False) == items[::-1]
+
+
+def test_cursor_of_deleted_item_skips_its_timestamp():
+    items = _items(9)
+    cursor = (items[4].timestamp, "msg_gone")  # 与 msg_003..005 同一时间戳
+    assert [m.message_id for m in page_sorted_items(items, "message_id", cursor, 2, True)[0]] == ["msg_006", "msg_007"]
+    assert [m.message_id for m in page_sorted_items(items, "message_id", cursor, 2, False)[0]] == ["msg_001", "msg_002"]
+
+
+def test_message_page_through_profile_service():
+    profile = Profile(profile_name="老板", opponent_name="老板")
+    profile_service.save_profile(profile)
+    messages = _items(7, same_timestamp_every=7)
+    profile_service.append_messages(profile.profile_id, messages)
+
+    seen, cursor = [], None
+    while True:
+        page = profile_service.get_message_page(profile.profile_id, cursor, limit=3, direction="backward")
+        seen = [m.message_id for m in page.items] + seen
+        if not page.has_more:
+            break
+        cursor = page.next_cursor
+    assert seen == [m.message_id for m in messages]
+
+    with pytest.raises(HTTPException) as excinfo:
+        profile_service.get_message_page(profile.profile_id, direction="sideways")
+    assert excinfo.value.status_code == 400
@@ -0,0 +1,106 @@
+import threading
+
+from app.core.models import Message, Profile
+from app.services import profile_service
+from app.services.profile_cache import VersionedLRUCache
+from app.services.storage_backend import get_storage
+
+
+class _Loader:
+    def __init__(self, value="v"):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return f"{self.value}{self.calls}"
+
+
+def test_hit_until_invalidated():
+    cache, loader = VersionedLRUCache(8), _Loader()
+    assert cache.get_or_load("profile", "p1", loader) == "v1"
+    assert cache.get_or_load("profile", "p1", loader) == "v1"
+    cache.invalidate("p1")
+    assert cache.peek("profile", "p1") is None
+    assert cache.get_or_load("profile", "p1", loader) == "v2"
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_invalidate_only_affects_that_profile():
+    cache = VersionedLRUCache(8)
+    cache.get_or_load("profile", "p1", _Loader("a"))
+    cache.get_or_load("events", "p1", _Loader("b"))
+    cache.get_or_load("profile", "p2", _Loader("c"))
+    cache.invalidate("p1")
+    assert cache.peek("events", "p1") is None
+    assert cache.peek("profile", "p2") == "c1"
+
+
+def test_changed_stamp_reloads():
+    cache, loader = VersionedLRUCache(8), _Loader()
+    assert cache.get_or_load("profile", "p1", loader, stamp=(1, 10)) == "v1"
+    assert cache.get_or_load("profile", "p1", loader, stamp=(1, 10)) == "v1"
+    assert cache.get_or_load("profile", "p1", loader, stamp=(2, 12)) == "v2"
+    assert cache.peek("profile", "p1", stamp=(1, 10)) is None
+
+
+def test_write_during_load_is_not_cached():
+    cache = VersionedLRUCache(8)
+    loading, invalidated = threading.Event(), threading.Event()
+
+    def slow_loader():
+        loading.set()
+        invalidated.wait(5)
+        return "stale"
+
+    worker = threading.Thread(target=lambda: cache.get_or_load("profile", "p1", slow_loader))
+    worker.start()
+    loading.wait(5)
+    cache.invalidate("p1")  # 加载期间发生了写入
+    invalidated.set()
+    worker.join(5)
+    assert cache.peek("profile", "p1") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = VersionedLRUCache(2)
+    cache.get_or_load("profile", "p1", _Loader("a"))
+    cache.get_or_load("profile", "p2", _Loader("b"))
+    cache.get_or_load("profile", "p1", _Loader("x"))  # p1 成为最近使用
+    cache.get_or_load("profile", "p3", _Loader("c"))
+    assert cache.peek("profile", "p2") is None
+    assert cache.peek("profile", "p1") == "a1"
+    assert cache.evictions == 1
+
+
+def test_put_and_disabled_cache():
+    cache = VersionedLRUCache(8)
+    cache.put("profile", "p1", "fresh")
+    assert cache.peek("profile", "p1") == "fresh"
+    disabled, loader = VersionedLRUCache(0), _Loader()
+    disabled.get_or_load("profile", "p1", loader)
+    disabled.get_or_load("profile", "p1", loader)
+    assert loader.calls == 2
+
+
+def test_profile_service_sees_saves_and_appends():
+    profile = Profile(profile_name="老板", opponent_name="老板")
+    profile_service.save_profile(profile)
+    assert profile_service.get_profile(profile.profile_id).profile_name == "老板"
+
+    profile_service.save_profile(profile.model_copy(update={"profile_name": "新名字"}))
+    assert profile_service.get_profile(profile.profile_id).profile_name == "新名字"
+
+    message = Message(timestamp="2024-03-01T12:00:00+00:00", sender="User 1", content_type="text", text="在吗")
+    profile_service.append_messages(profile.profile_id, [message])
+    assert [m.text for m in profile_service.get_profile(profile.profile_id).messages] == ["在吗"]
+
+
+def test_profile_service_sees_changes_made_outside_the_process():
+    profile = Profile(profile_name="老板", opponent_name="老板")
+    profile_service.save_profile(profile)
+    profile_service.get_profile(profile.profile_id)
+
+    # 绕过 profile_service 直接写存储 (相当于另一个进程)，版本号不变，只能靠文件 stamp 发现
+    get_storage().save_profile(profile.model_copy(update={"profile_name": "外部修改", "messages": []}))
+    assert profile_service.get_profile(profile.profile_id).profile_name == "外部修改"
@@ -0,0 +1,244 @@
+"""两个存储后端 (JSON 文件 / SQLite) 共用的行为测试，以及 JSON -> SQLite 的迁移"""
+import datetime
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app.core.models import ContextualInsight, Event, Message, Profile, UserPersona
+from app.services.json_storage import JsonStorageBackend
+from app.services.sqlite_storage import SqliteStorageBackend, migrate_json_to_sqlite
+from app.services.storage_backend import to_local_date
+
+UTC = datetime.timezone.utc
+T0 = datetime.datetime(2024, 3, 1, 12, 0, tzinfo=UTC)
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _message(index: int, timestamp: datetime.datetime) -> Message:
+    return Message(message_id=f"msg_{index:04d}", timestamp=timestamp, sender="User 1" if index % 2 else "User 2",
+                   content_type="text", text=f"m{index}")
+
+
+def _messages():
+    """跨度超过按天分批读取的一批 (7 天)，每天有几条时间戳完全相同的消息"""
+    messages = []
+    for day in (0, 1, 9, 20):
+        for i in range(5):
+            index = len(messages)
+            messages.append(_message(index, T0 + datetime.timedelta(days=day, minutes=0 if i < 3 else i)))
+    return messages
+
+
+def _make_backend(kind, tmp_path):
+    if kind == "json":
+        return JsonStorageBackend(str(tmp_path / "profiles"))
+    return SqliteStorageBackend(str(tmp_path / "chat_helper.db"))
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def backend(request, tmp_path):
+    storage = _make_backend(request.param, tmp_path)
+    yield storage
+    storage.close()
+
+
+@pytest.fixture
+def profile(backend):
+    profile = Profile(profile_name="老板", opponent_name="老板")
+    backend.save_profile(profile)
+    backend.append_messages(profile.profile_id, _messages())
+    return profile
+
+
+def _ids(items):
+    return [getattr(item, "message_id", None) or item.event_id for item in items]
+
+
+def _sorted_ids(items):
+    return _ids(sorted(items, key=lambda item: (item.timestamp, _ids([item])[0])))
+
+
+# --- Profile / 消息 ---
+
+def test_profile_round_trip(backend, profile):
+    loaded = backend.load_profile(profile.profile_id)
+    assert loaded.profile_name == "老板"
+    assert sorted(_ids(loaded.messages)) == sorted(_ids(_messages()))
+    assert backend.profile_exists(profile.profile_id)
+    assert profile.profile_id in backend.list_profile_ids()
+    assert not backend.profile_exists("prof_missing")
+    assert backend.load_profile("prof_missing") is None
+
+
+def test_append_messages_is_visible_to_all_readers(backend, profile):
+    extra = _message(99, T0 + datetime.timedelta(days=1, hours=1))
+    backend.append_messages(profile.profile_id, [extra])
+    day = to_local_date(extra.timestamp)
+    assert "msg_0099" in _ids(backend.load_messages_for_dates(profile.profile_id, [day]))
+    assert "msg_0099" in _ids(backend.load_profile(profile.profile_id).messages)
+    assert len(backend.load_messages_between(profile.profile_id)) == len(_messages()) + 1
+
+
+def test_message_dates_and_day_reads(backend, profile):
+    expected_dates = sorted({to_local_date(msg.timestamp) for msg in _messages()})
+    assert backend.list_message_dates(profile.profile_id) == expected_dates
+    day = expected_dates[1]
+    loaded = backend.load_messages_for_dates(profile.profile_id, [day])
+    assert sorted(_ids(loaded)) == sorted(_ids(m for m in _messages() if to_local_date(m.timestamp) == day))
+    assert backend.load_messages_for_dates(profile.profile_id, []) == []
+
+
+def test_messages_between_is_half_open_and_sorted(backend, profile):
+    start = T0 + datetime.timedelta(days=1)
+    end = T0 + datetime.timedelta(days=9)
+    loaded = backend.load_messages_between(profile.profile_id, start, end)
+    assert _ids(loaded) == _sorted_ids(m for m in _messages() if start <= m.timestamp < end)
+    assert len(backend.load_messages_between(profile.profile_id, start=end)) == 10
+
+
+@pytest.mark.parametrize("forward", [True, False])
+@pytest.mark.parametrize("limit", [1, 2, 4, 50])
+def test_message_pages_cover_every_message_once(backend, profile, forward, limit):
+    collected, cursor = [], None
+    for _ in range(100):
+        page, has_more = backend.load_page("messages", profile.profile_id, cursor, limit, forward)
+        assert len(page) <= limit
+        assert _ids(page) == _sorted_ids(page)
+        collected.extend(page if forward else reversed(page))
+        if not has_more:
+            break
+        edge = page[-1] if forward else page[0]
+        cursor = (edge.timestamp, edge.message_id)
+    expected = _sorted_ids(_messages())
+    assert _ids(collected) == (expected if forward else expected[::-1])
+
+
+def test_source_hashes(backend, profile):
+    backend.add_source_hashes(profile.profile_id, ["a" * 64, "b" * 64])
+    backend.add_source_hashes(profile.profile_id, ["b" * 64])
+    assert backend.load_source_hashes(profile.profile_id) == {"a" * 64, "b" * 64}
+
+
+# --- 事件 / 洞察 / 画像 ---
+
+def test_events_by_time_and_date(backend, profile):
+    events = [Event(event_id=f"evt_{i}", timestamp=T0 + datetime.timedelta(days=i % 3), summary=f"e{i}")
+              for i in range(6)]
+    backend.save_events(profile.profile_id, events)
+    backend.flush()
+    assert backend.list_event_dates(profile.profile_id) == sorted({to_local_date(e.timestamp) for e in events})
+    day = to_local_date(T0 + datetime.timedelta(days=1))
+    assert sorted(_ids(backend.load_events_for_dates(profile.profile_id, [day]))) == ["evt_1", "evt_4"]
+    between = backend.load_events_between(profile.profile_id, T0, T0 + datetime.timedelta(days=2))
+    assert _ids(between) == _sorted_ids(e for e in events if e.timestamp < T0 + datetime.timedelta(days=2))
+
+    page, has_more = backend.load_page("events", profile.profile_id, None, 4, False)
+    assert has_more and _ids(page) == _sorted_ids(events)[-4:]
+
+
+def test_search_insights(backend, profile):
+    insights = [
+        ContextualInsight(profile_id=profile.profile_id, analysis_date=datetime.date(2024, 3, day), summary=summary)
+        for day, summary in ((1, "讨论了 Project 进度"), (3, "项目 project 延期"), (2, "闲聊"))
+    ]
+    backend.save_insights(profile.profile_id, insights)
+    found = backend.search_insights(profile.profile_id, "PROJECT")
+    assert [i.analysis_date.day for i in found] == [3, 1]
+
+
+def test_user_persona_round_trip(backend, profile):
+    backend.save_user_persona(UserPersona(profile_id=profile.profile_id, self_summary="INTJ"))
+    backend.flush()
+    assert backend.load_user_persona(profile.profile_id).self_summary == "INTJ"
+    assert backend.load_opponent_persona(profile.profile_id) is None
+
+
+# --- 旧格式迁移 ---
+
+def _write_legacy_profile(data_path, messages) -> Profile:
+    """旧版本的主文件: 消息直接内联在 profile_{id}.json 中"""
+    profile = Profile(profile_name="旧档案", opponent_name="老板", messages=messages)
+    os.makedirs(data_path, exist_ok=True)
+    with open(os.path.join(data_path, f"profile_{profile.profile_id}.json"), "w", encoding="utf-8") as f:
+        json.dump(profile.model_dump(mode="json", exclude={"events"}), f, indent=4, ensure_ascii=False)
+    return profile
+
+
+def test_json_legacy_inline_messages_are_readable_then_migrated(tmp_path):
+    data_path = str(tmp_path / "profiles")
+    legacy = _write_legacy_profile(data_path, _messages())
+    profile_path = os.path.join(data_path, f"profile_{legacy.profile_id}.json")
+    with open(profile_path, "rb") as f:
+        original = f.read()
+
+    storage = JsonStorageBackend(data_path)
+    try:
+        # 迁移之前按天读取照常工作，且不改写主文件
+        day = to_local_date(T0)
+        assert sorted(_ids(storage.load_messages_for_dates(legacy.profile_id, [day]))) == \
+            sorted(_ids(m for m in _messages() if to_local_date(m.timestamp) == day))
+        assert len(storage.load_messages_between(legacy.profile_id)) == len(_messages())
+        with open(profile_path, "rb") as f:
+            assert f.read() == original
+
+        assert storage.migrate() == 1
+        with open(profile_path, encoding="utf-8") as f:
+            assert not json.load(f).get("messages")
+        storage.append_messages(legacy.profile_id, [_message(99, T0)])
+        assert len(storage.load_profile(legacy.profile_id).messages) == len(_messages()) + 1
+        assert len(storage.load_messages_for_dates(legacy.profile_id, [day])) == 6
+        assert storage.migrate() == 0
+    finally:
+        storage.close()
+
+
+def _populate_json(data_path) -> Profile:
+    storage = JsonStorageBackend(data_path)
+    try:
+        profile = Profile(profile_name="老板", opponent_name="老板")
+        storage.save_profile(profile)
+        storage.append_messages(profile.profile_id, _messages())
+        storage.save_events(profile.profile_id, [Event(event_id="evt_1", timestamp=T0, summary="开会")])
+        storage.save_insights(profile.profile_id, [
+            ContextualInsight(profile_id=profile.profile_id, analysis_date=T0.date(), summary="总结")
+        ])
+    finally:
+        storage.close()
+    return profile
+
+
+def _assert_migrated(db_path, profile_ids):
+    target = SqliteStorageBackend(db_path)
+    for profile_id in profile_ids:
+        assert sorted(_ids(target.load_profile(profile_id).messages)) == sorted(_ids(_messages()))
+        assert len(target.load_messages_between(profile_id)) == len(_messages())
+    return target
+
+
+def test_migrate_json_to_sqlite(tmp_path):
+    data_path, db_path = str(tmp_path / "profiles"), str(tmp_path / "chat_helper.db")
+    profile = _populate_json(data_path)
+    legacy = _write_legacy_profile(data_path, _messages())
+
+    assert migrate_json_to_sqlite(data_path, db_path) == 2
+    target = _assert_migrated(db_path, [profile.profile_id, legacy.profile_id])
+    assert _ids(target.load_events(profile.profile_id)) == ["evt_1"]
+    assert [i.summary for i in target.load_insights(profile.profile_id)] == ["总结"]
+
+    # 重复执行是安全的: 整体覆盖，不产生重复
+    assert migrate_json_to_sqlite(data_path, db_path) == 2
+    _assert_migrated(db_path, [profile.profile_id, legacy.profile_id])
+
+
+def test_migration_command(tmp_path):
+    data_path, db_path = str(tmp_path / "profiles"), str(tmp_path / "chat_helper.db")
+    profile = _populate_json(data_path)
+    env = dict(os.environ, DATA_PATH=data_path, SQLITE_PATH=db_path)
+    completed = subprocess.run([sys.executable, "-m", "app.services.sqlite_storage"], cwd=REPO_ROOT, env=env,
+                               capture_output=True, text=True, timeout=120)
+    assert completed.returncode == 0, completed.stderr
+    assert "Migration finished: 1 profiles" in completed.stdout
+    _assert_migrated(db_path, [profile.profile_id])